@@ -0,0 +1,75 @@
+"""
+Times prompt assembly on long conversations: the old fixed "last 10
+messages" query, a naive budget that tokenizes the whole history every
+turn, and chat.context.build_context (cold, then with cached token counts).
+
+    python bench_context.py [messages ...]
+"""
+import os
+import random
+import sys
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ollama_chat.settings")
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from chat.context import MESSAGE_OVERHEAD, build_context, context_budget, estimate_tokens, to_ollama
+from chat.models import Conversation, Message
+
+def last_ten(conversation, model):
+    recent = conversation.messages.order_by('-created_at')[:10]
+    return to_ollama(reversed(recent))
+
+def naive_budget(conversation, model):
+    budget = context_budget(model)
+    selected, used = [], 0
+    for msg in reversed(list(conversation.messages.order_by('created_at'))):
+        cost = estimate_tokens(msg.content) + MESSAGE_OVERHEAD
+        if selected and used + cost > budget:
+            break
+        selected.append(msg)
+        used += cost
+    return to_ollama(reversed(selected))
+
+def timed(build, conversation, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        context = build(conversation, 'llama3.1:8b')
+    return (time.perf_counter() - start) / repeat * 1000, len(context)
+
+def make_conversation(user, count, rng):
+    conversation = Conversation.objects.create(user=user, title=f"{count} messages")
+    Message.objects.bulk_create([
+        Message(
+            conversation=conversation,
+            role='user' if i % 2 == 0 else 'bot',
+            content="lorem ipsum " * rng.randint(5, 200),
+        )
+        for i in range(count)
+    ], batch_size=500)
+    return conversation
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username='bench')
+        rng = random.Random(1)
+        print(f"{'messages':>9} {'last 10':>9} {'naive':>9} {'cold':>9} {'warm':>9} {'sent':>5}")
+        for size in sizes:
+            conversation = make_conversation(user, size, rng)
+            old, _ = timed(last_ten, conversation)
+            naive, _ = timed(naive_budget, conversation, repeat=3)
+            cold, _ = timed(build_context, conversation, repeat=1)
+            warm, sent = timed(build_context, conversation)
+            print(f"{size:>9} {old:>7.2f}ms {naive:>7.2f}ms {cold:>7.2f}ms {warm:>7.2f}ms {sent:>5}")
+    finally:
+        connection.creation.destroy_test_db(':memory:', verbosity=0)
+
+if __name__ == "__main__":
+    main()
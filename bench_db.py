@@ -0,0 +1,140 @@
+"""
+Drives concurrent api_chat and get_messages traffic through the Django
+stack against a fake Ollama and reports throughput, latency and database
+errors ("database is locked") per database profile:
+
+    sqlite-default  SQLite without the tuning in settings.DATABASES
+    sqlite-tuned    SQLite as configured in settings (WAL, busy timeout, ...)
+    postgres        DB_ENGINE=postgres, see settings.py; skipped if the
+                    server or psycopg is not available
+
+    python bench_db.py [threads] [requests per thread]
+
+Each profile runs in its own process on a throwaway database.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROFILES = ["sqlite-default", "sqlite-tuned", "postgres"]
+
+def run_profile(profile, threads, requests):
+    import django
+
+    if profile == "postgres":
+        try:
+            import psycopg  # noqa: F401
+        except ImportError:
+            print(f"{profile:>15}  skipped: psycopg is not installed")
+            return
+        os.environ["DB_ENGINE"] = "postgres"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ollama_chat.settings")
+
+    from django.conf import settings
+
+    workdir = tempfile.mkdtemp()
+    if profile.startswith("sqlite"):
+        settings.DATABASES["default"]["NAME"] = os.path.join(workdir, "bench.sqlite3")
+        if profile == "sqlite-default":
+            settings.DATABASES["default"]["OPTIONS"] = {}
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    from fake_ollama import FakeOllama
+    from chat.services import OllamaService
+
+    setup_test_environment()
+    if profile == "postgres":
+        try:
+            old_name = connection.creation.create_test_db(verbosity=0)
+        except Exception as e:
+            print(f"{profile:>15}  skipped: {e.__class__.__name__}: {str(e).splitlines()[0]}")
+            return
+    else:
+        call_command("migrate", verbosity=0)
+
+    fake = FakeOllama(tokens=["lorem "] * 20, delay=0.005).start()
+    settings.OLLAMA_BASE_URL = fake.base_url
+    settings.OLLAMA_WORKERS = threads
+    settings.OLLAMA_QUEUE_SIZE = threads * 2
+    settings.OLLAMA_USER_QUEUE_SIZE = None
+    settings.OLLAMA_COALESCE = False
+
+    users = [User.objects.create_user(username=f"bench{i}", password="x") for i in range(threads)]
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client_loop(user):
+        client = Client()
+        client.force_login(user)
+        conversation_id = None
+        for i in range(requests):
+            data = {"prompt": f"Question {i}"}
+            if conversation_id:
+                data["conversation_id"] = conversation_id
+            start = time.perf_counter()
+            try:
+                response = client.post("/api/chat/", data=data, content_type="application/json")
+                if response.status_code != 200:
+                    raise Exception(f"api_chat answered {response.status_code}")
+                body = b"".join(response.streaming_content).decode("utf-8")
+                if '"error"' in body:
+                    raise Exception(body.strip().splitlines()[-1])
+                if conversation_id is None:
+                    conversation_id = int(body.split('"conversation_id": ')[1].split(",")[0])
+                response = client.get(f"/api/messages/{conversation_id}/")
+                if response.status_code != 200:
+                    raise Exception(f"get_messages answered {response.status_code}")
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=client_loop, args=(user,)) for user in users]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    OllamaService.reset()
+    fake.stop()
+    if profile == "postgres":
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    latencies.sort()
+    done = len(latencies)
+    p50 = latencies[done // 2] * 1000 if done else 0
+    p95 = latencies[min(done - 1, int(done * 0.95))] * 1000 if done else 0
+    locked = sum("locked" in e for e in errors)
+    print(f"{profile:>15} {done / elapsed:>8.1f}/s {p50:>8.1f}ms {p95:>8.1f}ms {len(errors):>7} {locked:>7}")
+    if errors:
+        print(f"{'':>15}  first error: {errors[0][:100]}")
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "--profile":
+        run_profile(args[1], int(args[2]), int(args[3]))
+        return
+
+    threads = int(args[0]) if args else 16
+    requests = int(args[1]) if len(args) > 1 else 10
+    print(f"{threads} clients x {requests} turns (api_chat + get_messages)")
+    print(f"{'profile':>15} {'turns':>10} {'p50':>10} {'p95':>10} {'errors':>7} {'locked':>7}")
+    for profile in PROFILES:
+        subprocess.run([sys.executable, __file__, "--profile", profile, str(threads), str(requests)], check=False)
+
+if __name__ == "__main__":
+    main()
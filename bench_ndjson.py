@@ -0,0 +1,58 @@
+"""
+Compares the incremental NDJSON decoder with the old `buffer += chunk` /
+`buffer.split(b"\\n", 1)` loop on multi-megabyte Ollama-style streams.
+
+    python bench_ndjson.py [megabytes]
+"""
+import json
+import sys
+import time
+
+from chat.ndjson import iter_ndjson
+
+def legacy_decode(chunks):
+    objects = []
+    buffer = b""
+    for chunk in chunks:
+        if chunk:
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if line:
+                    try:
+                        objects.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+    return objects
+
+def make_stream(megabytes):
+    line = json.dumps({
+        "model": "llama3.1:8b",
+        "created_at": "2024-01-01T00:00:00.000000Z",
+        "message": {"role": "assistant", "content": " token"},
+        "done": False,
+    }).encode('utf-8') + b"\n"
+    count = int(megabytes * 1024 * 1024 / len(line))
+    return line * count, count
+
+def timed(decode, chunks):
+    start = time.perf_counter()
+    objects = decode(chunks)
+    return time.perf_counter() - start, len(objects)
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    data, count = make_stream(megabytes)
+    print(f"{megabytes:g} MB, {count} lines")
+    print(f"{'chunk size':>12} {'legacy':>10} {'decoder':>10} {'speedup':>8}")
+
+    for size in (64, 1024, 16 * 1024, 256 * 1024, len(data)):
+        chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        legacy, legacy_count = timed(legacy_decode, chunks)
+        decoder, decoder_count = timed(lambda c: list(iter_ndjson(c)), chunks)
+        assert legacy_count == decoder_count == count
+        label = "whole" if size == len(data) else str(size)
+        print(f"{label:>12} {legacy:>9.3f}s {decoder:>9.3f}s {legacy / decoder:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
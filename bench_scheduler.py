@@ -0,0 +1,70 @@
+"""
+Simulates chat traffic against the job schedulers and reports queue wait
+times. One heavy user fires a burst of requests while many light users
+send one request each; with FIFO the light users wait behind the whole
+burst, with fair queuing they are interleaved with it.
+
+    python bench_scheduler.py [workers] [seed]
+"""
+import heapq
+import random
+import sys
+
+from chat.scheduler import FairScheduler, FIFOScheduler
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+def make_arrivals(rng, heavy_jobs=60, light_users=40, duration=300):
+    arrivals = []
+    # Heavy user: bursts of 10 requests every 30 seconds
+    for n in range(heavy_jobs):
+        arrivals.append((30 * (n // 10) + rng.random(), 'heavy', n))
+    for user in range(light_users):
+        arrivals.append((rng.uniform(0, duration), f"light-{user}", 0))
+    arrivals.sort()
+    return arrivals
+
+def simulate(scheduler, arrivals, workers, rng):
+    """Discrete-event run; returns {user kind: [wait seconds]}."""
+    service_times = {id(a): rng.expovariate(1 / 4.0) for a in arrivals}
+    events = [(t, 0, i) for i, (t, _, _) in enumerate(arrivals)]
+    heapq.heapify(events)
+    free = workers
+    waits = {'heavy': [], 'light': []}
+
+    while events:
+        now, kind, index = heapq.heappop(events)
+        if kind == 0:
+            arrived, user, n = arrivals[index]
+            scheduler.put({'user': user, 'n': n, 'arrived': arrived, 'index': index})
+        else:
+            free += 1
+
+        while free and len(scheduler):
+            job = scheduler.get()
+            free -= 1
+            waits['heavy' if job['user'] == 'heavy' else 'light'].append(now - job['arrived'])
+            duration = service_times[id(arrivals[job['index']])]
+            heapq.heappush(events, (now + duration, 1, job['index']))
+    return waits
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    arrivals = make_arrivals(random.Random(seed))
+
+    print(f"{len(arrivals)} requests, {workers} workers")
+    print(f"{'scheduler':>10} {'users':>6} {'p50':>8} {'p99':>8}")
+    for name, scheduler_class in (('fifo', FIFOScheduler), ('fair', FairScheduler)):
+        scheduler = scheduler_class(depth=len(arrivals))
+        waits = simulate(scheduler, arrivals, workers, random.Random(seed))
+        for kind in ('light', 'heavy'):
+            print(f"{name:>10} {kind:>6} {percentile(waits[kind], 50):>7.1f}s {percentile(waits[kind], 99):>7.1f}s")
+
+if __name__ == "__main__":
+    main()
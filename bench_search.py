@@ -0,0 +1,142 @@
+"""
+Compares message search through the full-text index (chat.search) with the
+icontains scans it replaces, on a generated history: users x conversations
+x messages of Zipf-distributed words, a million messages by default.
+
+    python bench_search.py [messages]
+
+The fixture is built once in a temporary SQLite file with plain SQL; the
+FTS table is filled the same way migration 0007 backfills it.
+"""
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ollama_chat.settings")
+from django.conf import settings
+
+workdir = tempfile.mkdtemp()
+settings.DATABASES["default"]["NAME"] = os.path.join(workdir, "bench.sqlite3")
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat import search
+from chat.models import Message
+
+USERS = 1000
+CONVERSATIONS_PER_USER = 10
+# User 1 owns this share of all conversations, the rest are spread evenly
+HEAVY_SHARE = 0.1
+
+def owner_of(conversation_id):
+    total = USERS * CONVERSATIONS_PER_USER
+    heavy = int(total * HEAVY_SHARE)
+    if conversation_id <= heavy:
+        return 1
+    return 2 + (conversation_id - heavy - 1) * (USERS - 1) // (total - heavy)
+
+def vocabulary(size, rng):
+    syllables = ["ka", "lo", "mi", "ren", "to", "sa", "vel", "qui", "dor", "pa", "zu", "nee", "bro", "ti", "gam"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    # Frequency rank independent of spelling, so common words don't share prefixes
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+def build(total, rng):
+    words = vocabulary(20000, rng)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    per_conversation = max(1, total // (USERS * CONVERSATIONS_PER_USER))
+    now = timezone.now().isoformat(" ")
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO auth_user (id, password, is_superuser, username, first_name, last_name, email,"
+            " is_staff, is_active, date_joined) VALUES (%s, '', 0, %s, '', '', '', 0, 1, %s)",
+            [(u, f"user{u}", now) for u in range(1, USERS + 1)],
+        )
+        cursor.executemany(
+            "INSERT INTO chat_conversation (id, user_id, title, summary, created_at, updated_at)"
+            " VALUES (%s, %s, %s, '', %s, %s)",
+            [(c, owner_of(c), f"Chat {c}", now, now)
+             for c in range(1, USERS * CONVERSATIONS_PER_USER + 1)],
+        )
+        batch = []
+        for c in range(1, USERS * CONVERSATIONS_PER_USER + 1):
+            for i in range(per_conversation):
+                content = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(8, 60)))
+                batch.append((c, "user" if i % 2 == 0 else "bot", content, now))
+            if len(batch) >= 50000:
+                cursor.executemany(
+                    "INSERT INTO chat_message (conversation_id, role, content, created_at) VALUES (%s, %s, %s, %s)",
+                    batch,
+                )
+                batch = []
+        if batch:
+            cursor.executemany(
+                "INSERT INTO chat_message (conversation_id, role, content, created_at) VALUES (%s, %s, %s, %s)",
+                batch,
+            )
+        cursor.execute(
+            f"INSERT INTO {search.FTS_TABLE} (rowid, body, owner) "
+            "SELECT m.id, m.content, 'u' || c.user_id FROM chat_message m "
+            "JOIN chat_conversation c ON c.id = m.conversation_id"
+        )
+    return words
+
+def timed(run, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = run()
+    return (time.perf_counter() - start) / repeat * 1000, len(result)
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(1)
+    call_command("migrate", verbosity=0)
+
+    start = time.perf_counter()
+    words = build(total, rng)
+    count = Message.objects.count()
+    print(f"{count} messages, {USERS} users, built in {time.perf_counter() - start:.0f}s")
+
+    cases = [
+        ("common word", words[0]),
+        ("mid word", words[500]),
+        ("rare word", words[10000]),
+        ("two words", f"{words[3]} {words[800]}"),
+        ("prefix", words[1200][:4] + "*"),
+    ]
+    print(f"{'query':>12} | {'typical user':^22} | {'heavy user':^22} | {'admin (all users)':^22}")
+    for label, text in cases:
+        row = f"{label:>12}"
+        for user_id in (USERS // 2, 1):
+            scan, _ = timed(lambda: list(
+                Message.objects.filter(conversation__user_id=user_id, content__icontains=text)
+                .select_related('conversation').order_by('-created_at')[:20]
+            ), repeat=2)
+            indexed, hits = timed(lambda: search.search_messages(text, user_id, 20))
+            row += f" | {scan:>7.1f} -> {indexed:>6.1f}ms {hits:>3}"
+        admin_scan, _ = timed(lambda: list(Message.objects.filter(content__icontains=text).order_by('-id')[:100]), repeat=1)
+        admin_indexed, _ = timed(lambda: list(
+            search.filter_messages(Message.objects.all(), text).order_by('-id')[:100]
+        ), repeat=2)
+        print(f"{row} | {admin_scan:>7.1f} -> {admin_indexed:>6.1f}ms")
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        connection.close()
+        shutil.rmtree(workdir, ignore_errors=True)
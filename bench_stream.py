@@ -0,0 +1,94 @@
+"""
+Measures what merging streamed tokens into frames (chat.coalesce) saves:
+concurrent chats run through OllamaService against a fake Ollama server,
+each written to a socket one NDJSON line per frame, the way api_chat sends
+them, for a few OLLAMA_STREAM_FLUSH_INTERVAL values (0 is token by token).
+
+    python bench_stream.py [tokens] [streams] [tokens per second]
+
+Reports the writes per stream, the median time to the first frame and the
+CPU time the process spent per stream. The fake server runs in the same
+process, so its share of the CPU time is the same in every row.
+"""
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ollama_chat.settings")
+django.setup()
+
+from django.test.utils import override_settings
+
+from fake_ollama import FakeOllama
+from chat.services import OllamaService
+
+def drain(sock):
+    while sock.recv(65536):
+        pass
+
+def stream(service, index, results):
+    """One chat, written frame by frame to a socket; records (writes, first frame seconds)."""
+    sender, receiver = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(receiver,))
+    reader.start()
+    started = time.monotonic()
+    first = None
+    writes = 0
+    messages = [{'role': 'user', 'content': f"Question {index}"}]
+    for chunk in service.process_chat(messages, model="bench"):
+        if not isinstance(chunk, str):
+            continue
+        if first is None:
+            first = time.monotonic() - started
+        sender.sendall((json.dumps({'content': chunk}) + "\n").encode('utf-8'))
+        writes += 1
+    sender.close()
+    reader.join()
+    receiver.close()
+    results.append((writes, first))
+
+def run(fake, interval, streams):
+    overrides = dict(
+        OLLAMA_BASE_URL=fake.base_url, OLLAMA_WORKERS=streams, OLLAMA_QUEUE_SIZE=streams,
+        OLLAMA_USER_QUEUE_SIZE=None, OLLAMA_COALESCE=False, OLLAMA_RESPONSE_CACHE=False, OLLAMA_HEALTH_INTERVAL=0,
+        OLLAMA_STREAM_FLUSH_INTERVAL=interval,
+    )
+    with override_settings(**overrides):
+        OllamaService.reset()
+        service = OllamaService()
+        results = []
+        threads = [threading.Thread(target=stream, args=(service, i, results)) for i in range(streams)]
+        cpu = time.process_time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cpu = time.process_time() - cpu
+        OllamaService.reset()
+    writes = statistics.mean(w for w, _ in results)
+    first = statistics.median(f for _, f in results)
+    return writes, first, cpu / streams
+
+def main():
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 500
+
+    fake = FakeOllama(tokens=[" tok"] * tokens, delay=1 / rate, models=("bench",)).start()
+    print(f"{streams} streams of {tokens} tokens at {rate:g} tokens/s")
+    print(f"{'interval':>9} {'writes':>8} {'first frame':>12} {'CPU/stream':>11}")
+    try:
+        for interval in (0, 0.02, 0.05):
+            writes, first, cpu = run(fake, interval, streams)
+            print(f"{interval * 1000:>7g}ms {writes:>8.0f} {first * 1000:>10.1f}ms {cpu * 1000:>9.1f}ms")
+    finally:
+        fake.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,18 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import Conversation, Message, UserLoginLog
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+from .models import Conversation, LoginDailyRollup, Message, UserLoginLog
+from .pagination import InvalidCursor, KeysetPaginator
+from . import search
+
+# Messages shown by the conversation chat visual, and loaded per "load more"
+CHAT_VISUAL_PAGE = 50
 
 # Unregister the provided model admin
 admin.site.unregister(User)
@@ -23,47 +34,97 @@ class UserLoginLogInline(admin.TabularInline):
 class CustomUserAdmin(UserAdmin):
     inlines = [ConversationInline, UserLoginLogInline]
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'conversation_count')
-    
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(conversation_count=Count('conversations'))
+
+    @admin.display(description='Conversations', ordering='conversation_count')
     def conversation_count(self, obj):
-        return obj.conversations.count()
-    conversation_count.short_description = 'Conversations'
+        return obj.conversation_count
 
-from django.utils.html import format_html
+def chat_bubbles(messages):
+    return format_html_join(
+        '',
+        '<div style="display: flex; justify-content: {}; margin-bottom: 10px;">'
+        '<div style="background-color: {}; color: white; padding: 10px; border-radius: 10px; max-width: 80%; white-space: pre-wrap;">'
+        '<strong>{}:</strong><br>{}</div></div>',
+        (
+            ('right', '#10a37f', m.role.title(), m.content) if m.role == 'user'
+            else ('left', '#444654', m.role.title(), m.content)
+            for m in messages
+        ),
+    )
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'title', 'created_at', 'updated_at')
+    list_display = ('id', 'user', 'title', 'message_count', 'created_at', 'updated_at')
+    list_select_related = ('user',)
     list_filter = ('created_at', 'updated_at')
     search_fields = ('title', 'user__username')
     date_hierarchy = 'created_at'
-    readonly_fields = ('chat_visual',)
+    readonly_fields = ('chat_visual', 'created_at', 'updated_at')
     fields = ('user', 'title', 'chat_visual', 'created_at', 'updated_at')
 
+    class Media:
+        js = ('js/admin_chat.js',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(message_count=Count('messages'))
+
+    def get_urls(self):
+        return [
+            path('<int:object_id>/messages/', self.admin_site.admin_view(self.messages_view),
+                 name='chat_conversation_messages'),
+        ] + super().get_urls()
+
+    @admin.display(description='Messages', ordering='message_count')
+    def message_count(self, obj):
+        return obj.message_count
+
+    def message_page(self, conversation_id, before=None):
+        messages = Message.objects.filter(conversation_id=conversation_id).only('id', 'role', 'content', 'created_at')
+        rows, prev, _ = KeysetPaginator(messages, ('created_at', 'id')).page(CHAT_VISUAL_PAGE, before=before, tail=True)
+        return rows, prev
+
+    @admin.display(description='Chat History')
     def chat_visual(self, obj):
-        html = '<div style="max-width: 600px; font-family: sans-serif;">'
-        for msg in obj.messages.all().order_by('created_at'):
-            is_user = msg.role == 'user'
-            align = 'right' if is_user else 'left'
-            bg = '#10a37f' if is_user else '#444654'
-            color = 'white'
-            
-            html += f'''
-            <div style="display: flex; justify-content: {align}; margin-bottom: 10px;">
-                <div style="background-color: {bg}; color: {color}; padding: 10px; border-radius: 10px; max-width: 80%;">
-                    <strong>{msg.role.title()}:</strong> <br>
-                    {msg.content}
-                </div>
-            </div>
-            '''
-        html += '</div>'
-        return format_html(html)
-    chat_visual.short_description = "Chat History"
+        # The latest page; earlier ones are fetched from messages_view
+        if obj.pk is None:
+            return '-'
+        rows, prev = self.message_page(obj.pk)
+        more = format_html(
+            '<button type="button" class="button chat-visual-more" data-before="{}">Load earlier messages</button>',
+            prev,
+        ) if prev else ''
+        return format_html(
+            '<div class="chat-visual" data-url="{}" style="max-width: 600px; font-family: sans-serif;">{}'
+            '<div class="chat-visual-messages">{}</div></div>',
+            reverse('admin:chat_conversation_messages', args=[obj.pk]), more, chat_bubbles(rows),
+        )
+
+    def messages_view(self, request, object_id):
+        conversation = get_object_or_404(Conversation, pk=object_id)
+        if not self.has_view_permission(request, conversation):
+            raise PermissionDenied
+        try:
+            rows, prev = self.message_page(conversation.pk, before=request.GET.get('before'))
+        except InvalidCursor:
+            raise Http404
+        return JsonResponse({'html': chat_bubbles(rows), 'before': prev})
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'conversation', 'role', 'short_content', 'created_at')
+    list_select_related = ('conversation__user',)
     list_filter = ('role', 'created_at')
-    search_fields = ('content', 'conversation__title', 'conversation__user__username')
+    # Content is searched through the full-text index instead, see get_search_results
+    search_fields = ('conversation__title', 'conversation__user__username')
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results = results | search.filter_messages(queryset, search_term)
+        return results, may_have_duplicates
     
     def short_content(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
@@ -72,6 +133,17 @@ class MessageAdmin(admin.ModelAdmin):
 @admin.register(UserLoginLog)
 class UserLoginLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'ip_address', 'timestamp')
+    list_select_related = ('user',)
     list_filter = ('timestamp',)
     search_fields = ('user__username', 'ip_address')
     readonly_fields = ('user', 'ip_address', 'user_agent', 'timestamp')
+    # Skip the unfiltered COUNT(*) over the whole log next to filtered results
+    show_full_result_count = False
+
+@admin.register(LoginDailyRollup)
+class LoginDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'user', 'logins', 'ip_addresses', 'first_login', 'last_login')
+    list_select_related = ('user',)
+    list_filter = ('date',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'date', 'logins', 'ip_addresses', 'first_login', 'last_login')
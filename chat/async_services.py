@@ -0,0 +1,398 @@
+import asyncio
+import queue
+import time
+from contextlib import aclosing
+import weakref
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .backends import BackendPool
+from .cache import cacheable_key, get_response_cache
+from .coalesce import Coalescer, acoalesce, merged
+from .deadlines import Deadlines
+from .ndjson import aiter_ndjson
+from .residency import ResidencyManager
+from .scheduler import build_scheduler
+from .services import build_chat_payload
+from . import metrics
+from .transport import get_timeout
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+if httpx is not None:
+    class ConnectRetryTransport(httpx.AsyncBaseTransport):
+        """
+        httpx transport retrying failed connects `retries` times, sleeping
+        `backoff` seconds before the first retry and doubling it after each,
+        like chat.transport's Retry. httpx's own `retries` retries at once.
+        A request that failed to connect never reached Ollama, so retrying
+        it is safe even for POST; other errors are raised as-is.
+        """
+
+        def __init__(self, retries=3, backoff=0.2, **kwargs):
+            self.retries = retries
+            self.backoff = backoff
+            self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+        async def handle_async_request(self, request):
+            for attempt in range(self.retries + 1):
+                try:
+                    return await self._transport.handle_async_request(request)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt == self.retries:
+                        raise
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+
+        async def aclose(self):
+            await self._transport.aclose()
+
+class AsyncOllamaService:
+    """
+    asyncio counterpart of OllamaService for ASGI deployments.
+
+    Every generation is a coroutine reading an httpx stream, so one event
+    loop can hold many open token streams without a thread per connection.
+    Admission mirrors the threaded service: requests wait in the same kind
+    of scheduler (OLLAMA_SCHEDULER, with its priorities and per-user depth),
+    OLLAMA_WORKERS generations run at once and OLLAMA_MODEL_CONCURRENCY caps
+    each model. There are no worker tasks; a request is started straight
+    from the queue whenever a slot frees up.
+
+    There is one instance per event loop, since httpx clients are bound to
+    the loop they were created on. Requests are spread over the Ollama hosts
+    like the threaded service's (see chat.backends); this pool learns host
+    health from the requests themselves and runs no health checks. Its
+    ResidencyManager only picks keep_alive; preloading and unloading are
+    left to the threaded service.
+    """
+    _instances = weakref.WeakKeyDictionary()
+
+    def __new__(cls, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        instance = cls._instances.get(loop)
+        if instance is None:
+            instance = super(AsyncOllamaService, cls).__new__(cls)
+            instance._initialized = False
+            cls._instances[loop] = instance
+        return instance
+
+    @classmethod
+    async def reset(cls):
+        instance = cls._instances.pop(asyncio.get_running_loop(), None)
+        if instance is not None and instance._initialized:
+            await instance.aclose()
+
+    def __init__(self):
+        if self._initialized:
+            return
+        if httpx is None:
+            raise ImproperlyConfigured("AsyncOllamaService requires the 'httpx' package.")
+
+        self.pool = BackendPool.from_settings()
+        self.base_url = self.pool.backends[0].url
+        self.residency = ResidencyManager.from_settings(self.pool)
+        self.model_limits = dict(getattr(settings, 'OLLAMA_MODEL_CONCURRENCY', {}))
+        self.client = self._build_client()
+        # Per-host counters kept from httpcore trace events (see _tracer)
+        self._connection_stats = defaultdict(lambda: {'connections': 0, 'requests': 0})
+        self.scheduler = build_scheduler()
+        self.workers = max(1, getattr(settings, 'OLLAMA_WORKERS', 1))
+        self.running = 0
+        self.active = defaultdict(int)
+        # Moving average of generation time, for queue ETAs
+        self.avg_duration = None
+        self._initialized = True
+
+    def _build_client(self):
+        # Same pool size, timeouts and connect retries with backoff as the
+        # threaded service's requests.Session (see chat.transport).
+        self.pool_size = getattr(settings, 'OLLAMA_POOL_SIZE', 10)
+        connect, read = get_timeout()
+        transport = ConnectRetryTransport(
+            retries=getattr(settings, 'OLLAMA_RETRIES', 3),
+            backoff=getattr(settings, 'OLLAMA_RETRY_BACKOFF', 0.2),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.pool_size),
+        )
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect, pool=None),
+            transport=transport,
+        )
+
+    def pool_stats(self):
+        """
+        Per-host counters like chat.transport.pool_stats: connections opened
+        and requests sent over them, for each Ollama host used so far.
+        """
+        return {url: dict(stats, maxsize=self.pool_size) for url, stats in self._connection_stats.items()}
+
+    def _tracer(self, url):
+        """httpcore "trace" extension counting the connections and requests to `url`."""
+        stats = self._connection_stats[url]
+
+        async def trace(event, info):
+            if event.endswith('.connect_tcp.complete'):
+                stats['connections'] += 1
+            elif event.endswith('.send_request_headers.started'):
+                stats['requests'] += 1
+        return trace
+
+    async def aclose(self):
+        self.pool.close()
+        await self.client.aclose()
+
+    @asynccontextmanager
+    async def _post(self, model, path, payload):
+        """Streaming counterpart of OllamaService._post."""
+        tried = []
+        connected = False
+        while True:
+            with self.pool.acquire(model, exclude=tried) as backend:
+                tried.append(backend)
+                last = self.pool.choose(model, exclude=tried) is None
+                try:
+                    async with self.client.stream("POST", f"{backend.url}{path}", json=payload,
+                                                  extensions={'trace': self._tracer(backend.url)}) as response:
+                        connected = True
+                        if response.status_code >= 500:
+                            self.pool.record_failure(backend)
+                            if not last:
+                                connected = False
+                                continue
+                        yield backend, response
+                        return
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if connected:
+                        raise
+                    self.pool.record_failure(backend)
+                    if last:
+                        raise
+
+    def model_limit(self, model):
+        return self.model_limits.get(model, self.model_limits.get('*'))
+
+    def pending(self):
+        """Number of accepted requests that have not started yet."""
+        return len(self.scheduler)
+
+    def queue_status(self, job):
+        """Same as OllamaService.queue_status."""
+        position = self.scheduler.position(job)
+        if position is None:
+            return None
+        eta = None
+        if self.avg_duration is not None:
+            rounds = (position - 1) // self.workers + 1
+            eta = round(rounds * self.avg_duration, 1)
+        return {'position': position, 'eta': eta}
+
+    def process_chat(self, messages, model="llama3.1:8b", user=None, priority='default', options=None):
+        """
+        Queues the request and returns an AsyncChatStream yielding response
+        chunks, and {'queue': {...}} status dicts while it waits for a slot.
+        `user` and `priority` are passed to the scheduler as with
+        OllamaService.process_chat. Raises queue.Full if too many are waiting.
+        """
+        key = cacheable_key(model, messages, options)
+        if key is not None:
+            cached = get_response_cache().get(key)
+            if cached is not None:
+                metrics.REQUESTS.inc(model=model, outcome='cached')
+                return _replay(cached)
+
+        queued_at = time.monotonic()
+        job = {
+            'model': model,
+            'user': user,
+            'priority': priority,
+            'queued_at': queued_at,
+            'deadlines': Deadlines(model, queued_at),
+            # Resolved when the request gets its slot
+            'admitted': asyncio.get_running_loop().create_future(),
+        }
+        metrics.QUEUE_DEPTH.inc(model=model)
+        try:
+            self.scheduler.put(job)
+        except queue.Full:
+            metrics.QUEUE_DEPTH.dec(model=model)
+            raise
+        self._dispatch()
+        return AsyncChatStream(self, job, self._stream(messages, job, options, key))
+
+    def _eligible(self, job):
+        limit = self.model_limit(job['model'])
+        return limit is None or self.active[job['model']] < limit
+
+    def _dispatch(self):
+        """Starts queued requests, in the scheduler's order, while slots are free."""
+        while self.running < self.workers:
+            job = self.scheduler.get_nowait(self._eligible)
+            if job is None:
+                return
+            model = job['model']
+            self.running += 1
+            self.active[model] += 1
+            metrics.QUEUE_DEPTH.dec(model=model)
+            metrics.QUEUE_WAIT.observe(time.monotonic() - job['queued_at'], model=model)
+            metrics.ACTIVE.inc(model=model)
+            job['admitted'].set_result(None)
+
+    def _release(self, model, duration=None):
+        self.running -= 1
+        self.active[model] -= 1
+        metrics.ACTIVE.dec(model=model)
+        if duration is not None:
+            if self.avg_duration is None:
+                self.avg_duration = duration
+            else:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self._dispatch()
+
+    def _withdraw(self, job, outcome):
+        """Takes back a request that won't run: its queue place, or the slot it was just given."""
+        if self.scheduler.remove(job):
+            metrics.QUEUE_DEPTH.dec(model=job['model'])
+        else:
+            self._release(job['model'])
+        metrics.REQUESTS.inc(model=job['model'], outcome=outcome)
+
+    async def _wait(self, job):
+        """Waits for the request's slot, yielding queue status dicts as they change."""
+        interval = getattr(settings, 'OLLAMA_QUEUE_STATUS_INTERVAL', 1.0)
+        timeout = min(interval, 0.1)
+        last_status = None
+        deadlines = job['deadlines']
+        while not job['admitted'].done():
+            stage, remaining = deadlines.next(started=False, streaming=False)
+            if remaining is not None and remaining <= 0:
+                raise deadlines.exceeded(stage)
+            try:
+                # shield(): a timeout must not cancel the admission itself
+                async with asyncio.timeout(timeout if remaining is None else min(timeout, remaining)):
+                    await asyncio.shield(job['admitted'])
+            except TimeoutError:
+                status = self.queue_status(job)
+                if status is not None and status != last_status:
+                    last_status = status
+                    yield {'queue': status}
+                timeout = interval
+
+    async def _stream(self, messages, job, options, key):
+        model = job['model']
+        deadlines = job['deadlines']
+        started = None
+        try:
+            async with aclosing(self._wait(job)) as statuses:
+                async for status in statuses:
+                    yield status
+            started = time.monotonic()
+            try:
+                # aclosing() makes an early close reach the httpx stream at
+                # once instead of whenever it is collected
+                chunks = acoalesce(self._chat(messages, model, options, key, job['queued_at'], deadlines),
+                                   Coalescer.from_settings())
+                async with aclosing(chunks):
+                    streaming = False
+                    while True:
+                        stage, remaining = deadlines.next(started=True, streaming=streaming)
+                        try:
+                            async with asyncio.timeout(remaining):
+                                chunk = await anext(chunks)
+                        except StopAsyncIteration:
+                            break
+                        except TimeoutError:
+                            raise deadlines.exceeded(stage) from None
+                        streaming = True
+                        yield chunk
+            finally:
+                self._release(model, time.monotonic() - started)
+        finally:
+            if started is None:
+                # Closed, or out of time, before it got going
+                outcome = 'timeout' if deadlines.passed(started=False, streaming=False) else 'cancelled'
+                self._withdraw(job, outcome)
+
+    async def _chat(self, messages, model, options, key, queued_at, deadlines):
+        self.residency.record(model)
+        payload = build_chat_payload(model, messages, options=options, keep_alive=self.residency.keep_alive(model))
+        started = time.monotonic()
+        # Stays 'cancelled' if the generator is closed early
+        outcome = 'cancelled'
+        backend = None
+        chunks = []
+        try:
+            async with self._post(model, "/api/chat", payload) as (backend, response):
+                if response.status_code != 200:
+                    body = await response.aread()
+                    outcome = 'error'
+                    metrics.UPSTREAM_ERRORS.inc(model=model, kind=str(response.status_code))
+                    raise Exception(f"Ollama API Error: {response.status_code} - {body.decode('utf-8', 'replace')}")
+
+                # Read to the end of the body even after 'done', so the
+                # connection goes back to the pool for reuse.
+                done = False
+                async for json_response in aiter_ndjson(response.aiter_bytes()):
+                    content = json_response.get('message', {}).get('content', '')
+                    if content:
+                        if not chunks:
+                            metrics.TIME_TO_FIRST_TOKEN.observe(time.monotonic() - queued_at, model=model)
+                        chunks.append(content)
+                        yield content
+                    if json_response.get('done', False) and not done:
+                        done = True
+                        metrics.observe_done(model, json_response)
+                if done:
+                    outcome = 'done'
+                    self.pool.record_success(backend, model)
+                    metrics.GENERATION.observe(time.monotonic() - started, model=model)
+                    if key:
+                        get_response_cache().set(key, chunks)
+                else:
+                    outcome = 'error'
+                    self.pool.record_failure(backend)
+                    metrics.UPSTREAM_ERRORS.inc(model=model, kind='incomplete')
+        except Exception as e:
+            if outcome == 'cancelled':
+                outcome = 'error'
+                if backend is not None:
+                    self.pool.record_failure(backend)
+                metrics.UPSTREAM_ERRORS.inc(model=model, kind=type(e).__name__)
+            raise
+        finally:
+            if outcome == 'cancelled' and deadlines.passed(started=True, streaming=bool(chunks)):
+                outcome = 'timeout'
+            metrics.REQUESTS.inc(model=model, outcome=outcome)
+
+class AsyncChatStream:
+    """
+    Async iterator over a chat's chunks. A bare async generator closed
+    before its first step never runs its finally blocks, so aclose() gives
+    back the queue place (or slot) itself when iteration never started.
+    """
+
+    def __init__(self, service, job, generator):
+        self.service = service
+        self.job = job
+        self._generator = generator
+        self._started = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self._started = True
+        return await self._generator.__anext__()
+
+    async def aclose(self):
+        if not self._started and not self._closed:
+            self.service._withdraw(self.job, 'cancelled')
+        self._closed = True
+        await self._generator.aclose()
+
+async def _replay(chunks):
+    for frame in merged(chunks, Coalescer.from_settings()):
+        yield frame
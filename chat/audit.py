@@ -0,0 +1,138 @@
+import atexit
+import datetime
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .batching import BatchWriter
+from .models import LoginDailyRollup, UserLoginLog
+
+class LoginAuditWriter(BatchWriter):
+    """
+    Records logins in UserLoginLog.
+
+    By default record() inserts the row before it returns. With
+    `write_behind`, it only queues the row, timestamped at login, and the
+    queue is bulk_created in batches (see BatchWriter). A batch that fails
+    is written again a row at a time.
+    """
+
+    name = "login-audit"
+
+    def __init__(self, write_behind=False, batch_size=500, flush_interval=1.0, **retries):
+        self._buffer = []
+        super().__init__(write_behind, batch_size, flush_interval, **retries)
+
+    def record(self, user, ip_address=None, user_agent=''):
+        entry = UserLoginLog(user=user, ip_address=ip_address, user_agent=user_agent, timestamp=timezone.now())
+        if not self.write_behind:
+            entry.save()
+            return entry
+
+        self._submit(lambda: self._buffer.append(entry))
+        return entry
+
+    def _size(self):
+        return len(self._buffer)
+
+    def _take(self):
+        batch, self._buffer = self._buffer, []
+        return batch
+
+    def _split(self, batch):
+        return [[entry] for entry in batch]
+
+    def _write(self, batch):
+        try:
+            UserLoginLog.objects.bulk_create(batch)
+        except Exception:
+            # Rolled back; ids bulk_create may have set don't exist
+            for entry in batch:
+                entry.pk = None
+                entry._state.adding = True
+            raise
+
+    def _drop(self, part, error):
+        for entry in part:
+            print(f"Dropping the login record of user {entry.user_id}: {error}")
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_audit_writer():
+    """The process-wide LoginAuditWriter, configured from LOGIN_AUDIT_WRITE_BEHIND*."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LoginAuditWriter(
+                write_behind=getattr(settings, 'LOGIN_AUDIT_WRITE_BEHIND', False),
+                batch_size=getattr(settings, 'LOGIN_AUDIT_WRITE_BEHIND_BATCH', 500),
+                flush_interval=getattr(settings, 'LOGIN_AUDIT_WRITE_BEHIND_INTERVAL', 1.0),
+            )
+        return _writer
+
+def reset_audit_writer():
+    """Flushes and stops the current writer; the next get_audit_writer() builds a new one."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+atexit.register(reset_audit_writer)
+
+def rollup_logins(before):
+    """
+    Folds the UserLoginLog rows of every day before the date `before` into
+    LoginDailyRollup (one row per user and day, added to any already there)
+    and deletes them. Works a day at a time, each in its own transaction,
+    so it can be interrupted and re-run. Returns (days, rows) compacted.
+    """
+    tz = timezone.get_current_timezone()
+    cutoff = timezone.make_aware(datetime.datetime.combine(before, datetime.time()), tz)
+    days = rows = 0
+    while True:
+        oldest = UserLoginLog.objects.filter(timestamp__lt=cutoff).order_by('timestamp').first()
+        if oldest is None:
+            return days, rows
+        start = timezone.make_aware(
+            datetime.datetime.combine(timezone.localtime(oldest.timestamp, tz).date(), datetime.time()), tz
+        )
+        end = min(start + datetime.timedelta(days=1), cutoff)
+        with transaction.atomic():
+            logs = UserLoginLog.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            aggregates = (
+                logs.annotate(date=TruncDate('timestamp', tzinfo=tz))
+                .values('user_id', 'date')
+                .annotate(
+                    logins=Count('id'),
+                    ip_addresses=Count('ip_address', distinct=True),
+                    first_login=Min('timestamp'),
+                    last_login=Max('timestamp'),
+                )
+                .order_by()
+            )
+            existing = {
+                (r.user_id, r.date): r
+                for r in LoginDailyRollup.objects.select_for_update().filter(date=start.date())
+            }
+            created, updated = [], []
+            for a in aggregates:
+                rollup = existing.get((a['user_id'], a['date']))
+                if rollup is None:
+                    created.append(LoginDailyRollup(**a))
+                    continue
+                # Rows logged late for a day that was already compacted; the
+                # distinct address count becomes a lower bound
+                rollup.logins += a['logins']
+                rollup.ip_addresses = max(rollup.ip_addresses, a['ip_addresses'])
+                rollup.first_login = min(rollup.first_login, a['first_login'])
+                rollup.last_login = max(rollup.last_login, a['last_login'])
+                updated.append(rollup)
+            LoginDailyRollup.objects.bulk_create(created)
+            LoginDailyRollup.objects.bulk_update(updated, ['logins', 'ip_addresses', 'first_login', 'last_login'])
+            deleted, _ = logs.delete()
+        days += 1
+        rows += deleted
@@ -0,0 +1,201 @@
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from . import metrics
+
+BACKEND_UP = metrics.Gauge('ollama_backend_up', "1 while the backend takes requests, 0 while its circuit is open.", ['backend'])
+BACKEND_OUTSTANDING = metrics.Gauge('ollama_backend_outstanding', "Requests in flight per backend.", ['backend'])
+
+class Backend:
+    """One Ollama host and what the pool knows about it."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        # Consecutive failures; the circuit opens at the pool's threshold
+        self.failures = 0
+        self.open_until = None
+        # Models in memory (from /api/ps) and installed (from /api/tags);
+        # None until known
+        self.loaded = set()
+        self.installed = None
+        # /api/ps entries by model name (size, size_vram, expires_at, ...)
+        self.resident = {}
+
+    def __repr__(self):
+        return f"<Backend {self.url}>"
+
+    def available(self, now):
+        return self.open_until is None or now >= self.open_until
+
+class BackendPool:
+    """
+    The Ollama hosts in OLLAMA_BASE_URLS, and routing between them.
+
+    choose() picks, among the hosts whose circuit is closed (and that have
+    the model installed, when known), those that already have the model
+    loaded, then the one with the fewest requests in flight. Loading a model
+    takes seconds to minutes, so affinity wins over load until the host is
+    busier than `affinity_slack` requests compared to the idlest one.
+
+    `failure_threshold` consecutive failures open a host's circuit for
+    `cooldown` seconds; after that it gets requests again and the next
+    failure opens it right away. A background thread polls each host's
+    /api/ps every `health_interval` seconds (0 disables it) to refresh the
+    loaded models and to close circuits of hosts that came back. When every
+    circuit is open, the host that failed first is tried anyway rather than
+    failing the request without trying.
+    """
+
+    def __init__(self, urls, session=None, health_interval=10, failure_threshold=3, cooldown=30,
+                 affinity_slack=2, timeout=(3.05, 5), clock=time.monotonic):
+        if not urls:
+            raise ValueError("BackendPool needs at least one URL")
+        self.backends = [Backend(url) for url in urls]
+        self.session = session
+        self.health_interval = health_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.affinity_slack = affinity_slack
+        self.timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        # Called with no arguments after each round of health checks
+        self.listeners = []
+        for backend in self.backends:
+            BACKEND_UP.set(1, backend=backend.url)
+            BACKEND_OUTSTANDING.set(0, backend=backend.url)
+        if health_interval and session is not None:
+            self._thread = threading.Thread(target=self._run_health_checks, name="ollama-health", daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def from_settings(cls, session=None):
+        urls = getattr(settings, 'OLLAMA_BASE_URLS', None) or [
+            getattr(settings, 'OLLAMA_BASE_URL', "http://localhost:11434")
+        ]
+        return cls(
+            urls,
+            session=session,
+            health_interval=getattr(settings, 'OLLAMA_HEALTH_INTERVAL', 10),
+            failure_threshold=getattr(settings, 'OLLAMA_CIRCUIT_FAILURES', 3),
+            cooldown=getattr(settings, 'OLLAMA_CIRCUIT_COOLDOWN', 30),
+            timeout=(getattr(settings, 'OLLAMA_CONNECT_TIMEOUT', 3.05), 5),
+        )
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def choose(self, model=None, exclude=()):
+        """The backend to send a request for `model` to, or None if all are excluded."""
+        now = self._clock()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            up = [b for b in candidates if b.available(now)]
+            if not up:
+                return min(candidates, key=lambda b: b.open_until)
+            if model is not None:
+                up = [b for b in up if b.installed is None or model in b.installed] or up
+                idlest = min(b.outstanding for b in up)
+                warm = [b for b in up if model in b.loaded and b.outstanding <= idlest + self.affinity_slack]
+                up = warm or up
+            # min() keeps list order between equals, so ties go to the first host
+            return min(up, key=lambda b: b.outstanding)
+
+    @contextmanager
+    def acquire(self, model=None, exclude=()):
+        """Chooses a backend and counts a request in flight on it while the block runs."""
+        backend = self.choose(model, exclude)
+        if backend is None:
+            raise LookupError("No Ollama backend left to try")
+        with self._lock:
+            backend.outstanding += 1
+        BACKEND_OUTSTANDING.inc(backend=backend.url)
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+            BACKEND_OUTSTANDING.dec(backend=backend.url)
+
+    def record_success(self, backend, model=None):
+        with self._lock:
+            backend.failures = 0
+            backend.open_until = None
+            if model is not None:
+                # Ollama keeps a model loaded for a while after serving it
+                backend.loaded.add(model)
+        BACKEND_UP.set(1, backend=backend.url)
+
+    def record_failure(self, backend):
+        with self._lock:
+            backend.failures += 1
+            if backend.failures < self.failure_threshold:
+                return
+            backend.open_until = self._clock() + self.cooldown
+        BACKEND_UP.set(0, backend=backend.url)
+
+    def set_installed(self, backend, models):
+        with self._lock:
+            backend.installed = set(models)
+
+    def check(self, backend):
+        """Polls the backend's /api/ps; returns whether it answered."""
+        try:
+            response = self.session.get(f"{backend.url}/api/ps", timeout=self.timeout)
+            response.raise_for_status()
+            resident = {model['name']: model for model in response.json().get('models', [])}
+        except Exception:
+            self.record_failure(backend)
+            return False
+        with self._lock:
+            backend.loaded = set(resident)
+            backend.resident = resident
+        self.record_success(backend)
+        return True
+
+    def check_all(self):
+        for backend in self.backends:
+            self.check(backend)
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error after health checks: {e}")
+
+    def mark_unloaded(self, backend, model):
+        with self._lock:
+            backend.loaded.discard(model)
+            backend.resident.pop(model, None)
+
+    def warm_models(self):
+        """Models loaded on at least one host whose circuit is closed."""
+        now = self._clock()
+        with self._lock:
+            return sorted({model for b in self.backends if b.available(now) for model in b.loaded})
+
+    def _run_health_checks(self):
+        while not self._closed.wait(self.health_interval):
+            self.check_all()
+
+    def status(self):
+        now = self._clock()
+        with self._lock:
+            return [
+                {
+                    'url': b.url,
+                    'up': b.available(now),
+                    'outstanding': b.outstanding,
+                    'failures': b.failures,
+                    'loaded': sorted(b.loaded),
+                }
+                for b in self.backends
+            ]
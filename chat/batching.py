@@ -0,0 +1,159 @@
+import threading
+import time
+from django.db import close_old_connections, connection
+
+class BatchWriter:
+    """
+    Base class for writers that, with `write_behind`, queue rows in memory
+    and write them from a background thread in batches: every
+    `flush_interval` seconds, or as soon as `batch_size` are waiting.
+    Whatever is queued is lost if the process dies before the next flush;
+    close() and interpreter exit flush it.
+
+    A batch that fails to write is cut up with _split() (e.g. a part per
+    conversation or row) and the parts are written one by one right away,
+    so a bad row only holds back its own part. Parts that still fail are
+    set aside and retried after `retry_delay` seconds, doubling up to
+    `max_retry_delay`, while later batches are written as usual; after
+    `attempts` failures a part is handed to _drop().
+
+    Subclasses keep the queue, guarded by self._cond, and implement
+    _size(), _take(), _split() and _write(); they queue with _submit().
+    The queue must exist before BatchWriter.__init__ starts the thread.
+    """
+
+    name = "batch"
+
+    def __init__(self, write_behind=False, batch_size=100, flush_interval=0.5,
+                 attempts=5, retry_delay=0.5, max_retry_delay=30):
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._cond = threading.Condition()
+        # Batches and parts being written
+        self._writing = []
+        # [part, failures, retry at] for parts waiting to be retried
+        self._held = []
+        self._closed = False
+        self._thread = None
+        if write_behind:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+            self._thread.start()
+
+    def _submit(self, add):
+        """Queues something by calling add() with the lock held."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{type(self).__name__} is closed")
+            add()
+            if self._size() >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self):
+        """Blocks until everything queued so far has been written (or dropped)."""
+        self._wait(lambda: self._size() or self._writing or self._held)
+
+    def _wait(self, pending):
+        """Blocks while pending(), called with the lock held, is true, hurrying the writer along."""
+        if not self.write_behind:
+            return
+        with self._cond:
+            while pending() and self._thread.is_alive():
+                self._cond.notify_all()
+                self._cond.wait(0.1)
+
+    def _unwritten(self):
+        """The batches and parts taken from the queue but not written yet. Called with the lock held."""
+        return self._writing + [part for part, _, _ in self._held]
+
+    def close(self, timeout=5):
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    waits = [retry_at - time.monotonic() for _, _, retry_at in self._held]
+                    if not self._closed:
+                        waits.append(self.flush_interval)
+                    if waits and self._size() < self.batch_size and not (self._closed and self._size()):
+                        # Give the batch a moment to fill up, or wait for a part's retry
+                        self._cond.wait(max(0, min(waits)))
+                    batch = self._take() if self._size() else None
+                    now = time.monotonic()
+                    due = [held for held in self._held if held[2] <= now]
+                    self._held = [held for held in self._held if held[2] > now]
+                    self._writing = ([batch] if batch is not None else []) + [part for part, _, _ in due]
+
+                # (part, failures, error) for what couldn't be written
+                failed = []
+                try:
+                    if self._writing:
+                        close_old_connections()
+                    if batch is not None:
+                        failed += [(part, 1, e) for part, e in self._write_parts(batch)]
+                    for part, failures, _ in due:
+                        try:
+                            self._write(part)
+                        except Exception as e:
+                            failed.append((part, failures + 1, e))
+                finally:
+                    with self._cond:
+                        for part, failures, e in failed:
+                            if failures >= self.attempts:
+                                self._drop(part, e)
+                                continue
+                            delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+                            print(f"Error writing {self.name} batch, retrying in {delay:g}s: {e}")
+                            self._held.append([part, failures, time.monotonic() + delay])
+                        self._writing = []
+                        self._cond.notify_all()
+                        if self._closed and not self._size() and not self._held:
+                            return
+        finally:
+            connection.close()
+
+    def _write_parts(self, batch):
+        """Writes `batch`, or else each of its parts; returns the (part, error) pairs that failed."""
+        try:
+            self._write(batch)
+            return []
+        except Exception as e:
+            parts = self._split(batch)
+            if len(parts) == 1:
+                return [(batch, e)]
+        failed = []
+        for part in parts:
+            try:
+                self._write(part)
+            except Exception as e:
+                failed.append((part, e))
+        return failed
+
+    def _size(self):
+        """Number of queued items. Called with the lock held."""
+        raise NotImplementedError
+
+    def _take(self):
+        """Empties the queue into a batch. Called with the lock held."""
+        raise NotImplementedError
+
+    def _split(self, batch):
+        """The parts of a failed batch to write on their own; by default it can't be split."""
+        return [batch]
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+    def _drop(self, part, error):
+        """Gives up on a part that keeps failing."""
+        print(f"Dropping {self.name} batch after {self.attempts} failed writes: {error}")
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+def cache_key(model, messages, options=None):
+    """
+    Hash identifying a generation: the model, the messages (role and
+    whitespace-trimmed content only) and the Ollama options.
+    """
+    normalized = [
+        {'role': msg.get('role'), 'content': (msg.get('content') or '').strip()}
+        for msg in messages
+    ]
+    data = json.dumps(
+        {'model': model, 'messages': normalized, 'options': options or {}},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False,
+    )
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def is_deterministic(options):
+    options = options or {}
+    return options.get('temperature') == 0 or 'seed' in options
+
+class ResponseCache:
+    """
+    LRU cache of finished generations, stored as the list of chunks they
+    were streamed in so a hit can be replayed chunk by chunk.
+
+    Entries expire after `ttl` seconds. Least recently used entries are
+    evicted beyond `max_entries` entries or `max_bytes` of content.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl=3600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= self._clock():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def set(self, key, chunks):
+        size = sum(len(chunk.encode('utf-8')) for chunk in chunks)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (list(chunks), size, self._clock() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, key):
+        chunks, size, expires = self._entries.pop(key)
+        self._bytes -= size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """
+    The process-wide response cache, or None unless OLLAMA_RESPONSE_CACHE is
+    on. Shared by the threaded and the asyncio services.
+    """
+    global _cache
+    if not getattr(settings, 'OLLAMA_RESPONSE_CACHE', False):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_entries=getattr(settings, 'OLLAMA_RESPONSE_CACHE_ENTRIES', 256),
+                max_bytes=getattr(settings, 'OLLAMA_RESPONSE_CACHE_BYTES', 16 * 1024 * 1024),
+                ttl=getattr(settings, 'OLLAMA_RESPONSE_CACHE_TTL', 3600),
+            )
+        return _cache
+
+def reset_response_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+def cacheable_key(model, messages, options=None):
+    """The cache key for a request, or None if it must not be cached."""
+    if get_response_cache() is None:
+        return None
+    if getattr(settings, 'OLLAMA_RESPONSE_CACHE_DETERMINISTIC_ONLY', False) and not is_deterministic(options):
+        return None
+    return cache_key(model, messages, options)
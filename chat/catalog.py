@@ -0,0 +1,103 @@
+import hashlib
+import json
+import threading
+import time
+from django.core.cache import caches
+
+class ModelCatalog:
+    """
+    Caches the list of models Ollama has installed.
+
+    Entries are fresh for `ttl` seconds. After that, get() keeps returning
+    the stale list for up to `stale_ttl` more seconds while a background
+    thread refreshes it, so a slow Ollama never stalls a page load once the
+    list has been fetched once. Failed refreshes keep the previous list.
+
+    If `cache_alias` names a Django cache, entries are shared through it so
+    other processes can skip their own first fetch.
+    """
+    cache_key = 'ollama:models'
+
+    def __init__(self, fetch, ttl=30, stale_ttl=300, cache_alias=None, clock=time.time):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cache = caches[cache_alias] if cache_alias else None
+        self._clock = clock
+        self._entry = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """
+        Returns a dict with 'models', 'etag', 'last_modified' (epoch seconds)
+        and 'fetched_at'.
+        """
+        entry = self._current()
+        if entry is None:
+            return self.refresh()
+
+        age = self._clock() - entry['fetched_at']
+        if age < self.ttl:
+            return entry
+        if age < self.ttl + self.stale_ttl:
+            self._refresh_in_background()
+            return entry
+        return self.refresh()
+
+    def refresh(self):
+        """Fetches the list now. Returns the previous entry if that fails."""
+        try:
+            models = self._fetch()
+        except Exception as e:
+            print(f"Error fetching models: {e}")
+            with self._lock:
+                return self._entry or {'models': [], 'etag': None, 'last_modified': None, 'fetched_at': 0}
+
+        now = self._clock()
+        etag = hashlib.sha1(json.dumps(models).encode('utf-8')).hexdigest()
+        with self._lock:
+            previous = self._entry
+            # Last-Modified tracks when the list changed, not when it was fetched
+            if previous and previous['etag'] == etag:
+                last_modified = previous['last_modified']
+            else:
+                last_modified = int(now)
+            self._entry = {'models': models, 'etag': etag, 'last_modified': last_modified, 'fetched_at': now}
+            entry = self._entry
+
+        if self.cache is not None:
+            self.cache.set(self.cache_key, entry, timeout=self.ttl + self.stale_ttl)
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+        if self.cache is not None:
+            self.cache.delete(self.cache_key)
+
+    def _current(self):
+        with self._lock:
+            entry = self._entry
+        if self.cache is not None and (entry is None or self._clock() - entry['fetched_at'] >= self.ttl):
+            # Another process may have refreshed it already
+            shared = self.cache.get(self.cache_key)
+            if shared is not None and (entry is None or shared['fetched_at'] > entry['fetched_at']):
+                with self._lock:
+                    self._entry = entry = shared
+        return entry
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="ollama-models-refresh", daemon=True).start()
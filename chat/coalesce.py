@@ -0,0 +1,125 @@
+import asyncio
+import time
+from contextlib import aclosing
+from django.conf import settings
+
+# What a take() passed to Coalescer.merge() returns when nothing is waiting
+EMPTY = object()
+
+class Coalescer:
+    """
+    Merges streamed text chunks into fewer, larger frames, so a long answer
+    isn't written to the client one token at a time.
+
+    A chunk that arrives `interval` seconds or more after the last frame
+    (the first token, or the first after a pause) goes out at once. Chunks
+    arriving faster wait until `interval` has passed since the last frame
+    and go out together, at most `max_chars` characters a frame. An
+    `interval` of 0 sends every chunk as it comes.
+    """
+
+    def __init__(self, interval=0.03, max_chars=1024, clock=time.monotonic):
+        self.interval = interval
+        self.max_chars = max_chars
+        self._clock = clock
+        self._last = None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            interval=getattr(settings, 'OLLAMA_STREAM_FLUSH_INTERVAL', 0.03),
+            max_chars=getattr(settings, 'OLLAMA_STREAM_FRAME_CHARS', 1024),
+        )
+
+    def delay(self):
+        """Seconds to hold a chunk that just arrived before sending it."""
+        if not self.interval or self._last is None:
+            return 0
+        return max(0, self._last + self.interval - self._clock())
+
+    def merge(self, first, take):
+        """
+        `first` plus the text chunks take() returns, until it returns EMPTY
+        or something else, as frames. Returns the frames and what stopped
+        it (EMPTY if the chunks ran out).
+        """
+        frames, parts, size = [], [first], len(first)
+        while self.interval:
+            item = take()
+            if not isinstance(item, str):
+                break
+            if size + len(item) > self.max_chars:
+                frames.append("".join(parts))
+                parts, size = [], 0
+            parts.append(item)
+            size += len(item)
+        else:
+            item = EMPTY
+        frames.append("".join(parts))
+        self._last = self._clock()
+        return frames, item
+
+def merged(chunks, coalescer):
+    """Frames of chunks that are all available already, e.g. a cached answer."""
+    remaining = iter(chunks)
+    for chunk in remaining:
+        frames, _ = coalescer.merge(chunk, lambda: next(remaining, EMPTY))
+        yield from frames
+
+async def acoalesce(chunks, coalescer):
+    """
+    Yields the text chunks of the async generator `chunks` merged by
+    `coalescer`. They are read by a separate task, so they keep coming in
+    while a frame is held back.
+    """
+    if not coalescer.interval:
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk
+        return
+
+    # Bounded, so a slow client makes read() wait and stop pulling from
+    # Ollama until it catches up
+    received = asyncio.Queue(getattr(settings, 'OLLAMA_RESPONSE_QUEUE_SIZE', 256))
+    end = object()
+
+    async def read():
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    await received.put(chunk)
+        except Exception as e:
+            await received.put(e)
+        else:
+            await received.put(end)
+
+    def take():
+        try:
+            return received.get_nowait()
+        except asyncio.QueueEmpty:
+            return EMPTY
+
+    reader = asyncio.ensure_future(read())
+    try:
+        item = EMPTY
+        while True:
+            if item is EMPTY:
+                item = await received.get()
+            if isinstance(item, str):
+                delay = coalescer.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                frames, item = coalescer.merge(item, take)
+                for frame in frames:
+                    yield frame
+                continue
+            if item is end:
+                return
+            raise item
+    finally:
+        # Closed early: stop reading, which closes `chunks`
+        reader.cancel()
+        try:
+            await reader
+        except asyncio.CancelledError:
+            pass
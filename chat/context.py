@@ -0,0 +1,78 @@
+from itertools import chain
+from django.conf import settings
+
+# Tokens a chat template adds around each message (role markers etc.)
+MESSAGE_OVERHEAD = 4
+
+def estimate_tokens(text):
+    """
+    Fast approximation of how many tokens `text` costs. BPE vocabularies
+    average about four bytes of UTF-8 per token, which is close enough to
+    budget a prompt without loading the model's tokenizer.
+    """
+    return (len(text.encode('utf-8')) + 3) // 4
+
+def context_budget(model):
+    budgets = getattr(settings, 'OLLAMA_CONTEXT_TOKENS', {})
+    return budgets.get(model, budgets.get('*', 2048))
+
+def to_ollama(messages):
+    """Turns chronological Messages into Ollama chat messages."""
+    # Ollama expects 'assistant' for bot role
+    return [
+        {'role': 'assistant' if msg.role == 'bot' else 'user', 'content': msg.content}
+        for msg in messages
+    ]
+
+def build_context(conversation, model, pending=()):
+    """
+    Returns the newest messages of `conversation` that fit in the model's
+    token budget, oldest first, ready to send to Ollama.
+
+    Messages are read newest first and reading stops at the budget, so the
+    cost depends on the budget rather than the length of the conversation.
+    The newest message is always included. Token counts missing from older
+    rows are computed once and stored.
+
+    If the conversation has a rolling summary (see chat.summaries), it is
+    sent first as a system message and the messages it covers are skipped.
+
+    `pending` are messages not written to the database yet (see
+    chat.persistence), oldest first; they count as the newest messages.
+    """
+    from .models import Message
+
+    budget = context_budget(model)
+    rows = Message.objects.filter(conversation_id=conversation.id)
+    summary = None
+    if conversation.summary:
+        summary = {'role': 'system', 'content': f"Summary of the earlier conversation:\n{conversation.summary}"}
+        budget -= estimate_tokens(summary['content']) + MESSAGE_OVERHEAD
+        rows = rows.filter(id__gt=conversation.summary_until)
+
+    selected = []
+    missing = []
+    used = 0
+    rows = (
+        rows.order_by('-created_at', '-id')
+        .only('id', 'role', 'content', 'token_count')
+        .iterator(chunk_size=50)
+    )
+    for msg in chain(reversed(pending), rows):
+        if msg.token_count is None:
+            msg.token_count = estimate_tokens(msg.content)
+            if msg.pk is not None:
+                missing.append(msg)
+        cost = msg.token_count + MESSAGE_OVERHEAD
+        if selected and used + cost > budget:
+            break
+        selected.append(msg)
+        used += cost
+
+    if missing:
+        Message.objects.bulk_update(missing, ['token_count'])
+    selected.reverse()
+    context = to_ollama(selected)
+    if summary:
+        context.insert(0, summary)
+    return context
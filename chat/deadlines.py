@@ -0,0 +1,62 @@
+import time
+from django.conf import settings
+
+STAGES = ('queue', 'first_token', 'total')
+
+class DeadlineExceeded(Exception):
+    """A chat ran past one of its model's limits; `stage` says which."""
+
+    WAITING_FOR = {
+        'queue': "a worker",
+        'first_token': "the first token",
+        'total': "the end of the answer",
+    }
+
+    def __init__(self, stage, limit):
+        super().__init__(f"Timed out after {limit:g}s waiting for {self.WAITING_FOR[stage]}")
+        self.stage = stage
+        self.limit = limit
+
+def limits_for(model):
+    """The model's OLLAMA_DEADLINES, stage by stage, falling back to '*'."""
+    configured = getattr(settings, 'OLLAMA_DEADLINES', {})
+    limits = dict.fromkeys(STAGES)
+    limits.update(configured.get('*', {}))
+    limits.update(configured.get(model, {}))
+    return limits
+
+class Deadlines:
+    """
+    A chat's deadlines, all counted from when it was queued: to be picked
+    up by a worker ('queue'), to produce its first token ('first_token')
+    and to finish ('total'). A limit of None never expires.
+    """
+
+    def __init__(self, model, queued_at, clock=time.monotonic):
+        self.limits = limits_for(model)
+        self.queued_at = queued_at
+        self._clock = clock
+
+    def next(self, started, streaming):
+        """
+        The stage whose deadline comes first for a chat that has `started`
+        (been picked up) and is `streaming` (has produced a token), and the
+        seconds left to it; (None, None) if none applies.
+        """
+        stages = ['total']
+        if not streaming:
+            stages.append('first_token')
+        if not started:
+            stages.append('queue')
+        pending = [(self.limits[s], s) for s in stages if self.limits[s] is not None]
+        if not pending:
+            return None, None
+        limit, stage = min(pending)
+        return stage, self.queued_at + limit - self._clock()
+
+    def passed(self, started, streaming):
+        _, remaining = self.next(started, streaming)
+        return remaining is not None and remaining <= 0
+
+    def exceeded(self, stage):
+        return DeadlineExceeded(stage, self.limits[stage])
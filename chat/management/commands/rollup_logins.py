@@ -0,0 +1,27 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from chat.audit import rollup_logins
+
+class Command(BaseCommand):
+    help = (
+        "Compacts UserLoginLog rows older than the retention period into daily "
+        "per-user LoginDailyRollup rows. Run it daily, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Keep this many days of individual logins (default: LOGIN_AUDIT_RETENTION_DAYS)",
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'LOGIN_AUDIT_RETENTION_DAYS', 90)
+        if days < 0:
+            raise CommandError("--days must not be negative")
+        before = timezone.localdate() - datetime.timedelta(days=days)
+        compacted_days, rows = rollup_logins(before)
+        self.stdout.write(f"Compacted {rows} login records from {compacted_days} days before {before}")
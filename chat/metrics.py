@@ -0,0 +1,184 @@
+import math
+import threading
+
+# Past this many label combinations a metric folds new ones into "other",
+# since some label values (model names) come from clients
+MAX_SERIES = 200
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _key(self, labels):
+        # Called with _lock held
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            key = ('other',) * len(self.labelnames)
+        return key
+
+    def get(self, **labels):
+        """The current value of one series, for tests and debugging."""
+        with self._lock:
+            return self._series.get(tuple(str(labels[name]) for name in self.labelnames))
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def samples(self):
+        """Yields (suffix, labels dict, value) for the exposition format."""
+        with self._lock:
+            series = list(self._series.items())
+        for key, value in sorted(series):
+            yield '', dict(zip(self.labelnames, key)), value
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (not cumulative), then sum and count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def get(self, **labels):
+        """(count, sum) of one series, or None."""
+        series = super().get(**labels)
+        return None if series is None else (series[2], series[1])
+
+    def samples(self):
+        with self._lock:
+            series = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items()]
+        for key, (counts, total, count) in sorted(series):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield '_bucket', {**labels, 'le': _format_value(bound)}, cumulative
+            yield '_bucket', {**labels, 'le': '+Inf'}, count
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation, quote=False)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                label_text = ",".join(f'{name}="{_escape(v)}"' for name, v in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{metric.name}{suffix}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value, quote=True):
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quote else value
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = Registry()
+
+# The generation pipeline (chat.services, chat.async_services, chat.views)
+
+REQUESTS = Counter(
+    'ollama_chat_requests_total',
+    "Chat requests by how they ended: done, cancelled, error, rejected (queue full), "
+    "cached (replayed from the response cache) or coalesced (joined an identical request).",
+    ['model', 'outcome'],
+)
+QUEUE_DEPTH = Gauge('ollama_queue_depth', "Jobs waiting for a worker.", ['model'])
+ACTIVE = Gauge('ollama_active_generations', "Jobs being generated.", ['model'])
+QUEUE_WAIT = Histogram('ollama_queue_wait_seconds', "Time from accepting a job to a worker starting it.", ['model'])
+TIME_TO_FIRST_TOKEN = Histogram(
+    'ollama_time_to_first_token_seconds', "Time from accepting a chat request to its first token, queueing included.",
+    ['model'],
+)
+GENERATION = Histogram(
+    'ollama_generation_seconds', "Time from a worker starting a chat request to the end of the reply.", ['model'],
+)
+TOKENS_PER_SECOND = Histogram(
+    'ollama_tokens_per_second', "Generation speed reported by Ollama (eval_count / eval_duration).", ['model'],
+    buckets=(1, 2.5, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200),
+)
+EVAL_TOKENS = Counter('ollama_eval_tokens_total', "Tokens generated, as reported by Ollama.", ['model'])
+PROMPT_TOKENS = Counter('ollama_prompt_eval_tokens_total', "Prompt tokens evaluated, as reported by Ollama.", ['model'])
+PROMPT_EVAL = Histogram(
+    'ollama_prompt_eval_seconds', "Prompt evaluation time reported by Ollama (prompt_eval_duration).", ['model'],
+)
+UPSTREAM_ERRORS = Counter(
+    'ollama_upstream_errors_total', "Failed calls to Ollama, by HTTP status or exception class.", ['model', 'kind'],
+)
+
+def observe_done(model, final):
+    """Records the timings and token counts in Ollama's final ('done') message."""
+    eval_count = final.get('eval_count')
+    eval_duration = final.get('eval_duration')
+    if eval_count:
+        EVAL_TOKENS.inc(eval_count, model=model)
+        if eval_duration:
+            TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model=model)
+    if final.get('prompt_eval_count'):
+        PROMPT_TOKENS.inc(final['prompt_eval_count'], model=model)
+    if final.get('prompt_eval_duration') is not None:
+        PROMPT_EVAL.observe(final['prompt_eval_duration'] / 1e9, model=model)
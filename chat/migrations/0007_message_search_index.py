@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 21:05
+
+from django.db import migrations
+
+FTS_TABLE = 'chat_message_fts'
+PG_INDEX = 'chat_message_content_tsv'
+
+
+def create_index(apps, schema_editor):
+    """See chat.search."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "body, owner, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, body, owner) "
+            "SELECT m.id, m.content, 'u' || c.user_id FROM chat_message m "
+            "JOIN chat_conversation c ON c.id = m.conversation_id"
+        )
+    elif vendor == 'postgresql':
+        # Matches the expression SearchVector('content', config='english') compiles to
+        schema_editor.execute(
+            f"CREATE INDEX {PG_INDEX} ON chat_message "
+            "USING GIN (to_tsvector('english'::regconfig, COALESCE(content, '')))"
+        )
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX {PG_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_conversation_index_tiebreak'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-18 21:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoginDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('logins', models.PositiveIntegerField()),
+                ('ip_addresses', models.PositiveIntegerField(help_text='Distinct IP addresses')),
+                ('first_login', models.DateTimeField()),
+                ('last_login', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='userloginlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='userloginlog',
+            index=models.Index(fields=['timestamp'], name='chat_login_timestamp'),
+        ),
+        migrations.AddField(
+            model_name='logindailyrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='login_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='logindailyrollup',
+            index=models.Index(fields=['date'], name='chat_login_rollup_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='logindailyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='chat_login_rollup_user_date'),
+        ),
+    ]
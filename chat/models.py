@@ -1,17 +1,53 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .context import estimate_tokens
 
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
     title = models.CharField(max_length=200, default="New Chat")
+    # Rolling summary of the messages up to and including summary_until,
+    # sent in their place once the conversation outgrows the context budget
+    summary = models.TextField(blank=True, default="")
+    summary_until = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored owner, so a save that changes it can be noticed (see
+        # chat.signals)
+        instance._loaded_user_id = instance.__dict__.get('user_id')
+        return instance
+
+    @staticmethod
+    def count_cache_key(user_id):
+        return f'chat:conversation-count:{user_id}'
+
+    @classmethod
+    def count_for(cls, user_id):
+        """
+        Number of conversations of a user, cached until one is created or
+        deleted (see chat.signals), or for CONVERSATION_COUNT_TTL seconds:
+        the signals only clear this process's cache unless CACHES is shared.
+        """
+        return cache.get_or_set(
+            cls.count_cache_key(user_id), lambda: cls.objects.filter(user_id=user_id).count(),
+            timeout=getattr(settings, 'CONVERSATION_COUNT_TTL', 60),
+        )
+
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # The sidebar: a user's conversations, most recently updated first
+            models.Index(fields=['user', '-updated_at', '-id'], name='chat_conv_user_updated'),
+        ]
 
 class Message(models.Model):
     ROLE_CHOICES = [
@@ -21,19 +57,66 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
+    # Approximate prompt cost, see chat.context.estimate_tokens
+    token_count = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
 
+    class Meta:
+        indexes = [
+            # A conversation's messages in order, either direction (context
+            # building reads newest first, the history oldest first)
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chat_msg_conv_created'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Re-estimated whenever the content is saved, so edits don't leave
+        # a stale count behind
+        update_fields = kwargs.get('update_fields')
+        saves_content = 'content' in self.__dict__ and (update_fields is None or 'content' in update_fields)
+        if saves_content or self.token_count is None:
+            self.token_count = estimate_tokens(self.content)
+            if update_fields is not None and 'token_count' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'token_count']
+        super().save(*args, **kwargs)
+
 class UserLoginLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_logs')
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set at login rather than on insert, which may come later in a batch
+    # (chat.audit)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return f"{self.user.username} logged in at {self.timestamp}"
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # The admin's default order, and the range chat.audit compacts
+            models.Index(fields=['timestamp'], name='chat_login_timestamp'),
+        ]
+
+class LoginDailyRollup(models.Model):
+    """A user's logins on one day, kept once the UserLoginLog rows are compacted."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='login_rollups')
+    date = models.DateField()
+    logins = models.PositiveIntegerField()
+    ip_addresses = models.PositiveIntegerField(help_text="Distinct IP addresses")
+    first_login = models.DateTimeField()
+    last_login = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user.username}: {self.logins} logins on {self.date}"
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='chat_login_rollup_user_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='chat_login_rollup_date'),
+        ]
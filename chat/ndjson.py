@@ -0,0 +1,70 @@
+import json
+
+class NDJSONDecoder:
+    """
+    Incremental decoder for newline-delimited JSON, as streamed by Ollama's
+    /api/chat, /api/generate and /api/pull endpoints.
+
+    feed() takes bytes as they arrive off the socket and returns the objects
+    for every line completed so far. Lines are located by offset in a single
+    bytearray and the consumed prefix is dropped once per feed, so decoding
+    a response costs time linear in its size regardless of how it is
+    chunked. Lines that are not valid JSON are skipped and counted in
+    `errors`.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, chunk):
+        buffer = self._buffer
+        # Bytes already buffered contain no newline, so only scan the new ones
+        scan = len(buffer)
+        buffer += chunk
+        objects = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", scan)
+            if end == -1:
+                break
+            self._decode(buffer[start:end], objects)
+            start = scan = end + 1
+        if start:
+            # bytearray drops a prefix without moving the rest of the buffer
+            del buffer[:start]
+        return objects
+
+    def close(self):
+        """Decodes a final line that was not newline-terminated."""
+        objects = []
+        if self._buffer:
+            self._decode(bytes(self._buffer), objects)
+            self._buffer.clear()
+        return objects
+
+    def _decode(self, line, objects):
+        if not line or line.isspace():
+            return
+        try:
+            objects.append(json.loads(line))
+        except json.JSONDecodeError:
+            self.errors += 1
+
+def iter_ndjson(chunks):
+    """Yields the decoded objects from an iterable of byte chunks."""
+    decoder = NDJSONDecoder()
+    for chunk in chunks:
+        if chunk:
+            yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+async def aiter_ndjson(chunks):
+    """Async variant of iter_ndjson, for httpx's aiter_bytes()."""
+    decoder = NDJSONDecoder()
+    async for chunk in chunks:
+        if chunk:
+            for obj in decoder.feed(chunk):
+                yield obj
+    for obj in decoder.close():
+        yield obj
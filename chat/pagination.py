@@ -0,0 +1,73 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(obj, fields):
+    values = [getattr(obj, name) for name in fields]
+    data = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, model, fields):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data)
+        if len(values) != len(fields):
+            raise ValueError
+        return [model._meta.get_field(name).to_python(value) for name, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError) as e:
+        raise InvalidCursor(cursor) from e
+
+class KeysetPaginator:
+    """
+    Keyset ("cursor") pagination over a queryset on two fields, e.g.
+    (created_at, id), where the second one breaks ties. Pages are read with
+    an index range scan starting at the cursor, so page N costs the same as
+    page 1, and rows inserted meanwhile don't shift the pages.
+
+    `descending` sets the display order. Cursors are opaque strings naming
+    a row; `after` returns the rows following it in display order, `before`
+    the rows preceding it, and neither the first page (or with `tail`, the
+    last one).
+    """
+
+    def __init__(self, queryset, fields, descending=False):
+        self.queryset = queryset
+        self.fields = tuple(fields)
+        self.descending = descending
+
+    def page(self, limit, after=None, before=None, tail=False):
+        """
+        Returns (rows in display order, prev cursor, next cursor). The
+        cursors are None when there is nothing further in that direction.
+        """
+        model = self.queryset.model
+        backwards = before is not None or (after is None and tail)
+        cursor = before if before is not None else after
+        rows = self.queryset
+        if cursor is not None:
+            rows = rows.filter(self._beyond(decode_cursor(cursor, model, self.fields), backwards))
+
+        descending = self.descending != backwards
+        rows = list(rows.order_by(*[('-' if descending else '') + name for name in self.fields])[:limit + 1])
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        first = encode_cursor(rows[0], self.fields) if rows else None
+        last = encode_cursor(rows[-1], self.fields) if rows else None
+        if backwards:
+            return rows, first if more else None, last if before is not None else None
+        return rows, first if after is not None else None, last if more else None
+
+    def _beyond(self, values, backwards):
+        # (a, b) past (va, vb) in the walking direction. The bound on `a`
+        # alone lets the database start an index range scan there.
+        (a, b), (va, vb) = self.fields, values
+        greater = self.descending == backwards
+        op = 'gt' if greater else 'lt'
+        return Q(**{f'{a}__{op}e': va}) & (Q(**{f'{a}__{op}': va}) | Q(**{f'{b}__{op}': vb}))
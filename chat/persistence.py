@@ -0,0 +1,150 @@
+import atexit
+import threading
+from collections import defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .batching import BatchWriter
+from .context import estimate_tokens
+from .models import Conversation, Message
+from .signals import messages_persisted
+
+class MessageWriter(BatchWriter):
+    """
+    Persists chat messages and bumps their conversation's updated_at.
+
+    By default every save() is written before it returns. With
+    `write_behind`, save() only queues the message (see BatchWriter) and
+    each batch is written with one bulk_create (new rows), one bulk_update
+    (rows saved again, e.g. checkpoints of a streaming reply) and one
+    bulk_update of the touched conversations. A batch that fails is
+    written again a conversation at a time, so one bad conversation (e.g.
+    deleted mid-reply) only holds back, and eventually loses, its own
+    messages.
+
+    bulk_create skips Message.save() and post_save, so each written batch
+    is announced with the messages_persisted signal instead.
+    """
+
+    name = "message"
+
+    def __init__(self, write_behind=False, batch_size=100, flush_interval=0.5, **retries):
+        # id(message) -> message, in the order they were first queued
+        self._queued = {}
+        self._touches = {}
+        super().__init__(write_behind, batch_size, flush_interval, **retries)
+
+    def save(self, message):
+        """Writes `message`, or queues it in write-behind mode. Saving it again updates the row."""
+        message.token_count = estimate_tokens(message.content)
+        now = timezone.now()
+        if not self.write_behind:
+            message.save()
+            Conversation.objects.filter(id=message.conversation_id).update(updated_at=now)
+            return message
+
+        def add():
+            self._queued.setdefault(id(message), message)
+            self._touches[message.conversation_id] = now
+
+        self._submit(add)
+        return message
+
+    async def asave(self, message):
+        if self.write_behind:
+            return self.save(message)
+        return await sync_to_async(self.save)(message)
+
+    def has_pending(self, conversation_id):
+        """True while messages of the conversation are queued, being written or waiting for a retry."""
+        with self._cond:
+            if any(conversation_id in touches for _, touches in self._unwritten()):
+                return True
+            return any(msg.conversation_id == conversation_id for msg in self._queued.values())
+
+    def wait_for(self, conversation_id):
+        """
+        Makes earlier messages of the conversation visible to queries. Only
+        waits for that conversation, not for the rest of the queue.
+        """
+        self._wait(lambda: self.has_pending(conversation_id))
+
+    async def await_for(self, conversation_id):
+        if self.has_pending(conversation_id):
+            await sync_to_async(self.wait_for)(conversation_id)
+
+    def _size(self):
+        return len(self._queued)
+
+    def _take(self):
+        batch = (list(self._queued.values()), self._touches)
+        self._queued, self._touches = {}, {}
+        return batch
+
+    def _write(self, batch):
+        messages, touches = batch
+        created = [msg for msg in messages if msg.pk is None]
+        updated = [msg for msg in messages if msg.pk is not None]
+        try:
+            with transaction.atomic():
+                if created:
+                    Message.objects.bulk_create(created)
+                if updated:
+                    Message.objects.bulk_update(updated, ['content', 'token_count'])
+                if touches:
+                    Conversation.objects.bulk_update(
+                        [Conversation(id=cid, updated_at=when) for cid, when in touches.items()],
+                        ['updated_at'],
+                    )
+        except Exception:
+            # bulk_create may have set ids for rows that were rolled back;
+            # a retry has to insert them again
+            for msg in created:
+                msg.pk = None
+                msg._state.adding = True
+            raise
+        try:
+            messages_persisted.send(sender=Message, created=created, updated=updated)
+        except Exception as e:
+            # The rows are written; only what listens (the search index) missed them
+            print(f"Error announcing {len(messages)} written messages: {e}")
+
+    def _split(self, batch):
+        messages, touches = batch
+        by_conversation = defaultdict(list)
+        for msg in messages:
+            by_conversation[msg.conversation_id].append(msg)
+        return [
+            (by_conversation.get(cid, []), {cid: touches[cid]} if cid in touches else {})
+            for cid in dict.fromkeys([*by_conversation, *touches])
+        ]
+
+    def _drop(self, part, error):
+        messages, touches = part
+        print(f"Dropping {len(messages)} messages of conversation {', '.join(map(str, touches))}: {error}")
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """The process-wide MessageWriter, configured from OLLAMA_WRITE_BEHIND*."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MessageWriter(
+                write_behind=getattr(settings, 'OLLAMA_WRITE_BEHIND', False),
+                batch_size=getattr(settings, 'OLLAMA_WRITE_BEHIND_BATCH', 100),
+                flush_interval=getattr(settings, 'OLLAMA_WRITE_BEHIND_INTERVAL', 0.5),
+            )
+        return _writer
+
+def reset_writer():
+    """Flushes and stops the current writer; the next get_writer() builds a new one."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+atexit.register(reset_writer)
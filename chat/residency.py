@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import defaultdict, deque
+from django.conf import settings
+
+# keep_alive that keeps a model loaded until it is unloaded explicitly
+PINNED = -1
+
+class ResidencyManager:
+    """
+    Keeps the models in use loaded in Ollama, so chats don't wait for a cold
+    load, and makes room by unloading the ones that aren't.
+
+    - preload() loads the `preload` models (OLLAMA_PRELOAD_MODELS), one
+      host each, when the service is first used in a process. They are
+      pinned: loaded, and chatted with, with keep_alive -1, so Ollama
+      never unloads them.
+    - keep_alive(model) is the keep_alive sent with a chat. Models with at
+      least `hot_requests` chats in the last `window` seconds are hot and get
+      `hot_keep_alive`. The rest get `cold_keep_alive`; None leaves Ollama's
+      default (5 minutes).
+    - evict() runs after each round of the pool's health checks. A host with
+      more than `max_loaded` models, or more than `max_bytes` of them, gets
+      its least recently used cold models unloaded (keep_alive 0) until it
+      is back under the limits. Hot models are never unloaded.
+    """
+
+    def __init__(self, pool, session=None, preload=(), hot_keep_alive='30m', cold_keep_alive=None,
+                 hot_requests=3, window=600, max_loaded=None, max_bytes=None, timeout=None,
+                 clock=time.monotonic):
+        self.pool = pool
+        self.session = session
+        self.preloaded = list(preload)
+        self.hot_keep_alive = hot_keep_alive
+        self.cold_keep_alive = cold_keep_alive
+        self.hot_requests = hot_requests
+        self.window = window
+        self.max_loaded = max_loaded
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        # model -> monotonic times of its recent chats
+        self._requests = defaultdict(deque)
+        if session is not None and (max_loaded or max_bytes):
+            pool.listeners.append(self.evict)
+
+    @classmethod
+    def from_settings(cls, pool, session=None):
+        from .transport import get_timeout
+
+        return cls(
+            pool,
+            session=session,
+            preload=getattr(settings, 'OLLAMA_PRELOAD_MODELS', ()),
+            hot_keep_alive=getattr(settings, 'OLLAMA_KEEP_ALIVE_HOT', '30m'),
+            cold_keep_alive=getattr(settings, 'OLLAMA_KEEP_ALIVE_COLD', None),
+            hot_requests=getattr(settings, 'OLLAMA_HOT_REQUESTS', 3),
+            window=getattr(settings, 'OLLAMA_HOT_WINDOW', 600),
+            max_loaded=getattr(settings, 'OLLAMA_MAX_LOADED_MODELS', None),
+            max_bytes=getattr(settings, 'OLLAMA_MAX_LOADED_BYTES', None),
+            timeout=get_timeout(),
+        )
+
+    def record(self, model):
+        """Counts a chat for `model`."""
+        now = self._clock()
+        with self._lock:
+            requests = self._requests[model]
+            requests.append(now)
+            self._prune(requests, now)
+
+    def _prune(self, requests, now):
+        # Called with _lock held
+        while requests and requests[0] < now - self.window:
+            requests.popleft()
+
+    def is_hot(self, model):
+        if model in self.preloaded:
+            return True
+        now = self._clock()
+        with self._lock:
+            requests = self._requests.get(model)
+            if not requests:
+                return False
+            self._prune(requests, now)
+            return len(requests) >= self.hot_requests
+
+    def last_used(self, model):
+        with self._lock:
+            requests = self._requests.get(model)
+            return requests[-1] if requests else float('-inf')
+
+    def keep_alive(self, model):
+        # Every request resets a model's keep_alive, so pinned ones keep theirs
+        if model in self.preloaded:
+            return PINNED
+        return self.hot_keep_alive if self.is_hot(model) else self.cold_keep_alive
+
+    def warm(self):
+        """Models loaded on some reachable host."""
+        return self.pool.warm_models()
+
+    def preload(self):
+        for model in self.preloaded:
+            try:
+                with self.pool.acquire(model) as backend:
+                    self._load(backend, model, PINNED)
+            except Exception as e:
+                print(f"Error preloading {model}: {e}")
+                continue
+            self.pool.record_success(backend, model)
+
+    def evict(self):
+        for backend in self.pool.backends:
+            resident = dict(backend.resident)
+            total = sum(entry.get('size', 0) for entry in resident.values())
+            cold = sorted((m for m in resident if not self.is_hot(m)), key=self.last_used)
+            for model in cold:
+                over_count = self.max_loaded is not None and len(resident) > self.max_loaded
+                over_bytes = self.max_bytes is not None and total > self.max_bytes
+                if not (over_count or over_bytes):
+                    break
+                try:
+                    self._load(backend, model, 0)
+                except Exception as e:
+                    print(f"Error unloading {model} from {backend.url}: {e}")
+                    continue
+                total -= resident.pop(model).get('size', 0)
+                self.pool.mark_unloaded(backend, model)
+
+    def _load(self, backend, model, keep_alive):
+        # A chat without messages only loads the model, or unloads it with
+        # keep_alive 0
+        response = self.session.post(
+            f"{backend.url}/api/chat",
+            json={'model': model, 'messages': [], 'stream': False, 'keep_alive': keep_alive},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
@@ -0,0 +1,212 @@
+import queue
+import threading
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+class Scheduler:
+    """
+    Base class for the job queue drained by OllamaService's workers (and,
+    without blocking, by AsyncOllamaService).
+
+    Jobs are the service's job dicts; schedulers read their 'user' and
+    'priority' keys. put() raises queue.Full once `depth` jobs are waiting.
+    get() blocks until a job is available for which `eligible(job)` is true
+    (the service uses this to respect per-model concurrency limits), and
+    returns None once the scheduler is closed.
+    """
+
+    def __init__(self, depth=5, **options):
+        self.depth = depth
+        self._cond = threading.Condition()
+        self._size = 0
+        self._closed = False
+
+    def __len__(self):
+        with self._cond:
+            return self._size
+
+    def put(self, job):
+        with self._cond:
+            if self._size >= self.depth:
+                raise queue.Full
+            self._push(job)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self, eligible=None):
+        eligible = eligible or (lambda job: True)
+        with self._cond:
+            while not self._closed:
+                job = self._pop(eligible)
+                if job is not None:
+                    self._size -= 1
+                    return job
+                self._cond.wait()
+            return None
+
+    def get_nowait(self, eligible=None):
+        """Like get(), but returns None at once if no eligible job is waiting."""
+        eligible = eligible or (lambda job: True)
+        with self._cond:
+            job = self._pop(eligible)
+            if job is not None:
+                self._size -= 1
+            return job
+
+    def remove(self, job):
+        """Drops a job that has not started yet. Returns False if it had."""
+        with self._cond:
+            if self._remove(job):
+                self._size -= 1
+                return True
+            return False
+
+    def position(self, job):
+        """1-based place of `job` in the serving order, or None if it isn't queued."""
+        with self._cond:
+            return self._position(job)
+
+    def notify(self):
+        """Wakes waiting workers, e.g. after a model slot was released."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _push(self, job):
+        raise NotImplementedError
+
+    def _pop(self, eligible):
+        raise NotImplementedError
+
+    def _remove(self, job):
+        raise NotImplementedError
+
+    def _position(self, job):
+        raise NotImplementedError
+
+class FIFOScheduler(Scheduler):
+    """First come, first served."""
+
+    def __init__(self, depth=5, **options):
+        super().__init__(depth)
+        self._jobs = deque()
+
+    def _push(self, job):
+        self._jobs.append(job)
+
+    def _pop(self, eligible):
+        for i, job in enumerate(self._jobs):
+            if eligible(job):
+                del self._jobs[i]
+                return job
+        return None
+
+    def _remove(self, job):
+        for i, queued in enumerate(self._jobs):
+            if queued is job:
+                del self._jobs[i]
+                return True
+        return False
+
+    def _position(self, job):
+        for i, queued in enumerate(self._jobs):
+            if queued is job:
+                return i + 1
+        return None
+
+class FairScheduler(Scheduler):
+    """
+    Priority classes served in order, with round-robin between users inside
+    each class, so one user's backlog can't hold everyone else up.
+
+    `priorities` lists the class names from most to least urgent; jobs with
+    an unknown class go into the last one. Each user may have at most
+    `per_user_depth` jobs waiting.
+    """
+
+    def __init__(self, depth=5, priorities=('default',), per_user_depth=None, **options):
+        super().__init__(depth)
+        self.priorities = list(priorities)
+        self.per_user_depth = per_user_depth
+        # class -> user -> deque of jobs; the OrderedDict order is the
+        # round-robin order of the users in that class
+        self._classes = {name: OrderedDict() for name in self.priorities}
+        self._per_user = {}
+
+    def _class_of(self, job):
+        priority = job.get('priority')
+        return priority if priority in self._classes else self.priorities[-1]
+
+    def _push(self, job):
+        user = job.get('user')
+        if self.per_user_depth is not None and self._per_user.get(user, 0) >= self.per_user_depth:
+            raise queue.Full
+        self._classes[self._class_of(job)].setdefault(user, deque()).append(job)
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+
+    def _pop(self, eligible):
+        for users in self._classes.values():
+            for user, jobs in users.items():
+                for i, job in enumerate(jobs):
+                    if eligible(job):
+                        del jobs[i]
+                        self._dequeued(users, user)
+                        # This user goes to the back of the rotation
+                        if user in users:
+                            users.move_to_end(user)
+                        return job
+        return None
+
+    def _remove(self, job):
+        users = self._classes[self._class_of(job)]
+        jobs = users.get(job.get('user'), ())
+        for i, queued in enumerate(jobs):
+            if queued is job:
+                del jobs[i]
+                self._dequeued(users, job.get('user'))
+                return True
+        return False
+
+    def _dequeued(self, users, user):
+        if not users[user]:
+            del users[user]
+        self._per_user[user] -= 1
+        if not self._per_user[user]:
+            del self._per_user[user]
+
+    def _position(self, job):
+        ahead = 0
+        job_class = self._class_of(job)
+        for name, users in self._classes.items():
+            if name != job_class:
+                ahead += sum(len(jobs) for jobs in users.values())
+                continue
+
+            jobs = users.get(job.get('user'), ())
+            index = next((i for i, queued in enumerate(jobs) if queued is job), None)
+            if index is None:
+                return None
+            # The job is served in round `index`; users earlier in the
+            # rotation get one more turn before it than users after it.
+            before = True
+            for user, other in users.items():
+                if other is jobs:
+                    before = False
+                    ahead += index
+                else:
+                    ahead += min(len(other), index + 1 if before else index)
+            return ahead + 1
+        return None
+
+def build_scheduler():
+    scheduler_class = import_string(getattr(settings, 'OLLAMA_SCHEDULER', 'chat.scheduler.FIFOScheduler'))
+    return scheduler_class(
+        depth=getattr(settings, 'OLLAMA_QUEUE_SIZE', 5),
+        priorities=getattr(settings, 'OLLAMA_PRIORITIES', ('default',)),
+        per_user_depth=getattr(settings, 'OLLAMA_USER_QUEUE_SIZE', None),
+    )
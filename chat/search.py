@@ -0,0 +1,142 @@
+import re
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from .models import Message
+
+# SQLite: an FTS5 table with one row per message (rowid = message id). The
+# `owner` column holds a "u<user id>" token, so restricting a search to one
+# user is a posting-list intersection inside FTS rather than a filter over
+# every match. See migration 0007.
+FTS_TABLE = 'chat_message_fts'
+
+# PostgreSQL: an expression GIN index on to_tsvector(TS_CONFIG, content)
+TS_CONFIG = 'english'
+
+# Marks around matched terms in snippets, replaced after escaping
+_START, _END = '\x02', '\x03'
+
+# A word, optionally followed by * to match it as a prefix
+WORD = re.compile(r'(\w+)(\*?)', re.UNICODE)
+
+def backend():
+    if connection.vendor == 'sqlite':
+        return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'tsvector'
+    return None
+
+def fts_query(text, owner=None):
+    """
+    Turns free text into an FTS5 query matching messages that contain all of
+    its words; "word*" matches any word starting with it. Returns None if
+    there is nothing to search for.
+
+    Prefixes are opt-in: a short, common one expands to the posting lists
+    of every word it starts, which costs a scan of most of the index.
+    """
+    terms = [f'"{word}"{star}' for word, star in WORD.findall(text)]
+    if not terms:
+        return None
+    query = f"body : ({' AND '.join(terms)})"
+    if owner is not None:
+        query = f'owner : "u{owner}" AND {query}'
+    return query
+
+def search_messages(text, user_id, limit=20):
+    """
+    The user's messages matching `text`, best first, as dicts with the
+    message and conversation ids, the conversation title, role, created_at
+    and an HTML snippet with the matches in <mark>.
+    """
+    if backend() == 'fts5':
+        query = fts_query(text, owner=user_id)
+        if query is None:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, '…', 12) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+                [_START, _END, query, limit],
+            )
+            hits = cursor.fetchall()
+        # The owner token narrows the search; the database has the final say
+        messages = (
+            Message.objects.filter(conversation__user_id=user_id).select_related('conversation')
+            .only('id', 'conversation_id', 'role', 'created_at', 'conversation__title')
+            .in_bulk([id for id, _ in hits])
+        )
+        return [_result(messages[id], snippet) for id, snippet in hits if id in messages]
+
+    messages = Message.objects.filter(conversation__user_id=user_id).select_related('conversation')
+    if backend() == 'tsvector':
+        from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+
+        query = SearchQuery(text, config=TS_CONFIG, search_type='websearch')
+        vector = SearchVector('content', config=TS_CONFIG)
+        messages = messages.annotate(
+            search=vector,
+            rank=SearchRank(vector, query),
+            snippet=SearchHeadline('content', query, config=TS_CONFIG, start_sel=_START, stop_sel=_END),
+        ).filter(search=query).order_by('-rank')
+    else:
+        messages = messages.filter(content__icontains=text).order_by('-created_at')
+    return [_result(m, getattr(m, 'snippet', m.content[:200])) for m in messages[:limit]]
+
+def _result(message, snippet):
+    return {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'conversation_title': message.conversation.title,
+        'role': message.role,
+        'created_at': message.created_at.isoformat(),
+        'snippet': escape(snippet).replace(_START, '<mark>').replace(_END, '</mark>'),
+    }
+
+def filter_messages(queryset, text):
+    """Narrows a Message queryset to full-text matches of `text`, for any user."""
+    if backend() == 'fts5':
+        query = fts_query(text)
+        if query is None:
+            return queryset.none()
+        return queryset.filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query]))
+    if backend() == 'tsvector':
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+
+        return queryset.annotate(
+            search=SearchVector('content', config=TS_CONFIG)
+        ).filter(search=SearchQuery(text, config=TS_CONFIG, search_type='websearch'))
+    return queryset.filter(content__icontains=text)
+
+def index_messages(messages, created=False):
+    """
+    Adds or refreshes the index entries of saved messages; pass `created`
+    for rows that can't have one yet. PostgreSQL's index is maintained by
+    the database, so this only does work on SQLite.
+    """
+    if backend() != 'fts5':
+        return
+    rows = [(m.id, m.content, f"u{m.conversation.user_id}") for m in messages if m.id is not None]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        if not created:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, body, owner) VALUES (%s, %s, %s)", rows)
+
+def set_owner(conversation):
+    """Re-tags the index entries of a conversation's messages after it changed hands."""
+    if backend() != 'fts5':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {FTS_TABLE} SET owner = %s "
+            f"WHERE rowid IN (SELECT id FROM {Message._meta.db_table} WHERE conversation_id = %s)",
+            [f"u{conversation.user_id}", conversation.id],
+        )
+
+def unindex_messages(ids):
+    if backend() != 'fts5' or not ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(id,) for id in ids])
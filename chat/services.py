@@ -1,8 +1,44 @@
 import queue
+import socket
 import threading
-import requests
-import json
 import time
+from collections import defaultdict
+from contextlib import contextmanager
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from .backends import BackendPool
+from .cache import cache_key, cacheable_key, get_response_cache
+from .catalog import ModelCatalog
+from .coalesce import EMPTY, Coalescer, merged
+from .deadlines import Deadlines
+from .ndjson import iter_ndjson
+from .residency import ResidencyManager
+from .scheduler import build_scheduler
+from . import metrics, summaries
+from .transport import build_session, get_timeout, pool_stats
+
+def build_chat_payload(model, messages, stream=True, options=None, keep_alive=None):
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": stream
+    }
+    if options:
+        payload["options"] = options
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+def replay(chunks):
+    """Streams a cached response the same way a live one is streamed."""
+    yield from merged(chunks, Coalescer.from_settings())
+
+class StreamCancelled(Exception):
+    """Ends the iteration of a ChatStream whose cancel() was called."""
+
+    def __init__(self):
+        super().__init__("The chat was cancelled")
 
 class OllamaService:
     _instance = None
@@ -16,97 +52,593 @@ class OllamaService:
                     cls._instance._initialized = False
         return cls._instance
 
+    @classmethod
+    def reset(cls):
+        """
+        Stops the current instance's workers and drops the singleton, so the
+        next OllamaService() picks up the current settings.
+        """
+        with cls._lock:
+            instance, cls._instance = cls._instance, None
+        if instance is not None and instance._initialized:
+            instance.shutdown()
+
     def __init__(self):
         if self._initialized:
             return
         
-        # Queue size N=5
-        self.queue = queue.Queue(maxsize=5)
-        self.worker_thread = threading.Thread(target=self._worker, daemon=True)
-        self.worker_thread.start()
+        self.session = build_session()
+        self.timeout = get_timeout()
+        # The Ollama hosts (OLLAMA_BASE_URLS, or just OLLAMA_BASE_URL)
+        self.pool = BackendPool.from_settings(self.session)
+        self.base_url = self.pool.backends[0].url
+        # Preloads OLLAMA_PRELOAD_MODELS, picks each chat's keep_alive and
+        # unloads cold models from hosts over their limits
+        self.residency = ResidencyManager.from_settings(self.pool, self.session)
+        if self.residency.preloaded:
+            threading.Thread(target=self.residency.preload, name="ollama-preload", daemon=True).start()
+        self.catalog = ModelCatalog(
+            self.fetch_models,
+            ttl=getattr(settings, 'OLLAMA_MODELS_TTL', 30),
+            stale_ttl=getattr(settings, 'OLLAMA_MODELS_STALE_TTL', 300),
+            cache_alias=getattr(settings, 'OLLAMA_MODELS_CACHE', None),
+        )
+        self.scheduler = build_scheduler()
+
+        # Per-model concurrency limits. Workers only take jobs whose model has
+        # a free slot, so a model at its limit waits in the scheduler while
+        # the remaining workers keep serving other models.
+        self.model_limits = dict(getattr(settings, 'OLLAMA_MODEL_CONCURRENCY', {}))
+        self._model_lock = threading.Lock()
+        self._active = defaultdict(int)
+        self._cancel_lock = threading.Lock()
+        self._summary_lock = threading.Lock()
+        self._summarizing = set()
+
+        # Identical chat requests in flight share one generation; see process_chat
+        self.coalesce = getattr(settings, 'OLLAMA_COALESCE', True)
+        self._flight_lock = threading.Lock()
+        self._flights = {}
+
+        # Bound on chunks waiting for each subscriber; see _put
+        self.response_queue_size = getattr(settings, 'OLLAMA_RESPONSE_QUEUE_SIZE', 256)
+
+        # Moving average of how long a job holds a worker, for queue ETAs
+        self.avg_duration = None
+
+        self.workers = []
+        for i in range(max(1, getattr(settings, 'OLLAMA_WORKERS', 1))):
+            worker = threading.Thread(target=self._worker, name=f"ollama-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
         self._initialized = True
-        self.base_url = "http://localhost:11434"
+
+    def shutdown(self, timeout=5):
+        self.scheduler.close()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+        self.pool.close()
+        self.session.close()
+
+    def pool_stats(self):
+        return pool_stats(self.session)
 
     def get_available_models(self):
-        try:
-            response = requests.get(f"{self.base_url}/api/tags")
-            if response.status_code == 200:
-                data = response.json()
-                return [model['name'] for model in data.get('models', [])]
-            return []
-        except Exception as e:
-            print(f"Error fetching models: {e}")
-            return []
+        return self.catalog.get()['models']
+
+    def fetch_models(self):
+        """
+        Asks every Ollama host for its installed models, bypassing the catalog
+        cache, and returns them all. Hosts that fail are left out, unless all do.
+        """
+        models = {}
+        error = None
+        for backend in self.pool.backends:
+            try:
+                response = self.session.get(f"{backend.url}/api/tags", timeout=self.timeout)
+                response.raise_for_status()
+                names = [model['name'] for model in response.json().get('models', [])]
+            except Exception as e:
+                error = e
+                continue
+            self.pool.set_installed(backend, names)
+            models.update(dict.fromkeys(names))
+        if error is not None and not models:
+            raise error
+        return list(models)
 
-    def process_chat(self, messages, model="llama3.1:8b"):
+    @contextmanager
+    def _post(self, model, path, payload, stream=False):
+        """
+        POSTs to the Ollama host the pool picks for `model` and yields
+        (backend, response), counting the request against the host until the
+        block exits. A host that can't be reached or answers 5xx is marked as
+        failing and the next one is tried; the last one's error is returned.
+        """
+        tried = []
+        while True:
+            with self.pool.acquire(model, exclude=tried) as backend:
+                tried.append(backend)
+                last = self.pool.choose(model, exclude=tried) is None
+                try:
+                    response = self.session.post(
+                        f"{backend.url}{path}", json=payload, stream=stream, timeout=self.timeout,
+                    )
+                except (requests.ConnectionError, requests.Timeout):
+                    self.pool.record_failure(backend)
+                    if last:
+                        raise
+                    continue
+                if response.status_code >= 500:
+                    self.pool.record_failure(backend)
+                    if not last:
+                        response.close()
+                        continue
+                with response:
+                    yield backend, response
+                return
+
+    def model_limit(self, model):
+        return self.model_limits.get(model, self.model_limits.get('*'))
+
+    def pending(self):
+        """Number of accepted jobs that have not started yet."""
+        return len(self.scheduler)
+
+    def queue_status(self, job):
+        """
+        Returns {'position': n, 'eta': seconds or None} while `job` waits,
+        or None once a worker has picked it up.
+        """
+        position = self.scheduler.position(job)
+        if position is None:
+            return None
+        eta = None
+        if self.avg_duration is not None:
+            # Jobs ahead drain len(workers) at a time
+            rounds = (position - 1) // len(self.workers) + 1
+            eta = round(rounds * self.avg_duration, 1)
+        return {'position': position, 'eta': eta}
+
+    def process_chat(self, messages, model="llama3.1:8b", user=None, priority='default', options=None):
         """
         Adds chat request to queue.
         Args:
             messages: List of dicts [{'role': 'user'|'assistant', 'content': '...'}]
             model: Model name string
+            user: Id used by the scheduler to share workers fairly between users
+            priority: Scheduler priority class, see OLLAMA_PRIORITIES
+            options: Ollama model options (temperature, seed, ...)
         Returns:
-            - Generator yielding response chunks
+            - ChatStream yielding response chunks, and {'queue': {...}} status
+              dicts while the request waits for a worker. Closing it early
+              cancels the request.
             - Raises queue.Full if queue is full
+
+        A request identical to one already queued or running (same model,
+        messages and options) subscribes to that job instead of queueing its
+        own: it gets the chunks produced so far, then the rest as they come.
+        The job is only cancelled once all of its subscribers have gone.
         """
-        response_queue = queue.Queue()
-        
-        try:
-            # Try to put in queue, non-blocking if full
-            self.queue.put_nowait({
+        key = cacheable_key(model, messages, options)
+        if key is not None:
+            cached = get_response_cache().get(key)
+            if cached is not None:
+                metrics.REQUESTS.inc(model=model, outcome='cached')
+                return replay(cached)
+
+        flight_key = cache_key(model, messages, options) if self.coalesce else None
+        with self._flight_lock:
+            if flight_key is not None:
+                job = self._flights.get(flight_key)
+                response_queue = job and self._subscribe(job)
+                if response_queue:
+                    metrics.REQUESTS.inc(model=model, outcome='coalesced')
+                    return ChatStream(self, job, response_queue)
+
+            queued_at = time.monotonic()
+            response_queue = queue.Queue(self.response_queue_size)
+
+            job = {
                 'type': 'chat',
                 'messages': messages,
                 'model': model,
-                'response_queue': response_queue
-            })
+                'options': options,
+                'cache_key': key,
+                'flight_key': flight_key,
+                'user': user,
+                'priority': priority,
+                'subscribers': [response_queue],
+                'history': [],
+                'finished': False,
+                'lock': threading.Lock(),
+                'cancelled': threading.Event(),
+                'upstream': None,
+                'queued_at': queued_at,
+                'started_at': None,
+                'deadlines': Deadlines(model, queued_at),
+                # The stage whose deadline ended the job, if one did
+                'expired': None,
+            }
+            self._enqueue(job)
+            if flight_key is not None:
+                self._flights[flight_key] = job
+        return ChatStream(self, job, response_queue)
+
+    def _enqueue(self, job):
+        # Counted first, as a worker may take the job as soon as it is in
+        metrics.QUEUE_DEPTH.inc(model=job['model'])
+        try:
+            self.scheduler.put(job)
         except queue.Full:
+            metrics.QUEUE_DEPTH.dec(model=job['model'])
             raise
 
-        # Yield from response_queue
+    def _subscribe(self, job):
+        """Adds a late joiner to a chat job, replaying what it missed; returns its queue."""
+        with job['lock']:
+            if job['finished'] or job['cancelled'].is_set():
+                return None
+            # Room for what it missed on top of the usual bound
+            response_queue = queue.Queue(self.response_queue_size + len(job['history']))
+            for item in job['history']:
+                response_queue.put_nowait(item)
+            job['subscribers'].append(response_queue)
+            return response_queue
+
+    def _unsubscribe(self, job, response_queue):
+        """Detaches a subscriber that went away; the last one cancels the job."""
+        with self._flight_lock:
+            with job['lock']:
+                if response_queue in job['subscribers']:
+                    job['subscribers'].remove(response_queue)
+                if job['subscribers'] or job['finished']:
+                    return
+            self._land(job)
+        self.cancel(job)
+
+    def _publish(self, job, item):
+        with job['lock']:
+            if job['flight_key'] is not None:
+                job['history'].append(item)
+            subscribers = list(job['subscribers'])
+        for response_queue in subscribers:
+            self._put(job, response_queue, item)
+
+    def _finish(self, job):
+        """Signals end of stream to all subscribers and stops taking new ones."""
+        with self._flight_lock:
+            self._land(job)
+            with job['lock']:
+                job['finished'] = True
+                job['history'] = []
+                subscribers = list(job['subscribers'])
+        for response_queue in subscribers:
+            self._put(job, response_queue, None)
+
+    def _put(self, job, response_queue, item):
+        """
+        Hands `item` to a subscriber. Response queues are bounded
+        (OLLAMA_RESPONSE_QUEUE_SIZE), so while a client reads slower than
+        Ollama generates, this blocks the worker and it stops reading from
+        Ollama until the client catches up. Gives up once the subscriber is
+        gone.
+        """
         while True:
-            chunk = response_queue.get()
-            if chunk is None:
-                break
-            if isinstance(chunk, Exception):
-                raise chunk
-            yield chunk
+            try:
+                response_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if response_queue not in job['subscribers']:
+                    return
+                if job['deadlines'].passed(True, True):
+                    # Out of time with a subscriber that stopped reading
+                    job['expired'] = 'total'
+                    self.cancel(job)
+                    return
+
+    def _land(self, job):
+        # Called with _flight_lock held
+        if job['flight_key'] is not None and self._flights.get(job['flight_key']) is job:
+            del self._flights[job['flight_key']]
+
+    def complete(self, messages, model):
+        """Runs a non-streaming chat and returns the reply text."""
+        payload = build_chat_payload(model, messages, stream=False)
+        with self._post(model, "/api/chat", payload) as (backend, response):
+            if response.status_code != 200:
+                raise Exception(f"Ollama API Error: {response.status_code} - {response.text}")
+            self.pool.record_success(backend, model)
+            return response.json().get('message', {}).get('content', '')
+
+    def request_summary(self, conversation, model):
+        """
+        Queues a background job folding older messages of `conversation` into
+        its rolling summary, if summaries are enabled and enough unsummarized
+        history has built up. Never blocks or fails the caller: the job is
+        skipped when the queue is full and retried after a later turn.
+        """
+        if not summaries.summaries_enabled() or not summaries.needs_summary(conversation, model):
+            return False
+        with self._summary_lock:
+            if conversation.id in self._summarizing:
+                return False
+            self._summarizing.add(conversation.id)
+        job = {
+            'type': 'summarize',
+            'conversation_id': conversation.id,
+            'model': summaries.summary_model(model),
+            'chat_model': model,
+            'user': None,
+            'priority': 'background',
+            'cancelled': threading.Event(),
+            'upstream': None,
+            'queued_at': time.monotonic(),
+        }
+        try:
+            self._enqueue(job)
+        except queue.Full:
+            with self._summary_lock:
+                self._summarizing.discard(conversation.id)
+            return False
+        return True
+
+    def cancel(self, job):
+        """
+        Stops a job whose client went away. A queued job is dropped; a running
+        one has its upstream connection to Ollama torn down so the worker and
+        the model slot are freed right away.
+        """
+        job['cancelled'].set()
+        if self.scheduler.remove(job):
+            metrics.QUEUE_DEPTH.dec(model=job['model'])
+            if job['type'] == 'chat':
+                metrics.REQUESTS.inc(model=job['model'], outcome='timeout' if job['expired'] else 'cancelled')
+            return
+        with self._cancel_lock:
+            if job['upstream'] is not None:
+                _abort(job['upstream'])
+
+    def _stream(self, job, response_queue, stop):
+        interval = getattr(settings, 'OLLAMA_QUEUE_STATUS_INTERVAL', 1.0)
+        timeout = min(interval, 0.1)
+        last_status = None
+        finished = False
+        streaming = False
+        deadlines = job['deadlines']
+        # Tokens are sent in frames; see Coalescer
+        coalescer = Coalescer.from_settings()
+        pending = EMPTY
+
+        def take():
+            try:
+                return response_queue.get_nowait()
+            except queue.Empty:
+                return EMPTY
+
+        try:
+            while True:
+                if stop.is_set():
+                    raise StreamCancelled()
+                stage, remaining = deadlines.next(job['started_at'] is not None, streaming)
+                if remaining is not None and remaining <= 0:
+                    # The last subscriber to leave (see finally) cancels the job
+                    job['expired'] = stage
+                    raise deadlines.exceeded(stage)
+                # Even with nothing to wait for, wake up now and then to
+                # notice stop
+                wait = interval if timeout is None else timeout
+                try:
+                    if pending is not EMPTY:
+                        chunk, pending = pending, EMPTY
+                    elif remaining is not None and remaining < wait:
+                        chunk = response_queue.get(timeout=remaining)
+                    else:
+                        chunk = response_queue.get(timeout=wait)
+                except queue.Empty:
+                    status = self.queue_status(job)
+                    if status is None:
+                        # Picked up by a worker; just wait for output from now on
+                        timeout = None
+                    elif status != last_status:
+                        last_status = status
+                        yield {'queue': status}
+                    if timeout is not None:
+                        timeout = interval
+                    continue
+                if chunk is None:
+                    finished = True
+                    break
+                if isinstance(chunk, Exception):
+                    finished = True
+                    raise chunk
+                timeout = None
+                streaming = True
+                delay = coalescer.delay()
+                if delay:
+                    time.sleep(delay)
+                frames, pending = coalescer.merge(chunk, take)
+                yield from frames
+        finally:
+            # Closed early: the client disconnected
+            if not finished:
+                self._unsubscribe(job, response_queue)
 
     def _worker(self):
         while True:
-            data = self.queue.get()
-            response_queue = data.get('response_queue')
-            
+            data = self.scheduler.get(self._acquire_model)
+            if data is None:
+                break
+            started = time.monotonic()
+            data['started_at'] = started
+            model = data['model']
+            metrics.QUEUE_DEPTH.dec(model=model)
+            metrics.QUEUE_WAIT.observe(started - data['queued_at'], model=model)
+            metrics.ACTIVE.inc(model=model)
             try:
-                # Process the request
+                self._handle(data)
+            finally:
+                metrics.ACTIVE.dec(model=model)
+                self._release_model(model)
                 if data['type'] == 'chat':
-                    payload = {
-                        "model": data['model'],
-                        "messages": data['messages'],
-                        "stream": True
-                    }
-                    with requests.post(f"{self.base_url}/api/chat", json=payload, stream=True) as response:
-                        if response.status_code == 200:
-                            buffer = b""
-                            for chunk in response.iter_content(chunk_size=None):
-                                if chunk:
-                                    buffer += chunk
-                                    while b"\n" in buffer:
-                                        line, buffer = buffer.split(b"\n", 1)
-                                        if line:
-                                            try:
-                                                json_response = json.loads(line)
-                                                content = json_response.get('message', {}).get('content', '')
-                                                if content:
-                                                    response_queue.put(content)
-                                                if json_response.get('done', False):
-                                                    break
-                                            except json.JSONDecodeError:
-                                                continue
+                    self._record_duration(time.monotonic() - started)
+
+    def _acquire_model(self, data):
+        """Claims a slot for the job's model if one is free. Called by the scheduler."""
+        model = data['model']
+        limit = self.model_limit(model)
+        with self._model_lock:
+            if limit is not None and self._active[model] >= limit:
+                return False
+            self._active[model] += 1
+            return True
+
+    def _release_model(self, model):
+        with self._model_lock:
+            self._active[model] -= 1
+        # Jobs for this model may have been skipped while it was full
+        self.scheduler.notify()
+
+    def _record_duration(self, duration):
+        if self.avg_duration is None:
+            self.avg_duration = duration
+        else:
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+
+    def _handle(self, data):
+        if data['type'] == 'summarize':
+            self._summarize(data)
+            return
+
+        model = data['model']
+        started = time.monotonic()
+        outcome = 'cancelled'
+        backend = None
+        try:
+            # Process the request
+            if not data['cancelled'].is_set():
+                self.residency.record(model)
+                payload = build_chat_payload(model, data['messages'], options=data['options'],
+                                             keep_alive=self.residency.keep_alive(model))
+                with self._post(model, "/api/chat", payload, stream=True) as (backend, response):
+                    # Let cancel() reach the connection while we read from it.
+                    # It is unregistered before the connection can go back to
+                    # the pool, so cancel() never tears down another job's.
+                    with self._cancel_lock:
+                        data['upstream'] = response
+                    try:
+                        if data['cancelled'].is_set():
+                            # Cancelled while connecting. Leaving the body unread
+                            # makes the with-block drop the connection.
+                            pass
+                        elif response.status_code == 200:
+                            # Read to the end of the body even after 'done', so
+                            # the connection goes back to the pool for reuse.
+                            chunks = []
+                            done = False
+                            for json_response in iter_ndjson(response.iter_content(chunk_size=None)):
+                                if data['cancelled'].is_set():
+                                    break
+                                content = json_response.get('message', {}).get('content', '')
+                                if content:
+                                    if not chunks:
+                                        metrics.TIME_TO_FIRST_TOKEN.observe(
+                                            time.monotonic() - data['queued_at'], model=model,
+                                        )
+                                    chunks.append(content)
+                                    self._publish(data, content)
+                                if json_response.get('done', False) and not done:
+                                    done = True
+                                    metrics.observe_done(model, json_response)
+                            if data['cancelled'].is_set():
+                                pass
+                            elif done:
+                                outcome = 'done'
+                                self.pool.record_success(backend, model)
+                                metrics.GENERATION.observe(time.monotonic() - started, model=model)
+                                # Only complete generations are worth replaying
+                                if data['cache_key']:
+                                    get_response_cache().set(data['cache_key'], chunks)
+                            else:
+                                outcome = 'error'
+                                self.pool.record_failure(backend)
+                                metrics.UPSTREAM_ERRORS.inc(model=model, kind='incomplete')
                         else:
-                            response_queue.put(Exception(f"Ollama API Error: {response.status_code} - {response.text}"))
-            except Exception as e:
-                if response_queue:
-                    response_queue.put(e)
-            finally:
-                if response_queue:
-                    response_queue.put(None) # Signal end of stream
-                self.queue.task_done()
+                            outcome = 'error'
+                            metrics.UPSTREAM_ERRORS.inc(model=model, kind=str(response.status_code))
+                            self._publish(data, Exception(f"Ollama API Error: {response.status_code} - {response.text}"))
+                    finally:
+                        with self._cancel_lock:
+                            data['upstream'] = None
+        except Exception as e:
+            if not data['cancelled'].is_set():
+                outcome = 'error'
+                if backend is not None:
+                    # Failed mid-stream; connection failures are counted by _post
+                    self.pool.record_failure(backend)
+                metrics.UPSTREAM_ERRORS.inc(model=model, kind=type(e).__name__)
+                self._publish(data, e)
+        finally:
+            if outcome == 'cancelled' and data['expired']:
+                outcome = 'timeout'
+            metrics.REQUESTS.inc(model=model, outcome=outcome)
+            self._finish(data) # Signal end of stream
+
+    def _summarize(self, data):
+        close_old_connections()
+        try:
+            summaries.summarize(data['conversation_id'], data['chat_model'], self.complete)
+        except Exception as e:
+            print(f"Error summarizing conversation {data['conversation_id']}: {e}")
+        finally:
+            with self._summary_lock:
+                self._summarizing.discard(data['conversation_id'])
+            close_old_connections()
+
+class ChatStream:
+    """
+    Iterator over a chat job's output for one subscriber. Closing it before
+    the end cancels the job if no other subscriber is left, including when
+    iteration never started.
+    """
+
+    def __init__(self, service, job, response_queue):
+        self.service = service
+        self.job = job
+        self.response_queue = response_queue
+        self._stop = threading.Event()
+        self._generator = service._stream(job, response_queue, self._stop)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._generator)
+
+    def close(self):
+        self._generator.close()
+        self.service._unsubscribe(self.job, self.response_queue)
+
+    def cancel(self):
+        """
+        Safe from any thread: the thread iterating the stream gets
+        StreamCancelled within OLLAMA_QUEUE_STATUS_INTERVAL seconds, and
+        closes it as usual.
+        """
+        self._stop.set()
+
+def _abort(response):
+    """
+    Tears down a streaming response's connection, even while another thread
+    is blocked reading from it. The connection is not returned to the pool.
+    """
+    connection = getattr(response.raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    else:
+        response.close()
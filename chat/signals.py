@@ -1,14 +1,51 @@
 from django.contrib.auth.signals import user_logged_in
-from django.dispatch import receiver
-from .models import UserLoginLog
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from .models import Conversation, Message
+from .audit import get_audit_writer
+from . import search
+
+# Sent after chat.persistence writes a batch of messages with bulk_create /
+# bulk_update, which bypass post_save. Arguments: created, updated.
+messages_persisted = Signal()
 
 @receiver(user_logged_in)
 def log_user_login(sender, request, user, **kwargs):
     ip_address = request.META.get('REMOTE_ADDR')
     user_agent = request.META.get('HTTP_USER_AGENT', '')
-    
-    UserLoginLog.objects.create(
-        user=user,
-        ip_address=ip_address,
-        user_agent=user_agent
-    )
+
+    get_audit_writer().record(user, ip_address=ip_address, user_agent=user_agent)
+
+@receiver(post_save, sender=Conversation)
+@receiver(post_delete, sender=Conversation)
+def invalidate_conversation_count(sender, instance, created=True, **kwargs):
+    # Renames and touches don't change the count; deletes (no `created`) do
+    if created:
+        cache.delete(Conversation.count_cache_key(instance.user_id))
+
+@receiver(post_save, sender=Conversation)
+def follow_owner_change(sender, instance, created, raw=False, **kwargs):
+    # E.g. reassigned in the admin: the messages' index entries carry the owner
+    previous = getattr(instance, '_loaded_user_id', None)
+    if created or raw or previous is None or previous == instance.user_id:
+        return
+    search.set_owner(instance)
+    cache.delete_many([Conversation.count_cache_key(previous), Conversation.count_cache_key(instance.user_id)])
+    instance._loaded_user_id = instance.user_id
+
+# Keep the full-text index (chat.search) in step with the messages
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        search.index_messages([instance], created=created)
+
+@receiver(messages_persisted)
+def index_persisted_messages(sender, created, updated, **kwargs):
+    search.index_messages(created, created=True)
+    search.index_messages(updated)
+
+@receiver(post_delete, sender=Message)
+def unindex_message(sender, instance, **kwargs):
+    search.unindex_messages([instance.id])
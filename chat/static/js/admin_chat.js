@@ -0,0 +1,22 @@
+// "Load earlier messages" for the conversation chat visual in the admin
+document.addEventListener('click', async (event) => {
+    const button = event.target.closest('.chat-visual-more');
+    if (!button) return;
+
+    const visual = button.closest('.chat-visual');
+    const list = visual.querySelector('.chat-visual-messages');
+    button.disabled = true;
+    try {
+        const url = `${visual.dataset.url}?before=${encodeURIComponent(button.dataset.before)}`;
+        const response = await fetch(url, { credentials: 'same-origin' });
+        const data = await response.json();
+        list.insertAdjacentHTML('afterbegin', data.html);
+        if (data.before) {
+            button.dataset.before = data.before;
+        } else {
+            button.remove();
+        }
+    } finally {
+        button.disabled = false;
+    }
+});
@@ -5,6 +5,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const sendBtn = document.getElementById('send-btn');
     const newChatBtn = document.getElementById('new-chat-btn');
     const historyList = document.getElementById('history-list');
+    const historyCount = document.getElementById('history-count');
     const currentChatTitle = document.getElementById('current-chat-title');
     const modelSelect = document.getElementById('model-select');
 
@@ -15,6 +16,11 @@ document.addEventListener('DOMContentLoaded', () => {
 
     let currentConversationId = null;
 
+    // The page only renders the first conversations; the rest are fetched
+    // as the sidebar is scrolled
+    let historyCursor = historyList.dataset.next || null;
+    let loadingHistory = false;
+
     // Fetch available models
     fetchModels();
 
@@ -23,11 +29,13 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/api/models/');
             const data = await response.json();
             if (data.models && data.models.length > 0) {
+                const warm = new Set(data.warm || []);
                 modelSelect.innerHTML = '';
                 data.models.forEach(model => {
                     const option = document.createElement('option');
                     option.value = model;
-                    option.text = model;
+                    // Loaded models answer right away; others load first
+                    option.text = warm.has(model) ? `${model} (loaded)` : model;
                     if (model.includes('llama3.1:8b')) option.selected = true;
                     modelSelect.appendChild(option);
                 });
@@ -97,22 +105,89 @@ document.addEventListener('DOMContentLoaded', () => {
         closeSidebarOnMobile();
     });
 
+    const MESSAGES_PAGE = 50;
+
+    historyList.addEventListener('scroll', () => {
+        if (historyList.scrollTop + historyList.clientHeight >= historyList.scrollHeight - 200) {
+            loadMoreHistory();
+        }
+    });
+    loadMoreHistory();
+
+    async function loadMoreHistory() {
+        if (!historyCursor || loadingHistory) return;
+        loadingHistory = true;
+        try {
+            const response = await fetch(`/api/conversations/?after=${encodeURIComponent(historyCursor)}`);
+            const data = await response.json();
+            (data.conversations || []).forEach(conv => {
+                // Conversations updated since the page loaded may be listed already
+                if (historyList.querySelector(`.history-item[data-id="${conv.id}"]`)) return;
+                historyList.appendChild(createHistoryItem(conv.id, conv.title));
+            });
+            historyCursor = data.next;
+        } catch (err) {
+            console.error("Failed to load conversations", err);
+            historyCursor = null;
+        } finally {
+            loadingHistory = false;
+        }
+        // Keep going until the sidebar can scroll
+        if (historyList.scrollHeight <= historyList.clientHeight) {
+            loadMoreHistory();
+        }
+    }
+
     async function loadMessages(conversationId) {
         chatArea.innerHTML = ''; // Clear chat
         try {
-            const response = await fetch(`/api/messages/${conversationId}/`);
+            // Newest page first; older ones are fetched on demand
+            const response = await fetch(`/api/messages/${conversationId}/?latest=${MESSAGES_PAGE}`);
             const data = await response.json();
 
             if (data.messages) {
                 data.messages.forEach(msg => {
                     appendMessage(msg.content, msg.role);
                 });
+                showLoadEarlier(conversationId, data.prev);
             }
         } catch (err) {
             console.error("Failed to load messages", err);
         }
     }
 
+    function showLoadEarlier(conversationId, cursor) {
+        const existing = chatArea.querySelector('.load-earlier');
+        if (existing) existing.remove();
+        if (!cursor) return;
+
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.className = 'load-earlier';
+        button.innerText = 'Load earlier messages';
+        button.addEventListener('click', async () => {
+            button.disabled = true;
+            try {
+                const response = await fetch(`/api/messages/${conversationId}/?limit=${MESSAGES_PAGE}&before=${encodeURIComponent(cursor)}`);
+                const data = await response.json();
+                if (conversationId != currentConversationId || !data.messages) return;
+
+                // Keep the view where it was while older messages go in above
+                const fromBottom = chatArea.scrollHeight - chatArea.scrollTop;
+                const anchor = button.nextSibling;
+                data.messages.forEach(msg => {
+                    chatArea.insertBefore(createMessage(msg.content, msg.role), anchor);
+                });
+                chatArea.scrollTop = chatArea.scrollHeight - fromBottom;
+                showLoadEarlier(conversationId, data.prev);
+            } catch (err) {
+                console.error("Failed to load messages", err);
+                button.disabled = false;
+            }
+        });
+        chatArea.insertBefore(button, chatArea.firstChild);
+    }
+
     chatForm.addEventListener('submit', async (e) => {
         e.preventDefault();
         const prompt = userInput.value.trim();
@@ -134,6 +209,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                 },
                 body: JSON.stringify({
                     prompt: prompt,
@@ -157,49 +233,64 @@ document.addEventListener('DOMContentLoaded', () => {
 
             // Clear typing indicator before streaming
             botMsgContent.innerHTML = '';
+            let queued = false;
+            let streamId = null;
+            let lastEventId = null;
+            let finished = false;
+
+            const handleEvent = (data, id) => {
+                if (id !== null) lastEventId = id;
+                if (data.conversation_id) {
+                    streamId = data.stream_id;
+                    // If it was a new chat, update ID and sidebar
+                    if (!currentConversationId) {
+                        currentConversationId = data.conversation_id;
+                        currentChatTitle.innerText = data.title;
+                        addHistoryItem(data.conversation_id, data.title);
+                    }
+                } else if (data.queue) {
+                    // Still waiting for a worker: show our place in line
+                    const eta = data.queue.eta ? `, ~${Math.ceil(data.queue.eta)}s` : '';
+                    botMsgContent.innerText = `⏳ Queued (position ${data.queue.position}${eta})`;
+                    queued = true;
+                } else if (data.content) {
+                    if (queued) {
+                        botMsgContent.innerHTML = '';
+                        queued = false;
+                    }
+                    // Plain text mode: newlines become <br>
+                    botMsgContent.innerHTML += data.content.replace(/\n/g, '<br>');
+                    chatArea.scrollTop = chatArea.scrollHeight;
+                } else if (data.error) {
+                    botMsgContent.innerText += `\n[Error: ${data.error}]`;
+                    botMsgContent.classList.add('error-message');
+                } else if (data.done) {
+                    finished = true;
+                }
+            };
+
+            try {
+                await readEvents(response, handleEvent);
+            } catch (err) {
+                if (!streamId) throw err;
+                console.warn("Chat stream interrupted", err);
+            }
 
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-            let buffer = '';
-
-            while (true) {
-                const { done, value } = await reader.read();
-                if (done) break;
-
-                buffer += decoder.decode(value, { stream: true });
-                const lines = buffer.split('\n');
-                buffer = lines.pop(); // Keep the last partial line in buffer
-
-                for (const line of lines) {
-                    if (!line.trim()) continue;
-                    try {
-                        const data = JSON.parse(line);
-
-                        if (data.conversation_id) {
-                            // If it was a new chat, update ID and sidebar
-                            if (!currentConversationId) {
-                                currentConversationId = data.conversation_id;
-                                currentChatTitle.innerText = data.title;
-                                addHistoryItem(data.conversation_id, data.title);
-                            }
-                        } else if (data.content) {
-                            // Append content to the existing HTML (which includes <strong>AI:</strong>)
-                            // We need to be careful not to overwrite the label.
-                            // Since we are just appending text, we can append to innerHTML, but we need to escape HTML if we were supporting it.
-                            // But we are in plain text mode.
-                            // Actually, appending to innerHTML is risky if data.content contains HTML special chars.
-                            // Better to append a text node?
-                            // But we want to keep the <strong>AI:</strong>.
-                            // Let's just append to innerHTML for now as it's simplest for plain text streaming.
-                            botMsgContent.innerHTML += data.content.replace(/\n/g, '<br>');
-                            chatArea.scrollTop = chatArea.scrollHeight;
-                        } else if (data.error) {
-                            botMsgContent.innerText += `\n[Error: ${data.error}]`;
-                            botMsgContent.classList.add('error-message');
+            // The connection dropped before the end: pick up after the last
+            // event we got, while the server still has the stream
+            for (let attempt = 1; !finished && streamId && attempt <= 3; attempt++) {
+                await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                try {
+                    const resumed = await fetch(`/api/chat/streams/${streamId}/`, {
+                        headers: {
+                            'Accept': 'text/event-stream',
+                            'Last-Event-ID': lastEventId ?? '-1',
                         }
-                    } catch (e) {
-                        console.error("Error parsing JSON chunk", e);
-                    }
+                    });
+                    if (!resumed.ok) break;
+                    await readEvents(resumed, handleEvent);
+                } catch (err) {
+                    console.warn("Failed to resume chat stream", err);
                 }
             }
 
@@ -217,7 +308,46 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Reads a Server-Sent Events response, calling onEvent(data, id) for
+    // each event; heartbeat comments are skipped
+    async function readEvents(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop(); // Keep the last partial frame in buffer
+
+            for (const frame of frames) {
+                let id = null;
+                let data = '';
+                for (const line of frame.split('\n')) {
+                    if (line.startsWith('id: ')) id = line.slice(4);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (!data) continue;
+                try {
+                    onEvent(JSON.parse(data), id);
+                } catch (e) {
+                    console.error("Error parsing event", e);
+                }
+            }
+        }
+    }
+
     function appendMessage(text, sender, isError = false) {
+        const msgDiv = createMessage(text, sender, isError);
+        chatArea.appendChild(msgDiv);
+        chatArea.scrollTop = chatArea.scrollHeight;
+        return msgDiv.id;
+    }
+
+    function createMessage(text, sender, isError = false) {
         const msgDiv = document.createElement('div');
         msgDiv.classList.add('message', `${sender}-message`);
 
@@ -233,10 +363,9 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         msgDiv.appendChild(contentDiv);
-        chatArea.appendChild(msgDiv);
-        chatArea.scrollTop = chatArea.scrollHeight;
         // Use a more unique ID to prevent collisions
-        return msgDiv.id = 'msg-' + Date.now() + '-' + Math.random().toString(36).substr(2, 9);
+        msgDiv.id = 'msg-' + Date.now() + '-' + Math.random().toString(36).substr(2, 9);
+        return msgDiv;
     }
 
     function appendLoading() {
@@ -259,13 +388,26 @@ document.addEventListener('DOMContentLoaded', () => {
         if (el) el.remove();
     }
 
-    function addHistoryItem(id, title) {
+    function createHistoryItem(id, title) {
         const div = document.createElement('div');
-        div.className = 'history-item active';
+        div.className = 'history-item';
         div.dataset.id = id;
-        div.innerHTML = `<span class="chat-title">${title}</span>`;
+        const span = document.createElement('span');
+        span.className = 'chat-title';
+        span.innerText = title;
+        div.appendChild(span);
+        return div;
+    }
+
+    function addHistoryItem(id, title) {
+        const div = createHistoryItem(id, title);
+        div.classList.add('active');
 
         // Prepend to list
         historyList.insertBefore(div, historyList.firstChild);
+
+        const count = parseInt(historyCount.dataset.count, 10) + 1;
+        historyCount.dataset.count = count;
+        historyCount.innerText = `${count} chat${count === 1 ? '' : 's'}`;
     }
 });
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import secrets
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+
+# SSE comment line; proxies see traffic, EventSource ignores it
+HEARTBEAT = ": keepalive\n\n"
+
+def sse_event(event_id, data):
+    """One Server-Sent Events frame carrying `data` as JSON."""
+    return f"id: {event_id}\ndata: {json.dumps(data)}\n\n"
+
+class StreamBuffer:
+    """
+    The events of one generation streamed as Server-Sent Events, numbered
+    from 0. A background task appends them as they are produced and readers
+    follow along with read() / aread(), so a client whose connection drops
+    can come back with Last-Event-ID and get the rest, including what was
+    produced while it was away.
+
+    The generation keeps running while no one reads for up to `grace`
+    seconds (see abandoned()), even if it produces nothing in the meantime
+    (see watch()); the buffer is kept for `ttl` seconds after it finishes.
+    """
+
+    def __init__(self, user_id, grace=30, ttl=60, clock=time.monotonic):
+        self.id = secrets.token_urlsafe(16)
+        self.user_id = user_id
+        self.grace = grace
+        self.ttl = ttl
+        self._clock = clock
+        self.events = []
+        self.finished = False
+        self.finished_at = None
+        self.readers = 0
+        self.left_at = clock()
+        # Keeps the async producer task referenced while it runs
+        self.task = None
+        # Stops the generation once the buffer is abandoned, see watch()
+        self._on_abandoned = None
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    def append(self, data):
+        with self._cond:
+            self.events.append(data)
+            self._notify()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self.finished_at = self._clock()
+            self._notify()
+
+    def _notify(self):
+        # Called with _cond held
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._waiters = []
+
+    def _ready(self, after):
+        return len(self.events) > after + 1 or self.finished
+
+    def _since(self, after):
+        return list(enumerate(self.events[after + 1:], after + 1)), self.finished
+
+    def read(self, after, timeout):
+        """
+        The (id, data) events after id `after`, waiting up to `timeout`
+        seconds for one, and whether the stream has finished.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._ready(after), timeout)
+            return self._since(after)
+
+    async def aread(self, after, timeout):
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._cond:
+            if self._ready(after):
+                return self._since(after)
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            return self._since(after)
+
+    def attach(self):
+        with self._cond:
+            self.readers += 1
+
+    def detach(self):
+        with self._cond:
+            self.readers -= 1
+            self.left_at = self._clock()
+            if self.readers or self.finished:
+                return
+        self._check_later()
+
+    def watch(self, on_abandoned):
+        """
+        Calls on_abandoned() `grace` seconds after the last reader left (or
+        after now, if none ever comes) unless someone came back or the
+        stream finished, so a generation that is still queued or quiet is
+        stopped too.
+        """
+        self._on_abandoned = on_abandoned
+        self._check_later()
+
+    def _check_later(self):
+        if self._on_abandoned is None:
+            return
+        timer = threading.Timer(self.grace, self._check)
+        timer.daemon = True
+        timer.start()
+
+    def _check(self):
+        if self.abandoned() and not self.finished:
+            self._on_abandoned()
+
+    def abandoned(self):
+        """True once no one has been reading for `grace` seconds."""
+        with self._cond:
+            return self.readers == 0 and self._clock() - self.left_at >= self.grace
+
+    def expired(self, now):
+        return self.finished and now - self.finished_at >= self.ttl
+
+class StreamRegistry:
+    """The live and recently finished StreamBuffers of this process, by id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def open(self, user_id):
+        buffer = StreamBuffer(
+            user_id,
+            grace=getattr(settings, 'OLLAMA_STREAM_RESUME_GRACE', 30),
+            ttl=getattr(settings, 'OLLAMA_STREAM_BUFFER_TTL', 60),
+        )
+        with self._lock:
+            self._purge(time.monotonic())
+            self._streams[buffer.id] = buffer
+        return buffer
+
+    def get(self, stream_id, user_id):
+        with self._lock:
+            self._purge(time.monotonic())
+            buffer = self._streams.get(stream_id)
+        if buffer is None or buffer.user_id != user_id:
+            return None
+        return buffer
+
+    def _purge(self, now):
+        # Called with _lock held
+        for stream_id in [i for i, b in self._streams.items() if b.expired(now)]:
+            del self._streams[stream_id]
+
+_registry = StreamRegistry()
+
+def get_streams():
+    return _registry
+
+def produce(buffer, events, cancel=None):
+    """
+    Runs `events`, a generator of dicts, in a background thread and appends
+    them to `buffer`, then {'done': True}. Stops early, closing `events`,
+    once the buffer is abandoned. A generator can't be stopped from another
+    thread while it waits, so `cancel`, if given, is called then to make
+    `events` end (e.g. ChatStream.cancel).
+    """
+    def run():
+        try:
+            for data in events:
+                buffer.append(data)
+                if buffer.abandoned():
+                    return
+            buffer.append({'done': True})
+        finally:
+            events.close()
+            buffer.finish()
+            close_old_connections()
+
+    threading.Thread(target=run, name=f"chat-stream-{buffer.id}", daemon=True).start()
+    if cancel is not None:
+        buffer.watch(cancel)
+
+def aproduce(buffer, events):
+    """Same as produce() for an async generator, as a task on the running loop."""
+    async def run():
+        try:
+            async for data in events:
+                buffer.append(data)
+                if buffer.abandoned():
+                    return
+            buffer.append({'done': True})
+        finally:
+            await events.aclose()
+            buffer.finish()
+
+    buffer.task = asyncio.ensure_future(run())
+    loop = asyncio.get_running_loop()
+    buffer.watch(lambda: loop.call_soon_threadsafe(buffer.task.cancel))
+
+def heartbeat_interval():
+    return getattr(settings, 'OLLAMA_SSE_HEARTBEAT', 15)
+
+def follow(buffer, after=-1):
+    """Streams `buffer`'s events after id `after` as SSE, with heartbeats while it is quiet."""
+    interval = heartbeat_interval()
+    buffer.attach()
+    try:
+        while True:
+            events, finished = buffer.read(after, interval)
+            if not events and not finished:
+                yield HEARTBEAT
+            for after, data in events:
+                yield sse_event(after, data)
+            if finished:
+                return
+    finally:
+        buffer.detach()
+
+async def afollow(buffer, after=-1):
+    interval = heartbeat_interval()
+    buffer.attach()
+    try:
+        while True:
+            events, finished = await buffer.aread(after, interval)
+            if not events and not finished:
+                yield HEARTBEAT
+            for after, data in events:
+                yield sse_event(after, data)
+            if finished:
+                return
+    finally:
+        buffer.detach()
@@ -0,0 +1,79 @@
+from django.conf import settings
+from .context import MESSAGE_OVERHEAD, context_budget, estimate_tokens
+from .models import Conversation, Message
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a chat between a user and an AI "
+    "assistant. Rewrite the summary so it also covers the new messages. Keep "
+    "names, facts, decisions and open questions; drop small talk. Reply with "
+    "the summary only."
+)
+
+def summaries_enabled():
+    return getattr(settings, 'OLLAMA_SUMMARY_ENABLED', False)
+
+def summary_model(model):
+    return getattr(settings, 'OLLAMA_SUMMARY_MODEL', None) or model
+
+def pending_messages(conversation, model):
+    """
+    Messages the summary should absorb next, oldest first: those older than
+    the recent window (half the model's context budget, always sent
+    verbatim) that the summary does not cover yet, up to
+    OLLAMA_SUMMARY_MAX_INPUT_TOKENS per pass.
+    """
+    rows = Message.objects.filter(conversation_id=conversation.id)
+    if conversation.summary_until is not None:
+        rows = rows.filter(id__gt=conversation.summary_until)
+
+    keep = context_budget(model) // 2
+    used = 0
+    boundary = None
+    for msg in rows.order_by('-created_at', '-id').only('id', 'token_count', 'content').iterator(chunk_size=50):
+        used += (msg.token_count or estimate_tokens(msg.content)) + MESSAGE_OVERHEAD
+        if used > keep:
+            boundary = msg
+            break
+    if boundary is None:
+        return []
+
+    limit = getattr(settings, 'OLLAMA_SUMMARY_MAX_INPUT_TOKENS', 4096)
+    pending = []
+    used = 0
+    older = rows.filter(id__lte=boundary.id).order_by('created_at', 'id')
+    for msg in older.iterator(chunk_size=50):
+        used += (msg.token_count or estimate_tokens(msg.content)) + MESSAGE_OVERHEAD
+        if pending and used > limit:
+            break
+        pending.append(msg)
+    return pending
+
+def needs_summary(conversation, model):
+    pending = pending_messages(conversation, model)
+    tokens = sum((msg.token_count or estimate_tokens(msg.content)) + MESSAGE_OVERHEAD for msg in pending)
+    return tokens >= getattr(settings, 'OLLAMA_SUMMARY_TRIGGER_TOKENS', 1024)
+
+def summarize(conversation_id, model, complete):
+    """
+    Folds the pending messages of a conversation into its stored summary.
+    `complete(messages, model)` runs a non-streaming chat and returns the text.
+    """
+    conversation = Conversation.objects.get(id=conversation_id)
+    pending = pending_messages(conversation, model)
+    if not pending:
+        return
+
+    transcript = "\n".join(
+        f"{'Assistant' if msg.role == 'bot' else 'User'}: {msg.content}" for msg in pending
+    )
+    previous = conversation.summary or "(empty)"
+    summary = complete([
+        {'role': 'system', 'content': SUMMARY_PROMPT},
+        {'role': 'user', 'content': f"Current summary:\n{previous}\n\nNew messages:\n{transcript}"},
+    ], summary_model(model))
+
+    # Only store it if no other pass got there first. update() leaves
+    # updated_at alone, so the conversation keeps its place in the sidebar.
+    Conversation.objects.filter(id=conversation_id, summary_until=conversation.summary_until).update(
+        summary=summary.strip(), summary_until=pending[-1].id
+    )
@@ -0,0 +1,91 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from .admin import CHAT_VISUAL_PAGE
+from .models import Conversation, Message, UserLoginLog
+
+class AdminQueryTests(TestCase):
+    """
+    The changelists and the conversation page run a fixed number of queries
+    however many rows they show.
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(self.admin)
+        self.conversation = Conversation.objects.create(user=self.admin, title="Long chat")
+
+    def add_rows(self, n):
+        for i in range(n):
+            user = User.objects.create_user(username=f'user{User.objects.count()}_{i}')
+            conversation = Conversation.objects.create(user=user, title=f"Chat {i}")
+            Message.objects.create(conversation=conversation, role='user', content=f"Hello {i}")
+            Message.objects.create(conversation=conversation, role='bot', content=f"Hi {i}")
+            UserLoginLog.objects.create(user=user, ip_address='127.0.0.1')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists(self):
+        urls = ['/admin/auth/user/', '/admin/chat/conversation/', '/admin/chat/message/', '/admin/chat/userloginlog/']
+        self.add_rows(2)
+        before = [self.count_queries(url) for url in urls]
+        self.add_rows(10)
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_changelist_counts(self):
+        self.add_rows(1)
+        Message.objects.create(conversation=self.conversation, role='user', content="One")
+        response = self.client.get('/admin/chat/conversation/', {'o': '4'})
+        self.assertEqual([c.message_count for c in response.context['cl'].result_list], [1, 2])
+        response = self.client.get('/admin/auth/user/')
+        counts = {u.username: u.conversation_count for u in response.context['cl'].result_list}
+        self.assertEqual(counts, {'admin': 1, 'user1_0': 1})
+
+    def test_chat_visual_shows_the_latest_page(self):
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user' if i % 2 == 0 else 'bot', content=f"message {i}")
+            for i in range(CHAT_VISUAL_PAGE * 2 + 5)
+        ])
+        url = f'/admin/chat/conversation/{self.conversation.id}/change/'
+        queries = self.count_queries(url)
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='bot', content="more") for _ in range(20)
+        ])
+        self.assertEqual(self.count_queries(url), queries)
+
+        Message.objects.filter(conversation=self.conversation, content="more").delete()
+        response = self.client.get(url)
+        self.assertContains(response, f"message {CHAT_VISUAL_PAGE * 2 + 4}")
+        self.assertContains(response, f"message {CHAT_VISUAL_PAGE + 5}")
+        self.assertNotContains(response, f"message {CHAT_VISUAL_PAGE + 4}<")
+        self.assertContains(response, "Load earlier messages")
+
+    def test_load_more(self):
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content=f"message {i}")
+            for i in range(CHAT_VISUAL_PAGE + 5)
+        ])
+        url = f'/admin/chat/conversation/{self.conversation.id}/messages/'
+        latest = self.client.get(url).json()
+        earlier = self.client.get(url, {'before': latest['before']}).json()
+        self.assertIn("message 5<", latest['html'])
+        self.assertIn("message 0<", earlier['html'])
+        self.assertIn("message 4<", earlier['html'])
+        self.assertNotIn("message 5<", earlier['html'])
+        self.assertIsNone(earlier['before'])
+        self.assertEqual(self.client.get(url, {'before': 'junk'}).status_code, 404)
+
+    def test_chat_visual_escapes_content(self):
+        Message.objects.create(conversation=self.conversation, role='bot', content="<script>alert(1)</script>")
+        response = self.client.get(f'/admin/chat/conversation/{self.conversation.id}/change/')
+        self.assertContains(response, "&lt;script&gt;alert(1)&lt;/script&gt;")
+
+    def test_messages_view_needs_staff(self):
+        self.client.force_login(User.objects.create_user(username='plain', password='password'))
+        response = self.client.get(f'/admin/chat/conversation/{self.conversation.id}/messages/')
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,150 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import path
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .tests_sse import parse
+from . import metrics
+from . import views
+import asyncio
+import json
+import queue
+import threading
+
+urlpatterns = [
+    path('api/chat/', views.api_chat_async, name='api_chat'),
+    path('api/chat/streams/<str:stream_id>/', views.api_chat_stream_async, name='api_chat_stream'),
+]
+
+class AsyncServiceTests(TestCase):
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"], delay=0.05).start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def client_threads(self):
+        # Leave out the fake server's per-connection handler threads
+        return len([t for t in threading.enumerate() if 'process_request' not in t.name])
+
+    async def test_many_streams_share_one_thread(self):
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=50, OLLAMA_QUEUE_SIZE=50):
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            threads_before = self.client_threads()
+
+            async def consume():
+                return "".join([chunk async for chunk in service.process_chat([], model="llama3.1:8b")])
+
+            results = await asyncio.gather(*[consume() for _ in range(50)])
+            await AsyncOllamaService.reset()
+
+        self.assertEqual(set(results), {"Hello World"})
+        self.assertEqual(self.fake.max_active, 50)
+        self.assertLessEqual(self.client_threads(), threads_before)
+
+    async def test_queue_full_when_too_many_waiting(self):
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=1, OLLAMA_QUEUE_SIZE=2,
+                               OLLAMA_USER_QUEUE_SIZE=None):
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            # One running, two waiting
+            generators = [service.process_chat([], user=i) for i in range(3)]
+            with self.assertRaises(queue.Full):
+                service.process_chat([])
+
+            for generator in generators:
+                self.assertEqual("".join([chunk async for chunk in generator]), "Hello World")
+            self.assertEqual(service.pending(), 0)
+            await AsyncOllamaService.reset()
+
+    async def test_fair_share_and_queue_status(self):
+        settings = dict(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=1, OLLAMA_QUEUE_SIZE=10,
+                        OLLAMA_SCHEDULER='chat.scheduler.FairScheduler', OLLAMA_USER_QUEUE_SIZE=2,
+                        OLLAMA_QUEUE_STATUS_INTERVAL=0.05)
+        with override_settings(**settings):
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            order = []
+
+            async def consume(user, priority='default'):
+                events = [chunk async for chunk in service.process_chat([], user=user, priority=priority)]
+                order.append(user)
+                return events
+
+            running = service.process_chat([], user='busy')
+            self.assertEqual(await anext(running), "Hello")
+            # A second user's chat is served before the first one's backlog
+            tasks = [asyncio.ensure_future(consume('a')), asyncio.ensure_future(consume('a'))]
+            await asyncio.sleep(0)
+            with self.assertRaises(queue.Full):
+                service.process_chat([], user='a')
+            tasks.append(asyncio.ensure_future(consume('b')))
+            await asyncio.sleep(0.2)
+            self.assertEqual("".join([chunk async for chunk in running]), " World")
+            results = await asyncio.gather(*tasks)
+            await AsyncOllamaService.reset()
+
+        self.assertEqual(order, ['a', 'b', 'a'])
+        self.assertEqual(results[0][0], {'queue': {'position': 1, 'eta': None}})
+        self.assertEqual("".join(e for e in results[2] if isinstance(e, str)), "Hello World")
+
+    async def test_closed_before_it_starts(self):
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=1, OLLAMA_QUEUE_SIZE=2):
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            for _ in range(5):
+                # The client left before the first chunk was asked for
+                await service.process_chat([], model='never-started').aclose()
+            self.assertEqual(service.pending(), 0)
+            self.assertEqual(metrics.QUEUE_DEPTH.get(model='never-started'), 0)
+            self.assertEqual("".join([chunk async for chunk in service.process_chat([])]), "Hello World")
+            await AsyncOllamaService.reset()
+
+@override_settings(ROOT_URLCONF='chat.tests_async')
+class AsyncChatViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='asyncuser', password='password')
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"]).start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    async def test_streams_and_saves_bot_message(self):
+        await self.async_client.aforce_login(self.user)
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url):
+            await AsyncOllamaService.reset()
+            response = await self.async_client.post(
+                '/api/chat/',
+                data=json.dumps({'prompt': 'Hi'}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            content = b"".join([chunk async for chunk in response.streaming_content])
+            await AsyncOllamaService.reset()
+
+        lines = [json.loads(line) for line in content.decode('utf-8').strip().split('\n')]
+        self.assertIn('conversation_id', lines[0])
+        self.assertEqual("".join(line.get('content', '') for line in lines[1:]), "Hello World")
+
+        messages = [m async for m in views.Message.objects.order_by('created_at', 'id')]
+        self.assertEqual([(m.role, m.content) for m in messages], [('user', 'Hi'), ('bot', 'Hello World')])
+        self.assertEqual(self.fake.requests[0]['messages'], [{'role': 'user', 'content': 'Hi'}])
+
+    async def test_server_sent_events(self):
+        await self.async_client.aforce_login(self.user)
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url):
+            await AsyncOllamaService.reset()
+            response = await self.async_client.post(
+                '/api/chat/', data=json.dumps({'prompt': 'Hi'}),
+                content_type='application/json', headers={'Accept': 'text/event-stream'},
+            )
+            events, _ = parse([chunk async for chunk in response.streaming_content])
+            stream_id = events[0][1]['stream_id']
+            resumed = await self.async_client.get(f'/api/chat/streams/{stream_id}/', headers={'Last-Event-ID': '1'})
+            replayed, _ = parse([chunk async for chunk in resumed.streaming_content])
+            await AsyncOllamaService.reset()
+
+        self.assertEqual("".join(data.get('content', '') for _, data in events), "Hello World")
+        self.assertEqual(events[-1][1], {'done': True})
+        self.assertEqual(replayed, events[2:])
@@ -0,0 +1,108 @@
+from datetime import date, datetime, timezone as dt_timezone
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from .audit import LoginAuditWriter, reset_audit_writer, rollup_logins
+from .models import LoginDailyRollup, UserLoginLog
+import time
+
+class LoginAuditTests(TestCase):
+    def setUp(self):
+        reset_audit_writer()
+        self.user = User.objects.create_user(username='auditor', password='password')
+
+    def tearDown(self):
+        reset_audit_writer()
+
+    def test_login_is_recorded(self):
+        self.client.post('/login/', {'username': 'auditor', 'password': 'password'}, HTTP_USER_AGENT='Tests')
+        log = UserLoginLog.objects.get()
+        self.assertEqual((log.user, log.ip_address, log.user_agent), (self.user, '127.0.0.1', 'Tests'))
+
+class WriteBehindAuditTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='password')
+
+    def test_logins_are_buffered_and_written_in_a_batch(self):
+        writer = LoginAuditWriter(write_behind=True, batch_size=100, flush_interval=10)
+        try:
+            entries = [writer.record(self.user, ip_address='10.0.0.1') for _ in range(5)]
+            self.assertEqual(UserLoginLog.objects.count(), 0)
+            writer.flush()
+            self.assertEqual(UserLoginLog.objects.count(), 5)
+            # Timestamped when recorded, not when written
+            self.assertEqual(
+                list(UserLoginLog.objects.order_by('id').values_list('timestamp', flat=True)),
+                [entry.timestamp for entry in entries],
+            )
+        finally:
+            writer.close()
+
+    def test_full_batch_is_written_without_waiting(self):
+        writer = LoginAuditWriter(write_behind=True, batch_size=3, flush_interval=10)
+        try:
+            for _ in range(3):
+                writer.record(self.user)
+            deadline = time.monotonic() + 5
+            while (writer._buffer or writer._writing) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(UserLoginLog.objects.count(), 3)
+        finally:
+            writer.close()
+
+    @override_settings(LOGIN_AUDIT_WRITE_BEHIND=True)
+    def test_login_view_does_not_write(self):
+        reset_audit_writer()
+        try:
+            self.client.post('/login/', {'username': 'auditor', 'password': 'password'})
+        finally:
+            # Closing flushes
+            reset_audit_writer()
+        self.assertEqual(UserLoginLog.objects.get().user, self.user)
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice')
+        self.bob = User.objects.create_user(username='bob')
+
+    def log(self, user, day, hour, ip='10.0.0.1'):
+        when = datetime(2026, 1, day, hour, tzinfo=dt_timezone.utc)
+        return UserLoginLog.objects.create(user=user, ip_address=ip, timestamp=when)
+
+    def rollups(self):
+        return list(LoginDailyRollup.objects.order_by('date', 'user__username').values_list(
+            'user__username', 'date', 'logins', 'ip_addresses', 'first_login__hour', 'last_login__hour',
+        ))
+
+    def test_compacts_days_before_the_cutoff(self):
+        self.log(self.alice, 1, 8)
+        self.log(self.alice, 1, 20, ip='10.0.0.2')
+        self.log(self.bob, 1, 9)
+        self.log(self.alice, 2, 10)
+        self.log(self.alice, 3, 10)
+
+        self.assertEqual(rollup_logins(date(2026, 1, 3)), (2, 4))
+        self.assertEqual(self.rollups(), [
+            ('alice', date(2026, 1, 1), 2, 2, 8, 20),
+            ('bob', date(2026, 1, 1), 1, 1, 9, 9),
+            ('alice', date(2026, 1, 2), 1, 1, 10, 10),
+        ])
+        self.assertEqual(UserLoginLog.objects.get().timestamp.day, 3)
+        self.assertEqual(rollup_logins(date(2026, 1, 3)), (0, 0))
+
+    def test_late_rows_are_added_to_the_day(self):
+        self.log(self.alice, 1, 8)
+        rollup_logins(date(2026, 1, 2))
+        self.log(self.alice, 1, 6)
+        rollup_logins(date(2026, 1, 2))
+        self.assertEqual(self.rollups(), [('alice', date(2026, 1, 1), 2, 1, 6, 8)])
+
+    def test_command(self):
+        self.log(self.alice, 1, 8)
+        recent = UserLoginLog.objects.create(user=self.bob)
+        out = StringIO()
+        call_command('rollup_logins', days=1, stdout=out)
+        self.assertIn("Compacted 1 login records from 1 days", out.getvalue())
+        self.assertEqual(list(UserLoginLog.objects.all()), [recent])
+        self.assertEqual(LoginDailyRollup.objects.get().user, self.alice)
@@ -0,0 +1,173 @@
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .backends import BackendPool
+from .services import OllamaService
+from .tests_metrics import unused_port
+from .transport import build_session
+import threading
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class BackendPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.pool = BackendPool(['http://a', 'http://b', 'http://c'], health_interval=0,
+                                failure_threshold=2, cooldown=30, affinity_slack=1, clock=self.clock)
+        self.a, self.b, self.c = self.pool.backends
+
+    def test_least_outstanding(self):
+        with self.pool.acquire('m') as first, self.pool.acquire('m') as second:
+            self.assertEqual((first, second), (self.a, self.b))
+            self.assertIs(self.pool.choose('m'), self.c)
+        self.assertEqual([b.outstanding for b in self.pool.backends], [0, 0, 0])
+
+    def test_affinity_up_to_the_slack(self):
+        self.pool.record_success(self.c, 'm')
+        with self.pool.acquire('m') as first, self.pool.acquire('m') as second:
+            self.assertEqual((first, second), (self.c, self.c))
+            # Two in flight on c against none elsewhere is past the slack
+            self.assertIs(self.pool.choose('m'), self.a)
+            self.assertIs(self.pool.choose('other'), self.a)
+
+    def test_only_hosts_with_the_model_installed(self):
+        self.pool.set_installed(self.a, ['x'])
+        self.pool.set_installed(self.b, ['m'])
+        self.assertIs(self.pool.choose('m'), self.b)
+        # c hasn't said what it has
+        self.assertIs(self.pool.choose('unknown'), self.c)
+        self.pool.set_installed(self.c, [])
+        # Nobody lists it: any host
+        self.assertIs(self.pool.choose('unknown'), self.a)
+
+    def test_circuit_breaker(self):
+        self.pool.record_failure(self.a)
+        self.assertIs(self.pool.choose(), self.a)
+        self.pool.record_failure(self.a)
+        self.assertIs(self.pool.choose(), self.b)
+
+        self.clock.now = 31
+        self.assertIs(self.pool.choose(), self.a)
+        # Still failing: opens again at once
+        self.pool.record_failure(self.a)
+        self.assertIs(self.pool.choose(), self.b)
+        self.pool.record_success(self.a)
+        self.assertIs(self.pool.choose(), self.a)
+
+    def test_all_open_tries_the_first_to_fail(self):
+        for backend in (self.b, self.a, self.c):
+            self.clock.now += 1
+            self.pool.record_failure(backend)
+            self.pool.record_failure(backend)
+        self.assertIs(self.pool.choose(), self.b)
+        self.assertIsNone(self.pool.choose(exclude=self.pool.backends))
+
+class MultiBackendTests(SimpleTestCase):
+    messages = [{'role': 'user', 'content': 'Hi'}]
+
+    def setUp(self):
+        self.fakes = [FakeOllama(tokens=["a", "b", "c"], delay=0.05, models=("m1", "m2")).start() for _ in range(2)]
+
+    def tearDown(self):
+        OllamaService.reset()
+        for fake in self.fakes:
+            fake.stop()
+
+    def settings(self, urls, **overrides):
+        return override_settings(
+            OLLAMA_BASE_URLS=urls, OLLAMA_WORKERS=4, OLLAMA_QUEUE_SIZE=20, OLLAMA_USER_QUEUE_SIZE=None,
+            OLLAMA_COALESCE=False, OLLAMA_RETRIES=0, OLLAMA_HEALTH_INTERVAL=0, **overrides
+        )
+
+    def chat(self, service, model='m1'):
+        return "".join(chunk for chunk in service.process_chat(self.messages, model=model) if isinstance(chunk, str))
+
+    def test_spreads_concurrent_chats(self):
+        with self.settings([fake.base_url for fake in self.fakes]):
+            OllamaService.reset()
+            service = OllamaService()
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(self.chat(service))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        self.assertEqual(results, ["abc"] * 4)
+        self.assertEqual([len(fake.requests) for fake in self.fakes], [2, 2])
+
+    def test_fails_over_and_opens_the_circuit(self):
+        dead = f"http://127.0.0.1:{unused_port()}"
+        with self.settings([dead, self.fakes[0].base_url], OLLAMA_CIRCUIT_FAILURES=1):
+            OllamaService.reset()
+            service = OllamaService()
+            # Each to a model the live host hasn't loaded, so affinity
+            # doesn't keep them off the dead one
+            for model in ['m1', 'm2']:
+                self.assertEqual(self.chat(service, model), "abc")
+            status = service.pool.status()
+        self.assertEqual(len(self.fakes[0].requests), 2)
+        # Tried once, then skipped while its circuit is open
+        self.assertEqual((status[0]['up'], status[0]['failures']), (False, 1))
+        self.assertTrue(status[1]['up'])
+
+    def test_fails_over_on_server_errors(self):
+        self.fakes[0].fail_status = 500
+        with self.settings([fake.base_url for fake in self.fakes]):
+            OllamaService.reset()
+            self.assertEqual(self.chat(OllamaService()), "abc")
+        self.assertEqual([len(fake.requests) for fake in self.fakes], [1, 1])
+
+    def test_last_error_is_reported(self):
+        for fake in self.fakes:
+            fake.fail_status = 503
+        with self.settings([fake.base_url for fake in self.fakes]):
+            OllamaService.reset()
+            with self.assertRaisesRegex(Exception, "503"):
+                self.chat(OllamaService())
+
+    def test_models_from_all_hosts(self):
+        self.fakes[1].models = ["m2", "m3"]
+        with self.settings([fake.base_url for fake in self.fakes]):
+            OllamaService.reset()
+            service = OllamaService()
+            self.assertEqual(service.fetch_models(), ["m1", "m2", "m3"])
+            # Only the second host has m3
+            self.assertEqual(self.chat(service, 'm3'), "abc")
+        self.assertEqual([len(fake.requests) for fake in self.fakes], [0, 1])
+
+    def test_health_checks(self):
+        self.fakes[1].loaded = ["m2"]
+        with self.settings([]):
+            session = build_session()
+        pool = BackendPool([fake.base_url for fake in self.fakes], session=session, health_interval=0)
+        pool.check_all()
+        self.assertEqual([b['loaded'] for b in pool.status()], [[], ['m2']])
+        self.assertIs(pool.choose('m2'), pool.backends[1])
+        self.assertIs(pool.choose('m1'), pool.backends[0])
+
+        pool = BackendPool([self.fakes[0].base_url, f"http://127.0.0.1:{unused_port()}"],
+                           session=session, health_interval=0)
+        for _ in range(3):
+            pool.check_all()
+        self.assertEqual([b['up'] for b in pool.status()], [True, False])
+
+    def test_async_fails_over(self):
+        dead = f"http://127.0.0.1:{unused_port()}"
+
+        async def chat():
+            await AsyncOllamaService.reset()
+            try:
+                service = AsyncOllamaService()
+                return "".join([chunk async for chunk in service.process_chat(self.messages, model='m1')])
+            finally:
+                await AsyncOllamaService.reset()
+
+        with self.settings([dead, self.fakes[1].base_url]):
+            self.assertEqual(async_to_sync(chat)(), "abc")
+        self.assertEqual(len(self.fakes[1].requests), 1)
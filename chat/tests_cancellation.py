@@ -0,0 +1,106 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .services import OllamaService
+import json
+import time
+
+class CancellationTests(TestCase):
+    """The upstream Ollama stream is closed soon after the client goes away."""
+
+    def start_fake(self, **kwargs):
+        self.fake = FakeOllama(**kwargs).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=1,
+                                         OLLAMA_COALESCE=False)
+        self.override.enable()
+        OllamaService.reset()
+        return OllamaService()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def assertUpstreamClosedWithin(self, seconds, since):
+        deadline = since + seconds
+        while not self.fake.disconnects and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.fake.disconnects, "upstream stream was not closed")
+        self.assertLess(self.fake.disconnects[0] - since, seconds)
+
+    def test_closing_the_generator_aborts_a_running_stream(self):
+        service = self.start_fake(tokens=["t"] * 1000, delay=0.01)
+        generator = service.process_chat([])
+        self.assertEqual(next(generator), "t")
+
+        closed_at = time.monotonic()
+        generator.close()
+        self.assertUpstreamClosedWithin(1, closed_at)
+
+        # The worker is free again
+        self.fake.tokens = ["ok"]
+        self.assertEqual("".join(service.process_chat([])), "ok")
+
+    def test_stalled_upstream_is_aborted(self):
+        service = self.start_fake(tokens=["a", "b"], stall=30)
+        generator = service.process_chat([])
+        self.assertEqual(next(generator), "a")
+
+        closed_at = time.monotonic()
+        generator.close()
+        self.assertUpstreamClosedWithin(1, closed_at)
+
+    def test_queued_job_is_dropped(self):
+        service = self.start_fake(tokens=["a", "b"], stall=30)
+        running = service.process_chat([], user=1)
+        self.assertEqual(next(running), "a")
+        queued = service.process_chat([], user=2)
+        self.assertEqual(service.pending(), 1)
+
+        queued.close()
+        self.assertEqual(service.pending(), 0)
+        running.close()
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_client_disconnect_from_view(self):
+        self.start_fake(tokens=["t"] * 1000, delay=0.01)
+        user = User.objects.create_user(username='cancel', password='password')
+        self.client.force_login(user)
+
+        response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}), content_type='application/json')
+        chunks = iter(response.streaming_content)
+        self.assertIn('conversation_id', json.loads(next(chunks)))
+        self.assertEqual(json.loads(next(chunks)), {'content': 't'})
+
+        closed_at = time.monotonic()
+        response.close()
+        self.assertUpstreamClosedWithin(1, closed_at)
+
+    def test_client_disconnect_after_metadata(self):
+        service = self.start_fake(tokens=["t"] * 1000, delay=0.01)
+        user = User.objects.create_user(username='early', password='password')
+        self.client.force_login(user)
+
+        response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}), content_type='application/json')
+        self.assertIn('conversation_id', json.loads(next(iter(response.streaming_content))))
+
+        response.close()
+        # The chat is dropped from the queue, or aborted if a worker had it already
+        deadline = time.monotonic() + 1
+        while (service.pending() or any(service._active.values())) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(service.pending(), 0)
+        self.assertFalse(any(service._active.values()))
+        self.assertEqual(len(self.fake.requests), len(self.fake.disconnects))
+
+    async def test_async_stream_close_aborts_upstream(self):
+        self.start_fake(tokens=["t"] * 1000, delay=0.01)
+        await AsyncOllamaService.reset()
+        generator = AsyncOllamaService().process_chat([])
+        self.assertEqual(await generator.__anext__(), "t")
+
+        closed_at = time.monotonic()
+        await generator.aclose()
+        self.assertUpstreamClosedWithin(1, closed_at)
+        await AsyncOllamaService.reset()
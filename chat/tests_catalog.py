@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, SimpleTestCase, override_settings
+from unittest.mock import patch
+from fake_ollama import FakeOllama
+from .catalog import ModelCatalog
+from .services import OllamaService
+import threading
+import time
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class ModelCatalogTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.models = ["llama3.1:8b"]
+        self.calls = 0
+        self.fetched = threading.Event()
+
+    def fetch(self):
+        self.calls += 1
+        self.fetched.set()
+        if isinstance(self.models, Exception):
+            raise self.models
+        return list(self.models)
+
+    def test_fresh_entries_are_not_refetched(self):
+        catalog = ModelCatalog(self.fetch, ttl=30, clock=self.clock)
+        self.assertEqual(catalog.get()['models'], ["llama3.1:8b"])
+        self.clock.now += 29
+        catalog.get()
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        catalog = ModelCatalog(self.fetch, ttl=30, stale_ttl=300, clock=self.clock)
+        first = catalog.get()
+        self.models = ["llama3.1:8b", "mistral"]
+        self.fetched.clear()
+        self.clock.now += 60
+
+        self.assertEqual(catalog.get()['models'], ["llama3.1:8b"])
+        self.assertTrue(self.fetched.wait(5))
+        while catalog._refreshing:
+            time.sleep(0.01)
+        refreshed = catalog.get()
+        self.assertEqual(refreshed['models'], ["llama3.1:8b", "mistral"])
+        self.assertNotEqual(refreshed['etag'], first['etag'])
+        self.assertEqual(refreshed['last_modified'], int(self.clock.now))
+
+    def test_failed_refresh_keeps_previous_list(self):
+        catalog = ModelCatalog(self.fetch, ttl=30, stale_ttl=0, clock=self.clock)
+        first = catalog.get()
+        self.models = ConnectionError("down")
+        self.clock.now += 60
+        self.assertEqual(catalog.get(), first)
+
+    def test_unchanged_list_keeps_last_modified(self):
+        catalog = ModelCatalog(self.fetch, ttl=30, stale_ttl=0, clock=self.clock)
+        first = catalog.get()
+        self.clock.now += 60
+        second = catalog.get()
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(second['last_modified'], first['last_modified'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_cache_between_instances(self):
+        ModelCatalog(self.fetch, cache_alias='default', clock=self.clock).get()
+        other = ModelCatalog(self.fetch, cache_alias='default', clock=self.clock)
+        self.assertEqual(other.get()['models'], ["llama3.1:8b"])
+        self.assertEqual(self.calls, 1)
+
+class ModelsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='modeluser', password='password')
+        self.client.login(username='modeluser', password='password')
+        self.fake = FakeOllama(models=["llama3.1:8b", "mistral"]).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url)
+        self.override.enable()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def test_etag_revalidation(self):
+        response = self.client.get('/api/models/')
+        self.assertEqual(response.json(), {'models': ["llama3.1:8b", "mistral"], 'warm': []})
+        self.assertIn('Last-Modified', response)
+
+        with patch.object(OllamaService, 'fetch_models') as fetch:
+            cached = self.client.get('/api/models/', HTTP_IF_NONE_MATCH=response['ETag'])
+            fetch.assert_not_called()
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
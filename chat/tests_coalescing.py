@@ -0,0 +1,86 @@
+from django.test import SimpleTestCase, override_settings
+from fake_ollama import FakeOllama
+from .services import OllamaService
+import threading
+import time
+
+HI = [{'role': 'user', 'content': 'Hi'}]
+
+class CoalescingTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["a", "b", "c", "d"], delay=0.05).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=2)
+        self.override.enable()
+        OllamaService.reset()
+        self.service = OllamaService()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def text(self, generator):
+        return "".join(chunk for chunk in generator if isinstance(chunk, str))
+
+    def test_concurrent_identical_requests_share_one_generation(self):
+        results = []
+        generators = [self.service.process_chat(HI, user=i) for i in range(5)]
+        threads = [threading.Thread(target=lambda g=g: results.append(self.text(g))) for g in generators]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ["abcd"] * 5)
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_late_joiner_replays_missed_chunks(self):
+        first = self.service.process_chat(HI)
+        self.assertEqual(next(first), "a")
+        self.assertEqual(next(first), "b")
+
+        late = self.service.process_chat(HI)
+        self.assertEqual(self.text(late), "abcd")
+        self.assertEqual(self.text(first), "cd")
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_generation_survives_while_a_subscriber_remains(self):
+        first = self.service.process_chat(HI)
+        self.assertEqual(next(first), "a")
+        second = self.service.process_chat(HI)
+        first.close()
+
+        self.assertEqual(self.text(second), "abcd")
+        self.assertEqual(self.fake.disconnects, [])
+
+    def test_last_subscriber_leaving_cancels(self):
+        self.fake.tokens = ["t"] * 1000
+        self.fake.delay = 0.01
+        first = self.service.process_chat(HI)
+        self.assertEqual(next(first), "t")
+        second = self.service.process_chat(HI)
+        first.close()
+        second.close()
+
+        deadline = time.monotonic() + 1
+        while not self.fake.disconnects and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(self.fake.disconnects)
+
+        # A new request starts its own generation
+        self.fake.tokens = ["ok"]
+        self.assertEqual(self.text(self.service.process_chat(HI)), "ok")
+
+    def test_different_or_finished_requests_are_not_coalesced(self):
+        self.assertEqual(self.text(self.service.process_chat(HI)), "abcd")
+        self.assertEqual(self.text(self.service.process_chat(HI)), "abcd")
+        self.assertEqual(self.text(self.service.process_chat(HI, options={'seed': 1})), "abcd")
+        self.assertEqual(len(self.fake.requests), 3)
+
+    def test_can_be_disabled(self):
+        with override_settings(OLLAMA_COALESCE=False):
+            OllamaService.reset()
+            service = OllamaService()
+            generators = [service.process_chat(HI), service.process_chat(HI)]
+            self.assertEqual([self.text(g) for g in generators], ["abcd", "abcd"])
+        self.assertEqual(len(self.fake.requests), 2)
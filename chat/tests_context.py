@@ -0,0 +1,62 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from .context import MESSAGE_OVERHEAD, build_context, estimate_tokens
+from .models import Conversation, Message
+
+@override_settings(OLLAMA_CONTEXT_TOKENS={'*': 100, 'big': 10000})
+class ContextBuilderTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='ctx', password='password')
+        self.conversation = Conversation.objects.create(user=user, title='ctx')
+
+    def add(self, role, content):
+        return Message.objects.create(conversation=self.conversation, role=role, content=content)
+
+    def test_token_count_is_stored_on_save(self):
+        msg = self.add('user', 'x' * 40)
+        self.assertEqual(msg.token_count, 10)
+        self.assertEqual(estimate_tokens('é' * 4), 2)
+
+    def test_token_count_follows_content_edits(self):
+        msg = self.add('user', 'x' * 40)
+        msg.content = 'x' * 80
+        msg.save()
+        self.assertEqual(Message.objects.get().token_count, 20)
+
+        msg.content = 'x' * 120
+        msg.save(update_fields=['content'])
+        self.assertEqual(Message.objects.get().token_count, 30)
+
+    def test_newest_messages_that_fit_the_budget(self):
+        # Each message costs 20 + MESSAGE_OVERHEAD tokens
+        for i in range(10):
+            self.add('user' if i % 2 == 0 else 'bot', f"{i}" * 80)
+
+        context = build_context(self.conversation, 'small')
+        fits = 100 // (20 + MESSAGE_OVERHEAD)
+        self.assertEqual([m['content'][0] for m in context], [str(i) for i in range(10 - fits, 10)])
+        self.assertEqual(context[-1]['role'], 'assistant')
+
+        self.assertEqual(len(build_context(self.conversation, 'big')), 10)
+
+    def test_newest_message_is_always_sent(self):
+        self.add('user', 'short')
+        self.add('user', 'x' * 1000)
+        self.assertEqual([m['content'] for m in build_context(self.conversation, 'small')], ['x' * 1000])
+
+    def test_missing_token_counts_are_backfilled(self):
+        for i in range(3):
+            self.add('user', 'y' * 40)
+        Message.objects.update(token_count=None)
+
+        build_context(self.conversation, 'small')
+        self.assertEqual(set(Message.objects.values_list('token_count', flat=True)), {10})
+
+    def test_query_count_does_not_grow_with_history(self):
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content='z' * 80, token_count=20)
+            for _ in range(1000)
+        ])
+        with self.assertNumQueries(1):
+            context = build_context(self.conversation, 'small')
+        self.assertEqual(len(context), 4)
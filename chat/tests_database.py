@@ -0,0 +1,20 @@
+from django.db import connection
+from django.test import SimpleTestCase
+import unittest
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "SQLite profile")
+class SQLiteProfileTests(SimpleTestCase):
+    databases = {'default'}
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        # 1 = NORMAL
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+        # 2 = MEMORY
+        self.assertEqual(self.pragma('temp_store'), 2)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
@@ -0,0 +1,164 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .deadlines import DeadlineExceeded, Deadlines, limits_for
+from .services import OllamaService
+from .tests_backends import Clock
+from . import metrics
+import json
+import time
+
+class DeadlinesTests(SimpleTestCase):
+    @override_settings(OLLAMA_DEADLINES={'*': {'queue': 10, 'total': 100}, 'big': {'total': None, 'first_token': 50}})
+    def test_per_model_limits(self):
+        self.assertEqual(limits_for('small'), {'queue': 10, 'first_token': None, 'total': 100})
+        self.assertEqual(limits_for('big'), {'queue': 10, 'first_token': 50, 'total': None})
+
+    @override_settings(OLLAMA_DEADLINES={'*': {'queue': 10, 'first_token': 30, 'total': 100}})
+    def test_next(self):
+        clock = Clock()
+        deadlines = Deadlines('m', queued_at=0, clock=clock)
+        self.assertEqual(deadlines.next(started=False, streaming=False), ('queue', 10))
+        clock.now = 5
+        self.assertEqual(deadlines.next(started=True, streaming=False), ('first_token', 25))
+        self.assertEqual(deadlines.next(started=True, streaming=True), ('total', 95))
+        self.assertFalse(deadlines.passed(started=True, streaming=False))
+        clock.now = 30
+        self.assertTrue(deadlines.passed(started=True, streaming=False))
+        self.assertEqual(str(deadlines.exceeded('first_token')), "Timed out after 30s waiting for the first token")
+
+    @override_settings(OLLAMA_DEADLINES={})
+    def test_no_limits(self):
+        self.assertEqual(Deadlines('m', 0).next(started=False, streaming=False), (None, None))
+
+class ServiceDeadlineTests(SimpleTestCase):
+    messages = [{'role': 'user', 'content': 'Hi'}]
+
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["t"] * 20, delay=0.05).start()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.fake.stop()
+
+    def settings(self, model, **limits):
+        return override_settings(
+            OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_COALESCE=False, OLLAMA_WORKERS=1,
+            OLLAMA_USER_QUEUE_SIZE=None, OLLAMA_STREAM_FLUSH_INTERVAL=0, OLLAMA_DEADLINES={model: limits},
+        )
+
+    def assertTimesOut(self, stream, stage):
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded) as raised:
+            for _ in stream:
+                pass
+        self.assertEqual(raised.exception.stage, stage)
+        return time.monotonic() - started
+
+    def test_first_token(self):
+        model = 'deadline-first'
+        self.fake.delay = 2
+        with self.settings(model, first_token=0.2):
+            OllamaService.reset()
+            service = OllamaService()
+            self.assertLess(self.assertTimesOut(service.process_chat(self.messages, model=model), 'first_token'), 1)
+            # The upstream request is dropped and the worker freed
+            deadline = time.monotonic() + 2
+            while service._active[model] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(service._active[model], 0)
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='timeout'), 1)
+
+    def test_total(self):
+        model = 'deadline-total'
+        with self.settings(model, total=0.3):
+            OllamaService.reset()
+            chunks = []
+            stream = OllamaService().process_chat(self.messages, model=model)
+            with self.assertRaises(DeadlineExceeded):
+                for chunk in stream:
+                    chunks.append(chunk)
+        self.assertTrue(0 < len(chunks) < 20)
+
+    def test_queue(self):
+        model = 'deadline-queue'
+        with self.settings(model, queue=0.2):
+            OllamaService.reset()
+            service = OllamaService()
+            busy = service.process_chat(self.messages, model='other')
+            next(busy)
+            self.assertTimesOut(service.process_chat(self.messages, model=model), 'queue')
+            busy.close()
+            self.assertEqual(service.pending(), 0)
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='timeout'), 1)
+
+    def test_backpressure(self):
+        self.fake.delay = 0
+        self.fake.tokens = ["t"] * 50
+        with self.settings('m'), override_settings(OLLAMA_RESPONSE_QUEUE_SIZE=2):
+            OllamaService.reset()
+            stream = OllamaService().process_chat(self.messages, model='m')
+            self.assertEqual(next(stream), "t")
+            time.sleep(0.3)
+            # The worker waits for us instead of queueing the whole answer
+            self.assertFalse(stream.job['finished'])
+            self.assertLessEqual(stream.response_queue.qsize(), 2)
+            self.assertEqual(1 + len(list(stream)), 50)
+
+    def test_async(self):
+        model = 'deadline-async'
+        self.fake.delay = 2
+
+        async def chat():
+            await AsyncOllamaService.reset()
+            try:
+                return [chunk async for chunk in AsyncOllamaService().process_chat(self.messages, model=model)]
+            finally:
+                await AsyncOllamaService.reset()
+
+        with self.settings(model, first_token=0.2):
+            with self.assertRaises(DeadlineExceeded) as raised:
+                async_to_sync(chat)()
+        self.assertEqual(raised.exception.stage, 'first_token')
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='timeout'), 1)
+
+    def test_async_queue(self):
+        model = 'deadline-async-queue'
+
+        async def chat():
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            try:
+                busy = service.process_chat(self.messages, model='other')
+                await anext(busy)
+                try:
+                    return [chunk async for chunk in service.process_chat(self.messages, model=model)]
+                finally:
+                    await busy.aclose()
+            finally:
+                await AsyncOllamaService.reset()
+
+        with self.settings(model, queue=0.2):
+            with self.assertRaises(DeadlineExceeded) as raised:
+                async_to_sync(chat)()
+        self.assertEqual(raised.exception.stage, 'queue')
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='timeout'), 1)
+
+class DeadlineViewTests(TestCase):
+    def test_error_event(self):
+        fake = FakeOllama(delay=2).start()
+        self.addCleanup(fake.stop)
+        self.client.force_login(User.objects.create_user(username='slow', password='password'))
+        with override_settings(OLLAMA_BASE_URL=fake.base_url, OLLAMA_DEADLINES={'*': {'first_token': 0.1}}):
+            OllamaService.reset()
+            try:
+                response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}),
+                                            content_type='application/json')
+                lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            finally:
+                OllamaService.reset()
+        self.assertEqual(lines[-1], {
+            'error': "Timed out after 0.1s waiting for the first token", 'deadline': 'first_token',
+        })
@@ -10,7 +10,7 @@ class DebugStreamingTests(TestCase):
         self.client = Client()
         self.client.login(username='debuguser', password='password')
 
-    @patch('chat.services.requests.post')
+    @patch('chat.transport.requests.Session.post')
     def test_streaming_timing(self, mock_post):
         # Mock Ollama response with a slow generator
         def mock_iter_content(chunk_size=None):
@@ -0,0 +1,108 @@
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .coalesce import EMPTY, Coalescer, acoalesce, merged
+from .services import OllamaService
+from .tests_backends import Clock
+import asyncio
+
+class CoalescerTests(SimpleTestCase):
+    def test_holds_chunks_arriving_within_the_interval(self):
+        clock = Clock()
+        coalescer = Coalescer(interval=0.05, clock=clock)
+        self.assertEqual(coalescer.delay(), 0)
+        coalescer.merge("a", lambda: EMPTY)
+        clock.now = 0.01
+        self.assertAlmostEqual(coalescer.delay(), 0.04)
+        # After a pause the next chunk goes out at once
+        clock.now = 1
+        self.assertEqual(coalescer.delay(), 0)
+
+    def test_frames_up_to_max_chars(self):
+        coalescer = Coalescer(interval=0.05, max_chars=4)
+        waiting = iter(["b", "cd", "efg", "h", None, "i"])
+        frames, stopped = coalescer.merge("a", lambda: next(waiting, EMPTY))
+        self.assertEqual((frames, stopped), (["abcd", "efgh"], None))
+        self.assertEqual(list(merged(["x" * 6, "y", "z"], coalescer)), ["x" * 6, "yz"])
+
+    def test_disabled(self):
+        coalescer = Coalescer(interval=0)
+        self.assertEqual(list(merged(["a", "b"], coalescer)), ["a", "b"])
+        self.assertEqual(coalescer.delay(), 0)
+
+    def test_async(self):
+        async def tokens():
+            for token in "abcdef":
+                await asyncio.sleep(0.01)
+                yield token
+
+        async def frames(interval):
+            return [frame async for frame in acoalesce(tokens(), Coalescer(interval=interval))]
+
+        self.assertEqual(async_to_sync(frames)(0), list("abcdef"))
+        coalesced = async_to_sync(frames)(0.025)
+        self.assertEqual(coalesced[0], "a")
+        self.assertEqual("".join(coalesced), "abcdef")
+        self.assertLess(len(coalesced), 6)
+
+    def test_async_errors_and_early_close(self):
+        closed = []
+
+        async def failing():
+            try:
+                yield "a"
+                await asyncio.sleep(0.01)
+                raise ValueError("upstream")
+            finally:
+                closed.append(True)
+
+        async def consume():
+            return [frame async for frame in acoalesce(failing(), Coalescer(interval=0.05))]
+
+        with self.assertRaisesRegex(ValueError, "upstream"):
+            async_to_sync(consume)()
+
+        async def first_only():
+            frames = acoalesce(failing(), Coalescer(interval=0.05))
+            first = await frames.__anext__()
+            await frames.aclose()
+            return first
+
+        self.assertEqual(async_to_sync(first_only)(), "a")
+        self.assertEqual(closed, [True, True])
+
+class StreamFramesTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["t"] * 40, delay=0.005).start()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.fake.stop()
+
+    def settings(self, interval):
+        return override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_COALESCE=False,
+                                 OLLAMA_STREAM_FLUSH_INTERVAL=interval)
+
+    def test_tokens_are_merged(self):
+        with self.settings(0.05):
+            OllamaService.reset()
+            frames = [c for c in OllamaService().process_chat([], model='m') if isinstance(c, str)]
+        # The first token isn't held back
+        self.assertEqual(frames[0], "t")
+        self.assertEqual("".join(frames), "t" * 40)
+        self.assertLess(len(frames), 10)
+
+    def test_async_tokens_are_merged(self):
+        async def chat():
+            await AsyncOllamaService.reset()
+            try:
+                return [frame async for frame in AsyncOllamaService().process_chat([], model='m')]
+            finally:
+                await AsyncOllamaService.reset()
+
+        with self.settings(0.05):
+            frames = async_to_sync(chat)()
+        self.assertEqual(frames[0], "t")
+        self.assertEqual("".join(frames), "t" * 40)
+        self.assertLess(len(frames), 10)
@@ -0,0 +1,142 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from .models import Conversation, Message
+from .persistence import MessageWriter
+import json
+import time
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='password')
+        self.client.force_login(self.user)
+        self.conversation = Conversation.objects.create(user=self.user, title="Long chat")
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user' if i % 2 == 0 else 'bot', content=f"m{i}")
+            for i in range(25)
+        ])
+        self.url = f'/api/messages/{self.conversation.id}/'
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def contents(self, data):
+        return [m['content'] for m in data['messages']]
+
+    def test_without_parameters_returns_everything(self):
+        data = self.get()
+        self.assertEqual(self.contents(data), [f"m{i}" for i in range(25)])
+        self.assertEqual(data['messages'][0]['role'], 'user')
+
+    def test_paging_forward(self):
+        seen = []
+        data = self.get(limit=10)
+        self.assertIsNone(data['prev'])
+        while True:
+            seen += self.contents(data)
+            if not data['next']:
+                break
+            data = self.get(limit=10, after=data['next'])
+            self.assertIsNotNone(data['prev'])
+        self.assertEqual(seen, [f"m{i}" for i in range(25)])
+
+    def test_latest_then_backwards(self):
+        data = self.get(latest=10)
+        self.assertEqual(self.contents(data), [f"m{i}" for i in range(15, 25)])
+        self.assertIsNone(data['next'])
+
+        data = self.get(limit=10, before=data['prev'])
+        self.assertEqual(self.contents(data), [f"m{i}" for i in range(5, 15)])
+        self.assertIsNotNone(data['next'])
+
+        data = self.get(limit=10, before=data['prev'])
+        self.assertEqual(self.contents(data), [f"m{i}" for i in range(5)])
+        self.assertIsNone(data['prev'])
+
+    def test_ties_on_created_at(self):
+        Message.objects.update(created_at=self.conversation.created_at)
+        data = self.get(limit=7)
+        seen = self.contents(data)
+        while data['next']:
+            data = self.get(limit=7, after=data['next'])
+            seen += self.contents(data)
+        self.assertEqual(seen, [f"m{i}" for i in range(25)])
+
+    def test_bad_parameters(self):
+        for params in [{'limit': 'x'}, {'limit': 0}, {'limit': 1000}, {'limit': 5, 'after': 'bogus'}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+    def test_ndjson_export(self):
+        response = self.client.get(self.url, {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b"".join(response.streaming_content).decode('utf-8').strip().split('\n')
+        self.assertEqual([json.loads(line)['content'] for line in lines], [f"m{i}" for i in range(25)])
+
+    def test_unchanged_conversation_is_not_modified(self):
+        response = self.client.get(self.url, {'latest': 10})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, {'latest': 10}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # The ETag covers the query
+        self.assertEqual(self.client.get(self.url, {'latest': 5}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        MessageWriter().save(Message(conversation=self.conversation, role='user', content="new"))
+        response = self.client.get(self.url, {'latest': 10}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.contents(response.json())[-1], "new")
+
+    def test_other_users_conversations_are_hidden(self):
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+class ConversationListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='password')
+        self.client.force_login(self.user)
+        for i in range(45):
+            Conversation.objects.create(user=self.user, title=f"c{i}")
+        Conversation.objects.create(user=User.objects.create_user(username='other'), title="not mine")
+
+    def test_index_renders_the_first_page(self):
+        response = self.client.get('/')
+        titles = [c.title for c in response.context['conversations']]
+        self.assertEqual(titles, [f"c{i}" for i in range(44, 14, -1)])
+        self.assertEqual(response.context['conversation_count'], 45)
+        self.assertContains(response, f'data-next="{response.context["next_cursor"]}"')
+
+    def test_pages_follow_the_index(self):
+        response = self.client.get('/')
+        data = self.client.get('/api/conversations/', {'after': response.context['next_cursor']}).json()
+        self.assertEqual([c['title'] for c in data['conversations']], [f"c{i}" for i in range(14, -1, -1)])
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['count'], 45)
+
+    def test_count_is_cached_and_invalidated(self):
+        self.assertEqual(Conversation.count_for(self.user.id), 45)
+        with self.assertNumQueries(0):
+            Conversation.count_for(self.user.id)
+
+        conversation = Conversation.objects.create(user=self.user, title="new")
+        self.assertEqual(Conversation.count_for(self.user.id), 46)
+        conversation.title = "renamed"
+        conversation.save()
+        with self.assertNumQueries(0):
+            Conversation.count_for(self.user.id)
+        conversation.delete()
+        self.assertEqual(Conversation.count_for(self.user.id), 45)
+
+    @override_settings(CONVERSATION_COUNT_TTL=0.1)
+    def test_count_expires(self):
+        self.assertEqual(Conversation.count_for(self.user.id), 45)
+        # Skips the signals, like a change made by another process
+        Conversation.objects.bulk_create([Conversation(user=self.user, title="elsewhere")])
+        self.assertEqual(Conversation.count_for(self.user.id), 45)
+        time.sleep(0.2)
+        self.assertEqual(Conversation.count_for(self.user.id), 46)
+
+    def test_bad_parameters(self):
+        for params in [{'limit': 0}, {'limit': 'x'}, {'after': 'bogus'}]:
+            self.assertEqual(self.client.get('/api/conversations/', params).status_code, 400, params)
@@ -0,0 +1,164 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .services import OllamaService
+from . import metrics
+import json
+import socket
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class RegistryTests(SimpleTestCase):
+    def test_exposition_format(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter('things_total', "Things.", ['kind'], registry=registry)
+        gauge = metrics.Gauge('level', "Level.", registry=registry)
+        histogram = metrics.Histogram('took_seconds', "Took.", ['kind'], buckets=(1, 5), registry=registry)
+        counter.inc(kind='a "quoted"\nkind')
+        counter.inc(2, kind='b')
+        gauge.set(1.5)
+        for value in (0.5, 2, 10):
+            histogram.observe(value, kind='x')
+
+        self.assertEqual(registry.render(), "\n".join([
+            '# HELP things_total Things.',
+            '# TYPE things_total counter',
+            'things_total{kind="a \\"quoted\\"\\nkind"} 1',
+            'things_total{kind="b"} 2',
+            '# HELP level Level.',
+            '# TYPE level gauge',
+            'level 1.5',
+            '# HELP took_seconds Took.',
+            '# TYPE took_seconds histogram',
+            'took_seconds_bucket{kind="x",le="1"} 1',
+            'took_seconds_bucket{kind="x",le="5"} 2',
+            'took_seconds_bucket{kind="x",le="+Inf"} 3',
+            'took_seconds_sum{kind="x"} 12.5',
+            'took_seconds_count{kind="x"} 3',
+        ]) + "\n")
+
+    def test_label_sets_are_capped(self):
+        counter = metrics.Counter('capped_total', "Capped.", ['model'], registry=metrics.Registry())
+        for i in range(metrics.MAX_SERIES + 5):
+            counter.inc(model=f"m{i}")
+        self.assertEqual(counter.get(model='other'), 5)
+        self.assertEqual(len(counter._series), metrics.MAX_SERIES + 1)
+
+class PipelineMetricsTests(SimpleTestCase):
+    messages = [{'role': 'user', 'content': 'Hi there'}]
+
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["a", "b", "c"], delay=0.02).start()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.fake.stop()
+
+    def assertObserved(self, histogram, model, count=1):
+        observed = histogram.get(model=model)
+        self.assertEqual(observed and observed[0], count, histogram.name)
+
+    def test_generation(self):
+        model = 'metrics-sync'
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_COALESCE=False):
+            OllamaService.reset()
+            self.assertEqual("".join(
+                chunk for chunk in OllamaService().process_chat(self.messages, model=model) if isinstance(chunk, str)
+            ), "abc")
+            OllamaService.reset()
+
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='done'), 1)
+        self.assertEqual(metrics.QUEUE_DEPTH.get(model=model), 0)
+        self.assertEqual(metrics.ACTIVE.get(model=model), 0)
+        for histogram in (metrics.QUEUE_WAIT, metrics.TIME_TO_FIRST_TOKEN, metrics.GENERATION,
+                          metrics.TOKENS_PER_SECOND, metrics.PROMPT_EVAL):
+            self.assertObserved(histogram, model)
+        # From Ollama's final message
+        self.assertEqual(metrics.EVAL_TOKENS.get(model=model), 3)
+        self.assertEqual(metrics.PROMPT_TOKENS.get(model=model), 2)
+        count, total = metrics.TOKENS_PER_SECOND.get(model=model)
+        self.assertLess(total, 3 / 0.04)
+
+    def test_async_generation(self):
+        model = 'metrics-async'
+
+        async def chat():
+            await AsyncOllamaService.reset()
+            try:
+                return "".join([chunk async for chunk in AsyncOllamaService().process_chat(self.messages, model=model)])
+            finally:
+                await AsyncOllamaService.reset()
+
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url):
+            self.assertEqual(async_to_sync(chat)(), "abc")
+
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='done'), 1)
+        self.assertEqual(metrics.QUEUE_DEPTH.get(model=model), 0)
+        self.assertEqual(metrics.EVAL_TOKENS.get(model=model), 3)
+        for histogram in (metrics.QUEUE_WAIT, metrics.TIME_TO_FIRST_TOKEN, metrics.GENERATION):
+            self.assertObserved(histogram, model)
+
+    def test_cancelled(self):
+        model = 'metrics-cancelled'
+        self.fake.delay = 0.2
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_COALESCE=False):
+            OllamaService.reset()
+            stream = OllamaService().process_chat(self.messages, model=model)
+            next(chunk for chunk in stream if isinstance(chunk, str))
+            stream.close()
+            OllamaService.reset()
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='cancelled'), 1)
+        self.assertIsNone(metrics.GENERATION.get(model=model))
+
+    def test_upstream_error(self):
+        model = 'metrics-down'
+        with override_settings(OLLAMA_BASE_URL=f"http://127.0.0.1:{unused_port()}", OLLAMA_RETRIES=0):
+            OllamaService.reset()
+            with self.assertRaises(Exception):
+                list(OllamaService().process_chat(self.messages, model=model))
+            OllamaService.reset()
+        self.assertEqual(metrics.REQUESTS.get(model=model, outcome='error'), 1)
+        self.assertEqual(metrics.UPSTREAM_ERRORS.get(model=model, kind='ConnectionError'), 1)
+
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', password='password')
+
+    def test_rejections_are_counted(self):
+        self.client.force_login(self.user)
+        with override_settings(OLLAMA_QUEUE_SIZE=0):
+            OllamaService.reset()
+            try:
+                response = self.client.post(
+                    '/api/chat/', data=json.dumps({'prompt': 'Hi', 'model': 'metrics-busy'}),
+                    content_type='application/json',
+                )
+            finally:
+                OllamaService.reset()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(metrics.REQUESTS.get(model='metrics-busy', outcome='rejected'), 1)
+
+    @override_settings(OLLAMA_METRICS_TOKEN='secret')
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn(b'# TYPE ollama_time_to_first_token_seconds histogram', response.content)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_no_token_configured(self):
+        with override_settings(OLLAMA_METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer None').status_code, 403)
@@ -0,0 +1,29 @@
+from django.test import SimpleTestCase
+from .ndjson import NDJSONDecoder, iter_ndjson
+import json
+
+class NDJSONDecoderTests(SimpleTestCase):
+    def setUp(self):
+        self.objects = [
+            {'message': {'role': 'assistant', 'content': f"token {i} é\n"}, 'done': False}
+            for i in range(50)
+        ] + [{'done': True, 'eval_count': 50}]
+        self.data = b"".join(json.dumps(obj).encode('utf-8') + b"\n" for obj in self.objects)
+
+    def test_any_chunking_gives_the_same_objects(self):
+        for size in (1, 2, 7, 64, 1000, len(self.data)):
+            chunks = [self.data[i:i + size] for i in range(0, len(self.data), size)]
+            self.assertEqual(list(iter_ndjson(chunks)), self.objects, size)
+
+    def test_feed_returns_completed_lines_only(self):
+        decoder = NDJSONDecoder()
+        self.assertEqual(decoder.feed(b'{"a": 1}\n{"b"'), [{'a': 1}])
+        self.assertEqual(decoder.feed(b': 2}'), [])
+        self.assertEqual(decoder.feed(b'\n\n  \n'), [{'b': 2}])
+        self.assertEqual(decoder.close(), [])
+
+    def test_trailing_line_and_invalid_lines(self):
+        decoder = NDJSONDecoder()
+        self.assertEqual(decoder.feed(b'not json\n{"a": 1}\n{"done": true}'), [{'a': 1}])
+        self.assertEqual(decoder.close(), [{'done': True}])
+        self.assertEqual(decoder.errors, 1)
@@ -0,0 +1,229 @@
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase, override_settings
+from fake_ollama import FakeOllama
+from .models import Conversation, Message
+from .persistence import MessageWriter, reset_writer
+from .services import OllamaService
+from .signals import messages_persisted
+import json
+import time
+
+class MessageWriterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='password')
+        self.conversation = Conversation.objects.create(user=self.user, title="Test")
+
+    def test_sync_writes_immediately_and_touches_conversation(self):
+        before = self.conversation.updated_at
+        writer = MessageWriter()
+        message = writer.save(Message(conversation=self.conversation, role='user', content='Hello there'))
+
+        self.assertIsNotNone(message.pk)
+        self.assertEqual(Message.objects.get().token_count, 3)
+        self.assertGreater(Conversation.objects.get().updated_at, before)
+
+        message.content = 'Hello there, again'
+        writer.save(message)
+        self.assertEqual(Message.objects.get().content, 'Hello there, again')
+
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='password')
+        self.conversation = Conversation.objects.create(user=self.user, title="Test")
+        self.writer = MessageWriter(write_behind=True, batch_size=100, flush_interval=10)
+        self.persisted = []
+        messages_persisted.connect(self.on_persisted)
+
+    def tearDown(self):
+        messages_persisted.disconnect(self.on_persisted)
+        self.writer.close()
+
+    def on_persisted(self, sender, created, updated, **kwargs):
+        self.persisted.append(([m.content for m in created], [m.content for m in updated]))
+
+    def test_messages_are_written_in_one_batch_on_flush(self):
+        messages = [
+            self.writer.save(Message(conversation=self.conversation, role='user', content=f'm{i}'))
+            for i in range(5)
+        ]
+        self.assertEqual(Message.objects.count(), 0)
+        self.assertTrue(self.writer.has_pending(self.conversation.id))
+
+        self.writer.flush()
+        self.assertFalse(self.writer.has_pending(self.conversation.id))
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('content', 'token_count')),
+            [(f'm{i}', 1) for i in range(5)],
+        )
+        self.assertTrue(all(m.pk for m in messages))
+        self.assertEqual(self.persisted, [(['m0', 'm1', 'm2', 'm3', 'm4'], [])])
+
+    def test_saving_again_updates_the_row(self):
+        message = self.writer.save(Message(conversation=self.conversation, role='bot', content='partial'))
+        message.content = 'partial and more'
+        self.writer.save(message)
+        self.writer.flush()
+        self.assertEqual(Message.objects.get().content, 'partial and more')
+
+        message.content = 'partial and more, done'
+        self.writer.save(message)
+        self.writer.flush()
+        self.assertEqual(Message.objects.get().content, 'partial and more, done')
+        self.assertEqual(self.persisted[-1], ([], ['partial and more, done']))
+
+    def test_full_batch_is_written_without_waiting(self):
+        writer = MessageWriter(write_behind=True, batch_size=3, flush_interval=10)
+        try:
+            for i in range(3):
+                writer.save(Message(conversation=self.conversation, role='user', content=f'm{i}'))
+            # Poll the writer rather than the table: the in-memory test
+            # database fails reads outright while the writer holds its lock
+            deadline = time.monotonic() + 2
+            while writer.has_pending(self.conversation.id) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(Message.objects.count(), 3)
+        finally:
+            writer.close()
+
+    def test_failed_batch_is_retried(self):
+        writer = MessageWriter(write_behind=True, flush_interval=10, retry_delay=0.05)
+        write, failures = writer._write, []
+
+        def flaky(batch):
+            messages, _ = batch
+            if len(failures) < 2:
+                failures.append([m.content for m in messages])
+                raise DatabaseError("database is locked")
+            write(batch)
+
+        writer._write = flaky
+        try:
+            writer.save(Message(conversation=self.conversation, role='user', content='first'))
+            writer.flush()
+            self.assertEqual(failures, [['first'], ['first']])
+            self.assertEqual(Message.objects.get().content, 'first')
+        finally:
+            writer.close()
+
+    def test_bad_conversation_only_loses_its_own_messages(self):
+        writer = MessageWriter(write_behind=True, flush_interval=10, attempts=2, retry_delay=0.01)
+        gone = Conversation.objects.create(user=self.user, title="Deleted mid-reply")
+        orphan = Message(conversation_id=gone.id, role='bot', content='orphan')
+        gone.delete()
+        try:
+            writer.save(orphan)
+            writer.save(Message(conversation=self.conversation, role='user', content='kept'))
+            writer.flush()
+            self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['kept'])
+        finally:
+            writer.close()
+
+    def test_bad_conversation_does_not_hold_up_others(self):
+        writer = MessageWriter(write_behind=True, flush_interval=10, attempts=2, retry_delay=1)
+        gone = Conversation.objects.create(user=self.user, title="Deleted mid-reply")
+        gone_id = gone.id
+        orphan = Message(conversation_id=gone_id, role='bot', content='orphan')
+        gone.delete()
+        try:
+            writer.save(orphan)
+            writer.save(Message(conversation=self.conversation, role='user', content='kept'))
+            started = time.monotonic()
+            writer.wait_for(self.conversation.id)
+            # Written on the first failure, without waiting for the orphan's retry
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertFalse(writer.has_pending(self.conversation.id))
+            self.assertTrue(writer.has_pending(gone_id))
+
+            writer.save(Message(conversation=self.conversation, role='bot', content='next'))
+            writer.wait_for(self.conversation.id)
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual(Message.objects.count(), 2)
+        finally:
+            writer.flush()
+            writer.close()
+
+    def test_close_flushes(self):
+        self.writer.save(Message(conversation=self.conversation, role='user', content='last words'))
+        self.writer.close()
+        self.assertEqual(Message.objects.get().content, 'last words')
+        with self.assertRaises(RuntimeError):
+            self.writer.save(Message(conversation=self.conversation, role='user', content='too late'))
+
+@override_settings(OLLAMA_WRITE_BEHIND=True, OLLAMA_WRITE_BEHIND_INTERVAL=10)
+class WriteBehindChatTests(TransactionTestCase):
+    def setUp(self):
+        reset_writer()
+        self.user = User.objects.create_user(username='writer', password='password')
+        self.client.force_login(self.user)
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"]).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url)
+        self.override.enable()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+        reset_writer()
+
+    def chat(self, prompt, conversation_id=None):
+        data = {'prompt': prompt}
+        if conversation_id:
+            data['conversation_id'] = conversation_id
+        response = self.client.post('/api/chat/', data=json.dumps(data), content_type='application/json')
+        content = b"".join(response.streaming_content).decode('utf-8')
+        return json.loads(content.split('\n')[0])['conversation_id']
+
+    def test_turns_see_messages_still_queued(self):
+        conversation_id = self.chat('Hi')
+        self.assertEqual(self.fake.requests[0]['messages'], [{'role': 'user', 'content': 'Hi'}])
+        self.assertEqual(Message.objects.count(), 0)
+
+        self.chat('And again?', conversation_id)
+        self.assertEqual(self.fake.requests[1]['messages'], [
+            {'role': 'user', 'content': 'Hi'},
+            {'role': 'assistant', 'content': 'Hello World'},
+            {'role': 'user', 'content': 'And again?'},
+        ])
+
+        reset_writer()
+        self.assertEqual(
+            list(Message.objects.order_by('created_at', 'id').values_list('role', 'content')),
+            [('user', 'Hi'), ('bot', 'Hello World'), ('user', 'And again?'), ('bot', 'Hello World')],
+        )
+
+class CheckpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='password')
+        self.client.force_login(self.user)
+        self.fake = FakeOllama(tokens=["t"] * 1000, delay=0.01).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_CHECKPOINT_INTERVAL=0.05)
+        self.override.enable()
+        reset_writer()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        reset_writer()
+        self.override.disable()
+        self.fake.stop()
+
+    def test_partial_reply_is_kept(self):
+        response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}), content_type='application/json')
+        stream = iter(response.streaming_content)
+        next(stream)  # metadata
+        for _ in range(20):
+            next(stream)
+
+        # Checkpointed while streaming
+        deadline = time.monotonic() + 2
+        while not Message.objects.filter(role='bot').exists() and time.monotonic() < deadline:
+            for _ in range(5):
+                next(stream)
+        self.assertTrue(Message.objects.filter(role='bot').exists())
+
+        response.close()
+        bot = Message.objects.get(role='bot')
+        self.assertGreaterEqual(len(bot.content), 20)
+        self.assertLess(len(bot.content), 1000)
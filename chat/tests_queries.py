@@ -0,0 +1,183 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .models import Conversation, Message
+from .services import OllamaService
+import json
+import re
+import unittest
+
+# A plan step that reads a whole chat table (or a whole index of it)
+FULL_SCAN = re.compile(r'^SCAN (chat_message|chat_conversation)\b')
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite's")
+class ViewQueryTests(TestCase):
+    """
+    Query counts and plans of every view in chat.views, for a user among
+    others with plenty of history. Counts must not grow with the history,
+    and queries on the chat tables must be index searches that return rows
+    already in the requested order.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='planner', password='password')
+        for owner in [cls.user] + [User.objects.create_user(username=f'other{i}') for i in range(3)]:
+            conversations = Conversation.objects.bulk_create([
+                Conversation(user=owner, title=f"Chat {i}") for i in range(20)
+            ])
+            Message.objects.bulk_create([
+                Message(conversation=conversation, role='user' if i % 2 == 0 else 'bot',
+                        content=f"message {i}", token_count=3)
+                for conversation in conversations for i in range(30)
+            ])
+        cls.conversation = cls.user.conversations.first()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"]).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url)
+        self.override.enable()
+        OllamaService.reset()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queries):
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not re.search(r'"chat_(message|conversation)"', sql):
+                continue
+            checked += 1
+            for step in self.plan(sql):
+                self.assertNotRegex(step, FULL_SCAN, sql)
+                self.assertNotIn('TEMP B-TREE', step, sql)
+        return checked
+
+    def test_index(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        # session, user, first page of conversations, conversation count
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(self.assertIndexed(queries), 2)
+        self.assertIn('chat_conv_user_updated', "".join(self.plan(queries[2]['sql'])))
+
+        # The count is cached
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/')
+        self.assertEqual(len(queries), 3)
+
+    def test_get_conversations(self):
+        first = self.client.get('/api/conversations/', {'limit': 5}).json()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/', {'limit': 5, 'after': first['next']})
+        self.assertEqual(len(response.json()['conversations']), 5)
+        # session, user, page (count cached by the first request)
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(self.assertIndexed(queries), 1)
+        self.assertIn('chat_conv_user_updated', "".join(self.plan(queries[-1]['sql'])))
+
+    def test_get_messages(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/messages/{self.conversation.id}/')
+        self.assertEqual(len(response.json()['messages']), 30)
+        # session, user, conversation, messages
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(self.assertIndexed(queries), 2)
+        self.assertIn('chat_msg_conv_created', "".join(self.plan(queries[-1]['sql'])))
+
+    def test_get_messages_pages(self):
+        first = self.client.get(f'/api/messages/{self.conversation.id}/', {'latest': 10}).json()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/messages/{self.conversation.id}/', {'limit': 10, 'before': first['prev']})
+        self.assertEqual(len(response.json()['messages']), 10)
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(self.assertIndexed(queries), 2)
+        self.assertIn('chat_msg_conv_created', "".join(self.plan(queries[-1]['sql'])))
+
+    def test_get_messages_is_in_order(self):
+        Message.objects.filter(conversation=self.conversation).update(created_at=self.conversation.created_at)
+        response = self.client.get(f'/api/messages/{self.conversation.id}/')
+        self.assertEqual(
+            [m['content'] for m in response.json()['messages']],
+            [f"message {i}" for i in range(30)],
+        )
+
+    def test_get_models(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/models/')
+        self.assertEqual(response.status_code, 200)
+        # session, user
+        self.assertEqual(len(queries), 2)
+
+    def test_api_chat(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/chat/', data=json.dumps({'prompt': 'Hi', 'conversation_id': self.conversation.id}),
+                content_type='application/json',
+            )
+            b"".join(response.streaming_content)
+        # session, user, conversation, context, then for the user and the
+        # bot message: insert, search index insert, conversation touch
+        self.assertEqual(len(queries), 10)
+        self.assertEqual(self.assertIndexed(queries), 2)
+
+    def test_auth_views(self):
+        self.client.logout()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/login/', {'username': 'planner', 'password': 'password'})
+            self.client.get('/logout/')
+            self.client.get('/register/')
+        self.assertEqual(self.assertIndexed(queries), 0)
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite's")
+@override_settings(ROOT_URLCONF='chat.tests_async')
+class AsyncViewQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='planner', password='password')
+        self.conversation = Conversation.objects.create(user=self.user, title="Chat")
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"]).start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    plan = ViewQueryTests.plan
+
+    def test_api_chat_async(self):
+        async_to_sync(self.async_client.aforce_login)(self.user)
+
+        async def chat():
+            await AsyncOllamaService.reset()
+            response = await self.async_client.post(
+                '/api/chat/', data=json.dumps({'prompt': 'Hi', 'conversation_id': self.conversation.id}),
+                content_type='application/json',
+            )
+            content = b"".join([chunk async for chunk in response.streaming_content])
+            await AsyncOllamaService.reset()
+            return content
+
+        with override_settings(OLLAMA_BASE_URL=self.fake.base_url):
+            # The async ORM runs its queries on this thread's connection
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIn(b"World", async_to_sync(chat)())
+
+        # As api_chat
+        self.assertEqual(len(queries), 10)
+        self.assertEqual(ViewQueryTests.assertIndexed(self, queries), 2)
@@ -0,0 +1,120 @@
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from fake_ollama import FakeOllama
+from .backends import BackendPool
+from .residency import ResidencyManager
+from .services import OllamaService
+from .tests_backends import Clock
+from .transport import build_session
+import time
+
+class KeepAliveTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        pool = BackendPool(['http://a'], health_interval=0)
+        self.residency = ResidencyManager(pool, preload=['pinned'], hot_keep_alive='1h', cold_keep_alive='1m',
+                                          hot_requests=2, window=60, clock=self.clock)
+
+    def test_hot_after_enough_recent_requests(self):
+        self.residency.record('m')
+        self.assertEqual(self.residency.keep_alive('m'), '1m')
+        self.clock.now = 30
+        self.residency.record('m')
+        self.assertEqual(self.residency.keep_alive('m'), '1h')
+        # The first request has left the window
+        self.clock.now = 61
+        self.assertEqual(self.residency.keep_alive('m'), '1m')
+
+    def test_preloaded_models_are_pinned(self):
+        self.assertEqual(self.residency.keep_alive('pinned'), -1)
+        self.assertEqual(self.residency.keep_alive('unused'), '1m')
+
+class ResidencyTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(models=("a", "b", "c")).start()
+        self.session = build_session()
+        self.pool = BackendPool([self.fake.base_url], session=self.session, health_interval=0)
+        self.clock = Clock()
+
+    def tearDown(self):
+        self.session.close()
+        self.fake.stop()
+
+    def manager(self, **kwargs):
+        return ResidencyManager(self.pool, session=self.session, hot_requests=2, clock=self.clock, **kwargs)
+
+    def test_preload(self):
+        self.manager(preload=['b']).preload()
+        self.assertEqual(self.fake.loaded, ['b'])
+        self.assertEqual(self.fake.requests, [{'model': 'b', 'messages': [], 'stream': False, 'keep_alive': -1}])
+        self.assertEqual(self.pool.warm_models(), ['b'])
+
+    def test_unloads_least_recently_used_cold_models(self):
+        self.fake.loaded = ['a', 'b', 'c']
+        residency = self.manager(max_loaded=2, max_bytes=int(1.5 * self.fake.model_size))
+        residency.record('a')
+        residency.record('a')
+        self.clock.now = 1
+        residency.record('b')
+        # c, never used here, goes for the count; then b for the bytes.
+        # a is hot and stays even though the host is still over.
+        self.pool.check_all()
+        self.assertEqual(self.fake.loaded, ['a'])
+        self.assertEqual([r['model'] for r in self.fake.requests], ['c', 'b'])
+        self.assertEqual(self.pool.warm_models(), ['a'])
+
+    def test_no_limits_no_unloading(self):
+        self.fake.loaded = ['a', 'b', 'c']
+        self.manager()
+        self.pool.check_all()
+        self.assertEqual(self.fake.requests, [])
+
+class ServiceResidencyTests(TestCase):
+    messages = [{'role': 'user', 'content': 'Hi'}]
+
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["a", "b"], models=("llama3.1:8b", "mistral")).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_COALESCE=False,
+                                          OLLAMA_HEALTH_INTERVAL=0, OLLAMA_HOT_REQUESTS=2)
+        self.override.enable()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def test_keep_alive_follows_traffic(self):
+        service = OllamaService()
+        for _ in range(2):
+            list(service.process_chat(self.messages, model='mistral'))
+        self.assertEqual([r.get('keep_alive') for r in self.fake.requests], [None, '30m'])
+
+    def test_preloaded_when_the_service_is_first_used(self):
+        with override_settings(OLLAMA_PRELOAD_MODELS=['mistral']):
+            # Loading the app (migrate, tests, workers) starts nothing
+            apps.get_app_config('chat').ready()
+            self.assertIsNone(OllamaService._instance)
+
+            OllamaService()
+            deadline = time.monotonic() + 2
+            while not self.fake.loaded and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(self.fake.loaded, ['mistral'])
+        self.assertEqual(self.fake.requests[0]['keep_alive'], -1)
+
+    def test_warm_models_in_the_model_list(self):
+        self.fake.loaded = ['mistral']
+        OllamaService().pool.check_all()
+        user = User.objects.create_user(username='warmuser', password='password')
+        self.client.force_login(user)
+        response = self.client.get('/api/models/')
+        self.assertEqual(response.json(), {'models': ["llama3.1:8b", "mistral"], 'warm': ["mistral"]})
+
+        # A change in what is loaded changes the ETag
+        self.fake.loaded = []
+        OllamaService().pool.check_all()
+        fresh = self.client.get('/api/models/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(fresh.json()['warm'], [])
@@ -0,0 +1,135 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .cache import ResponseCache, cache_key, get_response_cache, reset_response_cache
+from .services import OllamaService
+import json
+import time
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set('a', ['1'])
+        cache.set('b', ['2'])
+        cache.get('a')
+        cache.set('c', ['3'])
+        self.assertEqual(cache.get('a'), ['1'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), ['3'])
+
+    def test_entries_expire(self):
+        now = [0]
+        cache = ResponseCache(ttl=10, clock=lambda: now[0])
+        cache.set('a', ['1'])
+        now[0] = 9
+        self.assertEqual(cache.get('a'), ['1'])
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_size_cap(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.set('big', ['x' * 11])
+        self.assertIsNone(cache.get('big'))
+
+        cache.set('a', ['x' * 6])
+        cache.set('b', ['y' * 6])
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), ['y' * 6])
+
+    def test_key_normalization(self):
+        messages = [{'role': 'user', 'content': 'Hi'}]
+        self.assertEqual(
+            cache_key('m', messages),
+            cache_key('m', [{'role': 'user', 'content': '  Hi\n', 'id': 3}]),
+        )
+        self.assertEqual(cache_key('m', messages, {'seed': 1, 'temperature': 0}),
+                         cache_key('m', messages, {'temperature': 0, 'seed': 1}))
+        self.assertNotEqual(cache_key('m', messages), cache_key('other', messages))
+        self.assertNotEqual(cache_key('m', messages), cache_key('m', messages, {'seed': 1}))
+
+class CachedServiceTests(TestCase):
+    def setUp(self):
+        reset_response_cache()
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"]).start()
+        # Token by token, so live and replayed frames can be compared
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_RESPONSE_CACHE=True,
+                                          OLLAMA_STREAM_FLUSH_INTERVAL=0)
+        self.override.enable()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+        reset_response_cache()
+
+    def test_hit_is_replayed_without_calling_ollama(self):
+        service = OllamaService()
+        messages = [{'role': 'user', 'content': 'Hi'}]
+        self.assertEqual(list(service.process_chat(messages)), ["Hello", " ", "World"])
+        self.assertEqual(list(service.process_chat(messages)), ["Hello", " ", "World"])
+        self.assertEqual(len(self.fake.requests), 1)
+        self.assertEqual(get_response_cache().hits, 1)
+
+    def test_options_are_sent_and_part_of_the_key(self):
+        service = OllamaService()
+        list(service.process_chat([], options={'seed': 1}))
+        list(service.process_chat([], options={'seed': 2}))
+        self.assertEqual(len(self.fake.requests), 2)
+        self.assertEqual(self.fake.requests[0]['options'], {'seed': 1})
+
+    def test_deterministic_only(self):
+        service = OllamaService()
+        with override_settings(OLLAMA_RESPONSE_CACHE_DETERMINISTIC_ONLY=True):
+            list(service.process_chat([]))
+            list(service.process_chat([]))
+            list(service.process_chat([], options={'temperature': 0}))
+            list(service.process_chat([], options={'temperature': 0}))
+        self.assertEqual(len(self.fake.requests), 3)
+
+    def test_interrupted_generation_is_not_cached(self):
+        self.fake.tokens = ["t"] * 100
+        self.fake.delay = 0.01
+        service = OllamaService()
+        generator = service.process_chat([])
+        self.assertEqual(next(generator), "t")
+        generator.close()
+
+        deadline = time.monotonic() + 2
+        while service.pending() or service._active['llama3.1:8b']:
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(get_response_cache()), 0)
+
+    def test_off_by_default(self):
+        with override_settings(OLLAMA_RESPONSE_CACHE=False):
+            service = OllamaService()
+            list(service.process_chat([]))
+            list(service.process_chat([]))
+            self.assertIsNone(get_response_cache())
+        self.assertEqual(len(self.fake.requests), 2)
+
+    async def test_async_service_shares_the_cache(self):
+        await AsyncOllamaService.reset()
+        service = AsyncOllamaService()
+        first = [chunk async for chunk in service.process_chat([])]
+        second = [chunk async for chunk in service.process_chat([])]
+        await AsyncOllamaService.reset()
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_view_replays_the_same_frames(self):
+        user = User.objects.create_user(username='cacheuser', password='password')
+        self.client.force_login(user)
+
+        def chat():
+            response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}),
+                                        content_type='application/json')
+            lines = b"".join(response.streaming_content).decode('utf-8').strip().split('\n')
+            return [json.loads(line) for line in lines[1:]]
+
+        self.assertEqual(chat(), chat())
+        self.assertEqual(len(self.fake.requests), 1)
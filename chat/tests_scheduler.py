@@ -0,0 +1,88 @@
+from django.test import SimpleTestCase
+from .scheduler import FairScheduler, FIFOScheduler
+import queue
+
+def job(user, n, priority='default', model='m'):
+    return {'user': user, 'n': n, 'priority': priority, 'model': model}
+
+class FairSchedulerTests(SimpleTestCase):
+    def drain(self, scheduler, eligible=None):
+        order = []
+        while len(scheduler):
+            order.append(scheduler.get(eligible))
+        return order
+
+    def test_round_robin_between_users(self):
+        scheduler = FairScheduler(depth=10)
+        for n in range(3):
+            scheduler.put(job('heavy', n))
+        scheduler.put(job('light', 0))
+        scheduler.put(job('other', 0))
+
+        order = [(j['user'], j['n']) for j in self.drain(scheduler)]
+        self.assertEqual(order, [('heavy', 0), ('light', 0), ('other', 0), ('heavy', 1), ('heavy', 2)])
+
+    def test_priority_classes(self):
+        scheduler = FairScheduler(depth=10, priorities=['staff', 'default', 'background'])
+        scheduler.put(job('a', 0, 'background'))
+        scheduler.put(job('b', 0))
+        scheduler.put(job('c', 0, 'staff'))
+        scheduler.put(job('d', 0, 'unknown'))
+
+        self.assertEqual([j['user'] for j in self.drain(scheduler)], ['c', 'b', 'a', 'd'])
+
+    def test_positions_match_serving_order(self):
+        scheduler = FairScheduler(depth=20, priorities=['staff', 'default'])
+        jobs = [job('heavy', n) for n in range(5)] + [job('light', 0), job('boss', 0, 'staff')]
+        jobs += [job('light', 1), job('third', 0)]
+        for j in jobs:
+            scheduler.put(j)
+
+        positions = {id(j): scheduler.position(j) for j in jobs}
+        order = self.drain(scheduler)
+        self.assertEqual([positions[id(j)] for j in order], list(range(1, len(jobs) + 1)))
+        self.assertIsNone(scheduler.position(jobs[0]))
+
+    def test_depth_limits(self):
+        scheduler = FairScheduler(depth=3, per_user_depth=2)
+        scheduler.put(job('a', 0))
+        scheduler.put(job('a', 1))
+        with self.assertRaises(queue.Full):
+            scheduler.put(job('a', 2))
+        scheduler.put(job('b', 0))
+        with self.assertRaises(queue.Full):
+            scheduler.put(job('c', 0))
+
+    def test_ineligible_jobs_are_skipped_not_dropped(self):
+        scheduler = FairScheduler(depth=10)
+        big, small = job('a', 0, model='big'), job('b', 0, model='small')
+        scheduler.put(big)
+        scheduler.put(small)
+
+        self.assertIs(scheduler.get(lambda j: j['model'] != 'big'), small)
+        self.assertEqual(scheduler.position(big), 1)
+        self.assertIs(scheduler.get(), big)
+
+    def test_get_nowait(self):
+        scheduler = FairScheduler(depth=10)
+        self.assertIsNone(scheduler.get_nowait())
+        big = job('a', 0, model='big')
+        scheduler.put(big)
+        self.assertIsNone(scheduler.get_nowait(lambda j: j['model'] != 'big'))
+        self.assertIs(scheduler.get_nowait(), big)
+        self.assertEqual(len(scheduler), 0)
+
+    def test_remove(self):
+        for scheduler in (FairScheduler(depth=10), FIFOScheduler(depth=10)):
+            first, second = job('a', 0), job('a', 1)
+            scheduler.put(first)
+            scheduler.put(second)
+            self.assertTrue(scheduler.remove(first))
+            self.assertFalse(scheduler.remove(first))
+            self.assertEqual(scheduler.position(second), 1)
+            self.assertEqual(len(scheduler), 1)
+
+    def test_close_wakes_workers(self):
+        scheduler = FIFOScheduler()
+        scheduler.close()
+        self.assertIsNone(scheduler.get())
@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from .models import Conversation, Message
+from .search import search_messages
+from .signals import messages_persisted
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.conversation = Conversation.objects.create(user=self.user, title="Travel")
+        self.add("Planning a trip to Lisbon in spring")
+        self.add("Lisbon has great <pastries> and Lisbon trams", role='bot')
+        self.add("What about Porto?")
+        other = Conversation.objects.create(user=self.other, title="Secret")
+        Message.objects.create(conversation=other, role='user', content="My Lisbon secret")
+
+    def add(self, content, role='user'):
+        return Message.objects.create(conversation=self.conversation, role=role, content=content)
+
+    def contents(self, text):
+        return [Message.objects.get(id=r['id']).content for r in search_messages(text, self.user.id)]
+
+    def test_only_own_messages_best_first(self):
+        results = search_messages("lisbon", self.user.id)
+        self.assertEqual([r['role'] for r in results], ['bot', 'user'])
+        self.assertEqual(results[0]['conversation_title'], "Travel")
+        self.assertIn('<mark>Lisbon</mark>', results[0]['snippet'])
+        self.assertIn('&lt;pastries&gt;', results[0]['snippet'])
+
+    def test_all_words_and_prefixes(self):
+        self.assertEqual(self.contents("trip lisbon"), ["Planning a trip to Lisbon in spring"])
+        self.assertEqual(self.contents("trip lisb"), [])
+        self.assertEqual(self.contents("trip lisb*"), ["Planning a trip to Lisbon in spring"])
+        self.assertEqual(self.contents("porto lisbon"), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        for text in ['"', 'lisbon OR', 'NEAR(', '*', 'owner : u2', '']:
+            search_messages(text, self.user.id)
+        self.assertEqual(search_messages('', self.user.id), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.add("Madrid maybe")
+        message.content = "Valencia maybe"
+        message.save()
+        self.assertEqual(self.contents("madrid"), [])
+        self.assertEqual(self.contents("valencia"), ["Valencia maybe"])
+
+        message.delete()
+        self.assertEqual(self.contents("valencia"), [])
+        self.conversation.delete()
+        self.assertEqual(self.contents("lisbon"), [])
+
+    def test_index_follows_a_change_of_owner(self):
+        conversation = Conversation.objects.get(id=self.conversation.id)
+        conversation.user = self.other
+        conversation.save()
+        self.assertEqual(self.contents("lisbon"), [])
+        self.assertEqual(len(search_messages("lisbon", self.other.id)), 3)
+
+    def test_results_are_checked_against_the_owner(self):
+        # A stale index entry, e.g. after a queryset update() moved the conversation
+        Conversation.objects.filter(id=self.conversation.id).update(user=self.other)
+        self.assertEqual(self.contents("lisbon"), [])
+
+    def test_batched_writes_are_indexed(self):
+        created = Message.objects.bulk_create([
+            Message(conversation=self.conversation, role='user', content="Seville in summer")
+        ])
+        self.assertEqual(self.contents("seville"), [])
+        messages_persisted.send(sender=Message, created=created, updated=[])
+        self.assertEqual(self.contents("seville"), ["Seville in summer"])
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/api/search/', {'q': 'lisbon', 'limit': 1})
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(response.json()['results'][0]['conversation_id'], self.conversation.id)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'x', 'limit': 'many'}).status_code, 400)
+
+    def test_admin_search_uses_the_index(self):
+        admin = User.objects.create_superuser(username='admin', password='password')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/chat/message/', {'q': 'lisbon'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        # Usernames and titles still match
+        response = self.client.get('/admin/chat/message/', {'q': 'Travel'})
+        self.assertEqual(response.context['cl'].result_count, 3)
@@ -0,0 +1,170 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from unittest.mock import patch
+from fake_ollama import FakeOllama
+from .services import OllamaService
+from .streams import StreamBuffer, aproduce
+import asyncio
+import json
+import threading
+import time
+
+def parse(frames):
+    """(id, data) for each event of an SSE body, and the number of heartbeats."""
+    events, heartbeats = [], 0
+    for frame in b"".join(frames).decode("utf-8").split("\n\n"):
+        if frame.startswith(":"):
+            heartbeats += 1
+        elif frame:
+            fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+            events.append((int(fields['id']), json.loads(fields['data'])))
+    return events, heartbeats
+
+class StreamBufferTests(SimpleTestCase):
+    def test_read_after(self):
+        buffer = StreamBuffer(1)
+        buffer.append({'n': 0})
+        buffer.append({'n': 1})
+        self.assertEqual(buffer.read(0, 0), ([(1, {'n': 1})], False))
+        # Nothing new yet: waits, then comes back empty
+        self.assertEqual(buffer.read(1, 0.01), ([], False))
+        buffer.finish()
+        self.assertEqual(buffer.read(1, None), ([], True))
+
+    def test_async_readers_are_woken(self):
+        buffer = StreamBuffer(1)
+
+        async def read():
+            return await buffer.aread(-1, 5)
+
+        threading.Timer(0.05, buffer.append, [{'n': 0}]).start()
+        started = time.monotonic()
+        self.assertEqual(async_to_sync(read)(), ([(0, {'n': 0})], False))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_abandoned(self):
+        now = [0]
+        buffer = StreamBuffer(1, grace=10, clock=lambda: now[0])
+        buffer.attach()
+        now[0] = 20
+        self.assertFalse(buffer.abandoned())
+        buffer.detach()
+        self.assertFalse(buffer.abandoned())
+        now[0] = 30
+        self.assertTrue(buffer.abandoned())
+
+    def test_quiet_async_producer_is_stopped_once_abandoned(self):
+        closed = []
+
+        async def events():
+            try:
+                yield {'n': 0}
+                await asyncio.sleep(30)
+            finally:
+                closed.append(True)
+
+        async def run():
+            buffer = StreamBuffer(1, grace=0.1)
+            aproduce(buffer, events())
+            await asyncio.wait([buffer.task], timeout=2)
+            return buffer
+
+        buffer = async_to_sync(run)()
+        self.assertEqual(closed, [True])
+        self.assertTrue(buffer.finished)
+
+# The generation is saved from its own thread
+class SSEChatTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sseuser', password='password')
+        self.client.force_login(self.user)
+        patcher = patch('chat.views.OllamaService')
+        self.service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def generate(self, tokens, delay=0.0):
+        def chat(messages, model, **kwargs):
+            for token in tokens:
+                time.sleep(delay)
+                yield token
+        self.service.process_chat.side_effect = chat
+
+    def post(self):
+        return self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}),
+                                content_type='application/json', HTTP_ACCEPT='text/event-stream')
+
+    def test_events(self):
+        self.generate(["Hello", " ", "World"])
+        response = self.post()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events, _ = parse(response.streaming_content)
+
+        self.assertEqual([i for i, _ in events], list(range(5)))
+        metadata = events[0][1]
+        self.assertEqual(set(metadata), {'conversation_id', 'title', 'stream_id'})
+        self.assertEqual([data for _, data in events[1:]],
+                         [{'content': "Hello"}, {'content': " "}, {'content': "World"}, {'done': True}])
+
+    @override_settings(OLLAMA_SSE_HEARTBEAT=0.02)
+    def test_heartbeats_while_quiet(self):
+        self.generate(["a", "b"], delay=0.15)
+        _, heartbeats = parse(self.post().streaming_content)
+        self.assertGreater(heartbeats, 2)
+
+    def test_resume_after_a_dropped_connection(self):
+        self.generate(["a", "b", "c", "d"], delay=0.05)
+        response = self.post()
+        content = iter(response.streaming_content)
+        received, _ = parse([next(content), next(content)])
+        # The client goes away; the generation carries on
+        response.close()
+        (last_id, _), stream_id = received[-1], received[0][1]['stream_id']
+
+        resumed = self.client.get(f'/api/chat/streams/{stream_id}/', HTTP_LAST_EVENT_ID=str(last_id))
+        self.assertEqual(resumed.status_code, 200)
+        events, _ = parse(resumed.streaming_content)
+        self.assertEqual(received + events, list(enumerate([
+            received[0][1], {'content': "a"}, {'content': "b"}, {'content': "c"}, {'content': "d"}, {'done': True},
+        ])))
+
+        # Still there after it finished, for its owner only
+        replay = self.client.get(f'/api/chat/streams/{stream_id}/?last_event_id=4')
+        self.assertEqual(parse(replay.streaming_content)[0], [(5, {'done': True})])
+        self.assertEqual(self.client.get(f'/api/chat/streams/{stream_id}/', HTTP_LAST_EVENT_ID='x').status_code, 400)
+        self.client.force_login(User.objects.create_user(username='other', password='password'))
+        self.assertEqual(self.client.get(f'/api/chat/streams/{stream_id}/').status_code, 404)
+
+    def test_ndjson_without_accept(self):
+        self.generate(["Hello"])
+        response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}), content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[1:], [{'content': "Hello"}])
+
+class AbandonedStreamTests(TransactionTestCase):
+    def test_queued_chat_is_cancelled(self):
+        fake = FakeOllama(tokens=["a", "b"], stall=30).start()
+        self.addCleanup(fake.stop)
+        self.client.force_login(User.objects.create_user(username='leaver', password='password'))
+        settings = dict(OLLAMA_BASE_URL=fake.base_url, OLLAMA_WORKERS=1, OLLAMA_COALESCE=False,
+                        OLLAMA_STREAM_RESUME_GRACE=0.2, OLLAMA_QUEUE_STATUS_INTERVAL=0.05)
+        with override_settings(**settings):
+            OllamaService.reset()
+            service = OllamaService()
+            busy = service.process_chat([], user=0)
+            next(busy)
+            try:
+                response = self.client.post('/api/chat/', data=json.dumps({'prompt': 'Hi'}),
+                                            content_type='application/json', headers={'Accept': 'text/event-stream'})
+                next(iter(response.streaming_content))
+                # The tab is closed while the chat waits for the worker
+                response.close()
+                self.assertEqual(service.pending(), 1)
+                deadline = time.monotonic() + 2
+                while service.pending() and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(service.pending(), 0)
+            finally:
+                busy.close()
+                OllamaService.reset()
@@ -15,7 +15,7 @@ class StreamingChatTests(TestCase):
         service_instance = MockService.return_value
         
         # Generator for process_chat
-        def mock_chat_generator(messages, model):
+        def mock_chat_generator(messages, model, **kwargs):
             yield "Hello"
             yield " "
             yield "World"
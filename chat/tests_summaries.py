@@ -0,0 +1,67 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+from fake_ollama import FakeOllama
+from .context import build_context
+from .models import Conversation, Message
+from .services import OllamaService
+from . import summaries
+
+@override_settings(
+    OLLAMA_SUMMARY_ENABLED=True, OLLAMA_CONTEXT_TOKENS={'*': 200},
+    OLLAMA_SUMMARY_TRIGGER_TOKENS=100, OLLAMA_SUMMARY_MAX_INPUT_TOKENS=1000,
+)
+class SummaryTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='summary', password='password')
+        self.conversation = Conversation.objects.create(user=user, title='long chat')
+        # 20 messages of 20 + 4 tokens each
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, role='user' if i % 2 == 0 else 'bot', content=f"{i:02d}" * 40)
+            for i in range(20)
+        ]
+        self.fake = FakeOllama(tokens=["The user ", "counted to twenty."]).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url)
+        self.override.enable()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def test_pending_messages_leave_the_recent_window_alone(self):
+        pending = summaries.pending_messages(self.conversation, 'm')
+        # Half of the 200 token budget stays verbatim: the newest 4 messages
+        self.assertEqual(pending, self.messages[:16])
+
+    def test_summarize_folds_older_messages(self):
+        service = OllamaService()
+        summaries.summarize(self.conversation.id, 'm', service.complete)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary, "The user counted to twenty.")
+        self.assertEqual(self.conversation.summary_until, self.messages[15].id)
+        prompt = self.fake.requests[0]['messages'][1]['content']
+        self.assertIn("00" * 40, prompt)
+        self.assertNotIn("16" * 40, prompt)
+
+        context = build_context(self.conversation, 'm')
+        self.assertEqual(context[0]['role'], 'system')
+        self.assertIn("counted to twenty", context[0]['content'])
+        self.assertEqual([m['content'] for m in context[1:]], [m.content for m in self.messages[16:]])
+
+        # Nothing new to fold until more turns accumulate
+        self.assertEqual(summaries.pending_messages(self.conversation, 'm'), [])
+
+    def test_request_summary_queues_one_background_job(self):
+        service = OllamaService()
+        with patch.object(service.scheduler, 'put') as put:
+            self.assertTrue(service.request_summary(self.conversation, 'm'))
+            self.assertFalse(service.request_summary(self.conversation, 'm'))
+        job = put.call_args[0][0]
+        self.assertEqual((job['type'], job['priority']), ('summarize', 'background'))
+
+    @override_settings(OLLAMA_SUMMARY_ENABLED=False)
+    def test_disabled(self):
+        self.assertFalse(OllamaService().request_summary(self.conversation, 'm'))
@@ -0,0 +1,85 @@
+from django.test import SimpleTestCase, override_settings
+from fake_ollama import FakeOllama
+from .async_services import AsyncOllamaService
+from .services import OllamaService
+from .tests_metrics import unused_port
+import asyncio
+import httpx
+import time
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["Hello", " ", "World"]).start()
+        self.override = override_settings(OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_RETRIES=2)
+        self.override.enable()
+        OllamaService.reset()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.override.disable()
+        self.fake.stop()
+
+    def test_connections_are_reused(self):
+        service = OllamaService()
+        for _ in range(5):
+            self.assertEqual("".join(service.process_chat([])), "Hello World")
+        self.assertEqual(service.get_available_models(), ["llama3.1:8b"])
+
+        stats = service.pool_stats()[self.fake.base_url]
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['requests'], 6)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_session_settings(self):
+        with override_settings(OLLAMA_CONNECT_TIMEOUT=1, OLLAMA_READ_TIMEOUT=30, OLLAMA_POOL_SIZE=3):
+            OllamaService.reset()
+            service = OllamaService()
+            adapter = service.session.get_adapter(self.fake.base_url)
+
+            self.assertEqual(service.timeout, (1, 30))
+            self.assertEqual(adapter._pool_maxsize, 3)
+            self.assertEqual(adapter.max_retries.connect, 2)
+            self.assertEqual(adapter.max_retries.read, 0)
+
+    async def test_async_connections_are_reused(self):
+        await AsyncOllamaService.reset()
+        service = AsyncOllamaService()
+        for _ in range(3):
+            self.assertEqual("".join([chunk async for chunk in service.process_chat([])]), "Hello World")
+
+        stats = service.pool_stats()[self.fake.base_url]
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['requests'], 3)
+        await AsyncOllamaService.reset()
+
+    async def test_async_stats_are_per_host(self):
+        other = FakeOllama(tokens=["Hi"] * 5, delay=0.02).start()
+        self.addCleanup(other.stop)
+        self.fake.delay = 0.02
+
+        async def chat(service):
+            return [chunk async for chunk in service.process_chat([])]
+
+        with override_settings(OLLAMA_BASE_URLS=[self.fake.base_url, other.base_url], OLLAMA_WORKERS=2):
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            # Two chats at once go to different hosts
+            await asyncio.gather(chat(service), chat(service))
+
+            stats = service.pool_stats()
+            self.assertEqual(set(stats), {self.fake.base_url, other.base_url})
+            for fake in (self.fake, other):
+                self.assertEqual(stats[fake.base_url]['requests'], len(fake.requests))
+                self.assertEqual(stats[fake.base_url]['connections'], 1)
+            await AsyncOllamaService.reset()
+
+    async def test_async_connect_retries_back_off(self):
+        with override_settings(OLLAMA_BASE_URL=f"http://127.0.0.1:{unused_port()}", OLLAMA_RETRY_BACKOFF=0.1):
+            await AsyncOllamaService.reset()
+            service = AsyncOllamaService()
+            started = time.monotonic()
+            with self.assertRaises(httpx.ConnectError):
+                [chunk async for chunk in service.process_chat([])]
+            # OLLAMA_RETRIES=2: waits 0.1s, then 0.2s
+            self.assertGreaterEqual(time.monotonic() - started, 0.3)
+            await AsyncOllamaService.reset()
@@ -0,0 +1,103 @@
+from django.test import SimpleTestCase, override_settings
+from fake_ollama import FakeOllama
+from .services import OllamaService
+import queue
+import threading
+import time
+
+class WorkerPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.fake = FakeOllama(tokens=["a", "b", "c", "d"], delay=0.05).start()
+
+    def tearDown(self):
+        OllamaService.reset()
+        self.fake.stop()
+
+    def run_jobs(self, models, **overrides):
+        """Submits one chat per entry in `models`; returns the wall time, outputs and finish times."""
+        results = {}
+        finished = {}
+
+        with override_settings(
+            OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_QUEUE_SIZE=50,
+            OLLAMA_USER_QUEUE_SIZE=None, OLLAMA_COALESCE=False, **overrides
+        ):
+            OllamaService.reset()
+            service = OllamaService()
+
+            def consume(i, generator):
+                results[i] = "".join(chunk for chunk in generator if isinstance(chunk, str))
+                finished[i] = time.time() - start
+
+            start = time.time()
+            threads = []
+            for i, model in enumerate(models):
+                generator = service.process_chat([{'role': 'user', 'content': 'Hi'}], model=model)
+                thread = threading.Thread(target=consume, args=(i, generator))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join(10)
+            return time.time() - start, results, finished
+
+    def test_throughput_rises_with_worker_count(self):
+        models = ["llama3.1:8b"] * 8
+        single, results, _ = self.run_jobs(models, OLLAMA_WORKERS=1)
+        self.assertEqual(set(results.values()), {"abcd"})
+
+        pooled, results, _ = self.run_jobs(models, OLLAMA_WORKERS=4)
+        self.assertEqual(set(results.values()), {"abcd"})
+
+        self.assertEqual(self.fake.max_active, 4)
+        self.assertGreater(len(models) / pooled, 2 * len(models) / single)
+
+    def test_model_limit_does_not_starve_other_models(self):
+        models = ["big"] * 4 + ["small"]
+        elapsed, results, finished = self.run_jobs(
+            models, OLLAMA_WORKERS=3, OLLAMA_MODEL_CONCURRENCY={'big': 1}
+        )
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.fake.max_active_by_model['big'], 1)
+        # "small" ran alongside the big jobs instead of waiting behind all four
+        self.assertLess(finished[4], finished[3])
+        self.assertLess(finished[4], elapsed / 2)
+
+    def test_jobs_waiting_for_a_model_count_against_queue_size(self):
+        with override_settings(
+            OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=2,
+            OLLAMA_QUEUE_SIZE=1, OLLAMA_MODEL_CONCURRENCY={'*': 1},
+            OLLAMA_COALESCE=False,
+        ):
+            OllamaService.reset()
+            service = OllamaService()
+            generators = [service.process_chat([], model="big")]
+            # Wait for the first job to start so the queue is empty again
+            while self.fake.active == 0:
+                time.sleep(0.01)
+            generators.append(service.process_chat([], model="big"))
+
+            # The second job stays queued although a worker is idle
+            time.sleep(0.05)
+            self.assertEqual(service.pending(), 1)
+            with self.assertRaises(queue.Full):
+                service.process_chat([], model="big")
+
+            for generator in generators:
+                chunks = list(generator)
+                self.assertEqual("".join(c for c in chunks if isinstance(c, str)), "abcd")
+
+    def test_queued_requests_get_position_updates(self):
+        with override_settings(
+            OLLAMA_BASE_URL=self.fake.base_url, OLLAMA_WORKERS=1,
+            OLLAMA_QUEUE_STATUS_INTERVAL=0.05, OLLAMA_COALESCE=False,
+        ):
+            OllamaService.reset()
+            service = OllamaService()
+            first = service.process_chat([], user=1)
+            second = service.process_chat([], user=2)
+
+            chunks = list(second)
+            self.assertEqual(chunks[0], {'queue': {'position': 1, 'eta': None}})
+            self.assertEqual("".join(c for c in chunks if isinstance(c, str)), "abcd")
+            self.assertEqual("".join(first), "abcd")
@@ -0,0 +1,59 @@
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def get_timeout():
+    """(connect, read) timeout for calls to Ollama."""
+    return (
+        getattr(settings, 'OLLAMA_CONNECT_TIMEOUT', 3.05),
+        getattr(settings, 'OLLAMA_READ_TIMEOUT', 300),
+    )
+
+def build_session():
+    """
+    Returns a requests.Session with a keep-alive connection pool to Ollama.
+
+    Only connection errors are retried (with exponential backoff): a request
+    that failed to connect never reached Ollama, so retrying it is safe even
+    for POST. Read errors and HTTP error statuses are returned as-is.
+    """
+    retries = getattr(settings, 'OLLAMA_RETRIES', 3)
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=getattr(settings, 'OLLAMA_RETRY_BACKOFF', 0.2),
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    pool_size = getattr(settings, 'OLLAMA_POOL_SIZE', 10)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def pool_stats(session):
+    """
+    Per-host connection pool counters for `session`:
+    connections opened, requests sent over them, and idle connections.
+    """
+    stats = {}
+    for prefix, adapter in session.adapters.items():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            stats[host] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None),
+                'maxsize': pool.pool.maxsize,
+            }
+    return stats
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -6,7 +7,13 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
-    path('api/chat/', views.api_chat, name='api_chat'),
+    path('api/chat/', views.api_chat_async if settings.OLLAMA_ASYNC_CHAT else views.api_chat, name='api_chat'),
+    path('api/chat/streams/<str:stream_id>/',
+         views.api_chat_stream_async if settings.OLLAMA_ASYNC_CHAT else views.api_chat_stream,
+         name='api_chat_stream'),
+    path('api/conversations/', views.get_conversations, name='get_conversations'),
     path('api/messages/<int:conversation_id>/', views.get_messages, name='get_messages'),
     path('api/models/', views.get_models, name='get_models'),
+    path('api/search/', views.search_messages, name='search_messages'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
@@ -1,14 +1,29 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, StreamingHttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from asgiref.sync import sync_to_async
+from contextlib import aclosing, closing
+import hashlib
 import json
 import queue
+import time
+from .context import build_context
+from .deadlines import DeadlineExceeded
+from .persistence import get_writer
 from .services import OllamaService
+from .summaries import summaries_enabled
+from .async_services import AsyncOllamaService
 from .models import Conversation, Message
+from .pagination import KeysetPaginator
+from . import metrics, search, streams
 
 def register(request):
     if request.method == "POST":
@@ -35,24 +50,288 @@ def logout_view(request):
     logout(request)
     return redirect('login')
 
+# Conversations per sidebar page
+CONVERSATIONS_PAGE = 30
+CONVERSATIONS_PAGE_MAX = 100
+
+def _conversations(user):
+    return KeysetPaginator(
+        Conversation.objects.filter(user=user).only('id', 'title', 'updated_at'),
+        ('updated_at', 'id'), descending=True,
+    )
+
 @login_required
 def index(request):
-    conversations = request.user.conversations.all()
-    return render(request, 'chat/index.html', {'conversations': conversations})
+    # Only the first page; the sidebar fetches the rest as it is scrolled
+    conversations, _, next_cursor = _conversations(request.user).page(CONVERSATIONS_PAGE)
+    return render(request, 'chat/index.html', {
+        'conversations': conversations,
+        'next_cursor': next_cursor,
+        'conversation_count': Conversation.count_for(request.user.id),
+    })
+
+@login_required
+def get_conversations(request):
+    """
+    A page of the user's conversations, most recently updated first.
+    Pass the previous page's 'next' as ?after= for the following one.
+    """
+    try:
+        limit = int(request.GET.get('limit', CONVERSATIONS_PAGE))
+        if not 1 <= limit <= CONVERSATIONS_PAGE_MAX:
+            raise ValueError(limit)
+        conversations, _, next_cursor = _conversations(request.user).page(limit, after=request.GET.get('after'))
+    except ValueError:  # including InvalidCursor
+        return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+    return JsonResponse({
+        'conversations': [
+            {'id': c.id, 'title': c.title, 'updated_at': c.updated_at.isoformat()}
+            for c in conversations
+        ],
+        'next': next_cursor,
+        'count': Conversation.count_for(request.user.id),
+    })
+
+# Largest page get_messages returns
+MESSAGES_PAGE_MAX = 200
+
+def _message_json(message):
+    return {
+        'id': message.id,
+        'role': message.role,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+    }
 
 @login_required
 def get_messages(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
-    messages = conversation.messages.all()
+    """
+    A conversation's messages, oldest first.
+
+    ?limit=N returns a page: the first N messages, or the N after or before
+    a cursor passed as ?after= or ?before= (a previous page's 'next' or
+    'prev'). ?latest=N returns the newest N, for a quick first render.
+    Without either, all messages are returned. ?format=ndjson streams them
+    all, one JSON object per line, for exports.
+
+    Every message write bumps the conversation's updated_at, which the ETag
+    and Last-Modified headers are derived from, so polling an unchanged
+    conversation gets a 304.
+    """
+    conversation = get_object_or_404(
+        Conversation.objects.only('id', 'updated_at'), id=conversation_id, user=request.user
+    )
+    version = f"{conversation.id}:{conversation.updated_at.isoformat()}:{request.GET.urlencode()}"
+    etag = quote_etag(hashlib.sha1(version.encode('utf-8')).hexdigest())
+    last_modified = int(conversation.updated_at.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            response = _messages_response(request, conversation)
+        except ValueError:  # including InvalidCursor
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def _messages_response(request, conversation):
+    rows = Message.objects.filter(conversation_id=conversation.id)
+
+    if request.GET.get('format') == 'ndjson':
+        rows = rows.order_by('created_at', 'id').only('id', 'role', 'content', 'created_at')
+
+        def export():
+            for message in rows.iterator(chunk_size=500):
+                yield json.dumps(_message_json(message)) + "\n"
+
+        response = StreamingHttpResponse(export(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="conversation-{conversation.id}.ndjson"'
+        return response
+
+    latest = request.GET.get('latest')
+    limit = request.GET.get('limit', latest)
+    if limit is None:
+        messages = rows.order_by('created_at', 'id').only('id', 'role', 'content', 'created_at')
+        return JsonResponse({'messages': [_message_json(m) for m in messages]})
+
+    limit = int(limit)
+    if not 1 <= limit <= MESSAGES_PAGE_MAX:
+        raise ValueError(limit)
+    paginator = KeysetPaginator(rows.only('id', 'role', 'content', 'created_at'), ('created_at', 'id'))
+    messages, prev_cursor, next_cursor = paginator.page(
+        limit, after=request.GET.get('after'), before=request.GET.get('before'), tail=latest is not None,
+    )
     return JsonResponse({
-        'messages': [{'role': m.role, 'content': m.content} for m in messages]
+        'messages': [_message_json(m) for m in messages],
+        'prev': prev_cursor,
+        'next': next_cursor,
     })
 
+# Most results /api/search/ returns
+SEARCH_LIMIT_MAX = 50
+
+@login_required
+def search_messages(request):
+    """
+    The user's messages matching ?q=, best match first, with a highlighted
+    snippet each. ?limit= caps the results (default 20).
+    """
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+    return JsonResponse({'results': search.search_messages(request.GET.get('q', ''), request.user.id, limit)})
+
 @login_required
 def get_models(request):
     service = OllamaService()
-    models = service.get_available_models()
-    return JsonResponse({'models': models})
+    catalog = service.catalog.get()
+    # Models loaded on some host, which answer without a cold load
+    warm = [model for model in service.residency.warm() if model in catalog['models']]
+    etag = None
+    if catalog['etag']:
+        etag = quote_etag(hashlib.sha1(json.dumps([catalog['etag'], warm]).encode('utf-8')).hexdigest())
+    last_modified = catalog['last_modified']
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse({'models': catalog['models'], 'warm': warm})
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    # Let the browser keep the list but revalidate it on every load
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Generation pipeline metrics in the Prometheus text format. Open to staff
+    sessions, and to scrapers sending "Authorization: Bearer
+    <OLLAMA_METRICS_TOKEN>".
+    """
+    token = getattr(settings, 'OLLAMA_METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(authorization, f"Bearer {token}")) and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+def _new_title(prompt):
+    return (prompt[:30] + '...') if len(prompt) > 30 else prompt
+
+def _priority(user):
+    return 'staff' if user.is_staff else 'default'
+
+def _error(e):
+    """The event telling the client its answer failed."""
+    data = {'error': str(e)}
+    if isinstance(e, DeadlineExceeded):
+        data['deadline'] = e.stage
+    return data
+
+def _metadata(conversation):
+    return {
+        'conversation_id': conversation.id,
+        'title': conversation.title
+    }
+
+class _Checkpoint:
+    """
+    Saves a streaming bot reply every OLLAMA_CHECKPOINT_INTERVAL seconds
+    while it is generated, so a stream that is cut short still leaves what
+    was generated so far in the conversation.
+    """
+
+    def __init__(self, writer, message):
+        self.writer = writer
+        self.message = message
+        self.interval = getattr(settings, 'OLLAMA_CHECKPOINT_INTERVAL', None)
+        self.last = time.monotonic()
+        self.done = False
+        self.saved_chunks = 0
+
+    def due(self, chunks):
+        return (
+            not self.done and self.interval is not None and len(chunks) > self.saved_chunks
+            and time.monotonic() - self.last >= self.interval
+        )
+
+    def pending(self, chunks, final):
+        # The final save always happens; partial ones only if there is news
+        return not self.done and (final or len(chunks) > self.saved_chunks)
+
+    def _prepare(self, chunks, final):
+        self.message.content = "".join(chunks)
+        self.saved_chunks = len(chunks)
+        self.last = time.monotonic()
+        self.done = final
+
+    def maybe_save(self, chunks):
+        if self.due(chunks):
+            self.save(chunks)
+
+    def save(self, chunks, final=False):
+        if self.pending(chunks, final):
+            self._prepare(chunks, final)
+            self.writer.save(self.message)
+
+    async def amaybe_save(self, chunks):
+        if self.due(chunks):
+            await self.asave(chunks)
+
+    async def asave(self, chunks, final=False):
+        if self.pending(chunks, final):
+            self._prepare(chunks, final)
+            await self.writer.asave(self.message)
+
+def _streaming_response(content, content_type):
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['X-Accel-Buffering'] = 'no'  # Disable buffering in Nginx/proxies
+    response['Cache-Control'] = 'no-cache'  # Ensure no caching
+    return response
+
+def _ndjson(events):
+    # Closing the response (the client went away) closes the events too
+    with closing(events):
+        for data in events:
+            yield json.dumps(data) + "\n"
+
+async def _andjson(events):
+    async with aclosing(events):
+        async for data in events:
+            yield json.dumps(data) + "\n"
+
+def _chat_response(request, user_id, conversation, stream, is_async=False, cancel=None):
+    """
+    Streams the events (dicts) of stream(metadata), a generator yielding the
+    metadata it is given first, one JSON object per line. Clients sending
+    "Accept: text/event-stream" get Server-Sent Events instead: the metadata
+    carries a 'stream_id', each event has an id, a {'done': true} event ends
+    a complete answer, and a comment is sent every OLLAMA_SSE_HEARTBEAT
+    seconds while the generation is quiet. The generation then runs in the
+    background into a StreamBuffer, so a client whose connection dropped can
+    pick up where it left off from /api/chat/streams/<stream_id>/ (see
+    api_chat_stream). Once no one has followed it for
+    OLLAMA_STREAM_RESUME_GRACE seconds it is stopped, with `cancel` for a
+    threaded one (see streams.produce).
+    """
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        content = (_andjson if is_async else _ndjson)(stream(_metadata(conversation)))
+        return _streaming_response(content, 'application/x-ndjson')
+
+    buffer = streams.get_streams().open(user_id)
+    events = stream({**_metadata(conversation), 'stream_id': buffer.id})
+    if is_async:
+        streams.aproduce(buffer, events)
+        content = streams.afollow(buffer)
+    else:
+        streams.produce(buffer, events, cancel)
+        content = streams.follow(buffer)
+    return _streaming_response(content, 'text/event-stream')
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -63,61 +342,191 @@ def api_chat(request):
         prompt = data.get('prompt')
         conversation_id = data.get('conversation_id')
         model_name = data.get('model', 'llama3.1:8b')
+        options = data.get('options')
 
         if not prompt:
             return JsonResponse({'error': 'Prompt is required'}, status=400)
+        if options is not None and not isinstance(options, dict):
+            return JsonResponse({'error': 'Options must be an object'}, status=400)
 
         # Get or create conversation
         if conversation_id:
             conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
         else:
             # Create new conversation
-            title = (prompt[:30] + '...') if len(prompt) > 30 else prompt
-            conversation = Conversation.objects.create(user=request.user, title=title)
+            conversation = Conversation.objects.create(user=request.user, title=_new_title(prompt))
         
-        # Save User Message
-        Message.objects.create(conversation=conversation, role='user', content=prompt)
-
-        # Prepare context (last 10 messages)
-        # Ollama expects 'assistant' for bot role
-        recent_messages = conversation.messages.order_by('-created_at')[:10]
-        # Reverse to get chronological order
-        context_messages = []
-        for msg in reversed(recent_messages):
-            role = 'assistant' if msg.role == 'bot' else 'user'
-            context_messages.append({'role': role, 'content': msg.content})
+        # Prepare context (newest messages that fit the model's token budget),
+        # then save the user message. With write-behind persistence it may not
+        # be in the database yet, so it is passed along explicitly.
+        writer = get_writer()
+        writer.wait_for(conversation.id)
+        user_message = Message(conversation=conversation, role='user', content=prompt)
+        context_messages = build_context(conversation, model_name, pending=[user_message])
+        writer.save(user_message)
         
         service = OllamaService()
         try:
-            chat_generator = service.process_chat(context_messages, model=model_name)
+            chat_generator = service.process_chat(
+                context_messages, model=model_name,
+                user=request.user.id, priority=_priority(request.user),
+                options=options,
+            )
         except queue.Full:
+            metrics.REQUESTS.inc(model=model_name, outcome='rejected')
             return JsonResponse({'error': 'Server is busy, please try again later.'}, status=409)
 
-        def stream_response():
-            # Yield metadata first
-            yield json.dumps({
-                'conversation_id': conversation.id,
-                'title': conversation.title
-            }) + "\n"
-            
+        def stream_response(metadata):
+            bot_message = Message(conversation=conversation, role='bot', content="")
+            checkpoint = _Checkpoint(writer, bot_message)
             full_response = []
             try:
+                # Inside the try, so a client leaving after this line still
+                # cancels the generation
+                yield metadata
                 for chunk in chat_generator:
+                    if isinstance(chunk, dict):
+                        # Queue position/ETA while waiting for a worker
+                        yield chunk
+                        continue
                     full_response.append(chunk)
-                    yield json.dumps({'content': chunk}) + "\n"
+                    yield {'content': chunk}
+                    checkpoint.maybe_save(full_response)
                 
                 # Save Bot Message after full response is received
-                Message.objects.create(conversation=conversation, role='bot', content="".join(full_response))
+                checkpoint.save(full_response, final=True)
+                service.request_summary(conversation, model_name)
                 
             except Exception as e:
-                yield json.dumps({'error': str(e)}) + "\n"
+                yield _error(e)
+            finally:
+                # Keep what was generated if the stream was cut short
+                checkpoint.save(full_response)
+                # If the client went away mid-stream, this cancels the generation
+                chat_generator.close()
 
-        response = StreamingHttpResponse(stream_response(), content_type='text/event-stream')
-        response['X-Accel-Buffering'] = 'no'  # Disable buffering in Nginx/proxies
-        response['Cache-Control'] = 'no-cache'  # Ensure no caching
-        return response
+        # A cached answer replays without waiting, so it needs no cancel()
+        cancel = getattr(chat_generator, 'cancel', None)
+        return _chat_response(request, request.user.id, conversation, stream_response, cancel=cancel)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@login_required
+async def api_chat_async(request):
+    """
+    Same contract as api_chat, but streams from AsyncOllamaService so an
+    open generation costs a coroutine instead of a thread. Used for
+    /api/chat/ when served through ASGI (see OLLAMA_ASYNC_CHAT).
+    """
+    try:
+        data = json.loads(request.body)
+        prompt = data.get('prompt')
+        conversation_id = data.get('conversation_id')
+        model_name = data.get('model', 'llama3.1:8b')
+        options = data.get('options')
+
+        if not prompt:
+            return JsonResponse({'error': 'Prompt is required'}, status=400)
+        if options is not None and not isinstance(options, dict):
+            return JsonResponse({'error': 'Options must be an object'}, status=400)
+
+        user = await request.auser()
+        if conversation_id:
+            try:
+                conversation = await Conversation.objects.aget(id=conversation_id, user=user)
+            except Conversation.DoesNotExist:
+                raise Http404("No Conversation matches the given query.")
+        else:
+            conversation = await Conversation.objects.acreate(user=user, title=_new_title(prompt))
+
+        writer = get_writer()
+        await writer.await_for(conversation.id)
+        user_message = Message(conversation=conversation, role='user', content=prompt)
+        context_messages = await sync_to_async(build_context)(conversation, model_name, pending=[user_message])
+        await writer.asave(user_message)
+
+        service = AsyncOllamaService()
+        try:
+            chat_generator = service.process_chat(
+                context_messages, model=model_name,
+                user=user.id, priority=_priority(user),
+                options=options,
+            )
+        except queue.Full:
+            metrics.REQUESTS.inc(model=model_name, outcome='rejected')
+            return JsonResponse({'error': 'Server is busy, please try again later.'}, status=409)
+
+        async def stream_response(metadata):
+            bot_message = Message(conversation=conversation, role='bot', content="")
+            checkpoint = _Checkpoint(writer, bot_message)
+            full_response = []
+            try:
+                yield metadata
+                async for chunk in chat_generator:
+                    if isinstance(chunk, dict):
+                        yield chunk
+                        continue
+                    full_response.append(chunk)
+                    yield {'content': chunk}
+                    await checkpoint.amaybe_save(full_response)
+
+                await checkpoint.asave(full_response, final=True)
+                if summaries_enabled():
+                    # Summaries run on the threaded service's queue at background priority
+                    await sync_to_async(OllamaService().request_summary)(conversation, model_name)
+
+            except Exception as e:
+                yield _error(e)
+            finally:
+                await checkpoint.asave(full_response)
+                # Closes the upstream stream if the client disconnected
+                await chat_generator.aclose()
+
+        return _chat_response(request, user.id, conversation, stream_response, is_async=True)
 
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Http404:
+        raise
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+def _last_event_id(request):
+    return int(request.headers.get('Last-Event-ID', request.GET.get('last_event_id', -1)))
+
+@require_http_methods(["GET"])
+@login_required
+def api_chat_stream(request, stream_id):
+    """
+    Resumes an /api/chat/ Server-Sent Events stream: replays the events
+    after the Last-Event-ID header (or ?last_event_id=), then follows the
+    generation if it is still running. Streams are kept in the process that
+    served them, for OLLAMA_STREAM_BUFFER_TTL seconds after they finish.
+    """
+    buffer = streams.get_streams().get(stream_id, request.user.id)
+    if buffer is None:
+        raise Http404("No such stream.")
+    try:
+        after = _last_event_id(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+    return _streaming_response(streams.follow(buffer, after), 'text/event-stream')
+
+@require_http_methods(["GET"])
+@login_required
+async def api_chat_stream_async(request, stream_id):
+    """api_chat_stream for ASGI, following the stream without holding a thread."""
+    user = await request.auser()
+    buffer = streams.get_streams().get(stream_id, user.id)
+    if buffer is None:
+        raise Http404("No such stream.")
+    try:
+        after = _last_event_id(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=400)
+    return _streaming_response(streams.afollow(buffer, after), 'text/event-stream')
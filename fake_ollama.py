@@ -0,0 +1,194 @@
+import json
+import select
+import socket
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllama:
+    """
+    Minimal stand-in for an Ollama server, used by tests and benchmarks.
+
+    Streams `tokens` for every /api/chat request, sleeping `delay` seconds
+    between tokens (and `stall` seconds after the first one), and records
+    how many requests were running at once and when clients hung up. Models
+    it has served are listed as loaded by /api/ps, `model_size` bytes each,
+    until a chat with keep_alive 0 unloads them; set `fail_status` to answer
+    /api/chat with that HTTP status instead.
+    """
+
+    def __init__(self, tokens=("Hello", " ", "World"), delay=0.0, models=("llama3.1:8b",), stall=0.0, loaded=()):
+        self.tokens = list(tokens)
+        self.delay = delay
+        self.stall = stall
+        self.models = list(models)
+        self.loaded = list(loaded)
+        self.model_size = 1 << 30
+        self.fail_status = None
+        self.requests = []
+        self.disconnects = []
+        self.active = 0
+        self.max_active = 0
+        self.active_by_model = defaultdict(int)
+        self.max_active_by_model = defaultdict(int)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(_FakeOllamaHandler):
+            server_fake = fake
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _enter(self, model):
+        with self._lock:
+            self.active += 1
+            self.active_by_model[model] += 1
+            self.max_active = max(self.max_active, self.active)
+            self.max_active_by_model[model] = max(self.max_active_by_model[model], self.active_by_model[model])
+
+    def _leave(self, model):
+        with self._lock:
+            self.active -= 1
+            self.active_by_model[model] -= 1
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _sleep(self, seconds):
+        """Sleeps, but raises ConnectionResetError as soon as the client hangs up."""
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            readable, _, _ = select.select([self.connection], [], [], remaining)
+            if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                raise ConnectionResetError
+
+    def _write_chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        fake = self.server_fake
+        if self.path == "/api/tags":
+            self._send_json({'models': [{'name': name} for name in fake.models]})
+        elif self.path == "/api/ps":
+            self._send_json({'models': [{'name': name, 'model': name, 'size': fake.model_size} for name in fake.loaded]})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        fake = self.server_fake
+        if self.path != "/api/chat":
+            self._send_json({'error': 'not found'}, status=404)
+            return
+
+        payload = self._read_json()
+        model = payload.get('model')
+        with fake._lock:
+            fake.requests.append(payload)
+        if fake.fail_status:
+            self._send_json({'error': 'failed'}, status=fake.fail_status)
+            return
+        if payload.get('keep_alive') == 0 and not payload.get('messages'):
+            with fake._lock:
+                if model in fake.loaded:
+                    fake.loaded.remove(model)
+            self._send_json({'model': model, 'done': True, 'done_reason': 'unload'})
+            return
+        with fake._lock:
+            if model not in fake.loaded:
+                fake.loaded.append(model)
+
+        if payload.get('stream') is False:
+            self._send_json({
+                'model': model,
+                'message': {'role': 'assistant', 'content': "".join(fake.tokens)},
+                'done': True,
+            })
+            return
+
+        fake._enter(model)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            started = time.monotonic_ns()
+            for i, token in enumerate(fake.tokens):
+                if fake.delay:
+                    self._sleep(fake.delay)
+                if i == 1 and fake.stall:
+                    self._sleep(fake.stall)
+                self._write_chunk({
+                    'model': model,
+                    'message': {'role': 'assistant', 'content': token},
+                    'done': False,
+                })
+            # Ollama's final message carries its timings, in nanoseconds
+            prompt = sum(len(m.get('content', '').split()) for m in payload.get('messages', []))
+            self._write_chunk({
+                'model': model,
+                'done': True,
+                'prompt_eval_count': prompt,
+                'prompt_eval_duration': 1_000_000 * prompt,
+                'eval_count': len(fake.tokens),
+                'eval_duration': max(1, time.monotonic_ns() - started),
+            })
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            with fake._lock:
+                fake.disconnects.append(time.monotonic())
+        finally:
+            fake._leave(model)
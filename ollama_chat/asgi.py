@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ollama_chat.settings')
+# Serve /api/chat/ from the asyncio streaming view under ASGI
+os.environ.setdefault('OLLAMA_ASYNC_CHAT', '1')
 
 application = get_asgi_application()
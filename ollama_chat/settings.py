@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -75,12 +76,52 @@ WSGI_APPLICATION = 'ollama_chat.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default. Every connection switches to WAL (readers no longer block
+# the writer), waits up to `timeout` seconds for a lock instead of failing
+# with "database is locked", only fsyncs at checkpoints (synchronous=NORMAL
+# is still safe in WAL mode) and memory-maps the first 256MB. Write
+# transactions take the lock up front (IMMEDIATE), so two of them can't
+# deadlock upgrading from a read lock.
+#
+# Set DB_ENGINE=postgres (and DB_NAME, DB_USER, DB_PASSWORD, DB_HOST,
+# DB_PORT) to use PostgreSQL. Connections come from a psycopg pool of up to
+# DB_POOL_SIZE (needs psycopg[pool]); DB_POOL_SIZE=0 keeps one persistent
+# connection per thread for DB_CONN_MAX_AGE seconds instead.
+if os.environ.get('DB_ENGINE') == 'postgres':
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '20'))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'ollama_chat'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            # Pooled connections must not also be persistent
+            'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {'min_size': 2, 'max_size': DB_POOL_SIZE, 'timeout': 10},
+            } if DB_POOL_SIZE else {},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA mmap_size=268435456;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -146,3 +187,168 @@ JAZZMIN_SETTINGS = {
         "chat.Message": "fas fa-comment-dots",
     },
 }
+
+# Ollama backend
+OLLAMA_BASE_URL = "http://localhost:11434"
+
+# Several Ollama hosts to spread chats over (comma-separated in the env);
+# empty means just OLLAMA_BASE_URL. Requests go to the least busy host,
+# preferring hosts that already have the model loaded. A host failing
+# OLLAMA_CIRCUIT_FAILURES times in a row gets no requests for
+# OLLAMA_CIRCUIT_COOLDOWN seconds; /api/ps is polled every
+# OLLAMA_HEALTH_INTERVAL seconds (0 to disable) to notice recoveries and
+# loaded models.
+OLLAMA_BASE_URLS = [url for url in os.environ.get('OLLAMA_BASE_URLS', '').split(',') if url]
+OLLAMA_HEALTH_INTERVAL = 10
+OLLAMA_CIRCUIT_FAILURES = 3
+OLLAMA_CIRCUIT_COOLDOWN = 30
+
+# Model residency. OLLAMA_PRELOAD_MODELS are loaded in the background when
+# a process first uses the Ollama service (its first chat or model list),
+# not at import, so migrate, tests and forked workers start no threads. They
+# are pinned (keep_alive -1 on the load and on every chat). A model with
+# OLLAMA_HOT_REQUESTS chats in the last OLLAMA_HOT_WINDOW seconds is sent
+# with keep_alive OLLAMA_KEEP_ALIVE_HOT; others with OLLAMA_KEEP_ALIVE_COLD
+# (None for Ollama's default). After each health check, hosts with more
+# than OLLAMA_MAX_LOADED_MODELS models or OLLAMA_MAX_LOADED_BYTES of them
+# (None for no limit) have their least recently used cold models unloaded.
+OLLAMA_PRELOAD_MODELS = [model for model in os.environ.get('OLLAMA_PRELOAD_MODELS', '').split(',') if model]
+OLLAMA_KEEP_ALIVE_HOT = '30m'
+OLLAMA_KEEP_ALIVE_COLD = None
+OLLAMA_HOT_REQUESTS = 3
+OLLAMA_HOT_WINDOW = 600
+OLLAMA_MAX_LOADED_MODELS = None
+OLLAMA_MAX_LOADED_BYTES = None
+
+# Keep-alive connection pool to Ollama. Connection errors are retried
+# OLLAMA_RETRIES times with exponential backoff; timeouts are in seconds
+# (the read timeout is the longest gap allowed between streamed bytes).
+OLLAMA_POOL_SIZE = 10
+OLLAMA_CONNECT_TIMEOUT = 3.05
+OLLAMA_READ_TIMEOUT = 300
+OLLAMA_RETRIES = 3
+OLLAMA_RETRY_BACKOFF = 0.2
+
+# The model list from /api/tags is cached for OLLAMA_MODELS_TTL seconds, then
+# served stale for up to OLLAMA_MODELS_STALE_TTL more while it refreshes in
+# the background. Name a CACHES alias in OLLAMA_MODELS_CACHE to share it
+# between processes.
+OLLAMA_MODELS_TTL = 30
+OLLAMA_MODELS_STALE_TTL = 300
+OLLAMA_MODELS_CACHE = None
+
+# Queueing policy for chat jobs. FairScheduler serves OLLAMA_PRIORITIES in
+# order (most urgent first) and round-robins between users inside each
+# class; chat.scheduler.FIFOScheduler is plain first come, first served.
+OLLAMA_SCHEDULER = 'chat.scheduler.FairScheduler'
+OLLAMA_PRIORITIES = ['staff', 'default', 'background']
+
+# Prompt token budget per model ("*" for the rest). api_chat sends the newest
+# messages that fit; keep it below the model's num_ctx minus the room the
+# answer needs.
+OLLAMA_CONTEXT_TOKENS = {'*': 2048}
+
+# Rolling conversation summaries. When messages older than the recent window
+# (half the context budget) add up to OLLAMA_SUMMARY_TRIGGER_TOKENS, a
+# background-priority job folds them into Conversation.summary, which is then
+# sent in their place. OLLAMA_SUMMARY_MODEL defaults to the chat's model.
+OLLAMA_SUMMARY_ENABLED = False
+OLLAMA_SUMMARY_MODEL = None
+OLLAMA_SUMMARY_TRIGGER_TOKENS = 1024
+OLLAMA_SUMMARY_MAX_INPUT_TOKENS = 4096
+
+# Write chat messages from a background thread in batches instead of on the
+# request path. Queued messages are lost if the process is killed before the
+# next flush (at most OLLAMA_WRITE_BEHIND_INTERVAL seconds); leave this off
+# when every message must be committed before the stream moves on.
+OLLAMA_WRITE_BEHIND = False
+OLLAMA_WRITE_BEHIND_BATCH = 100
+OLLAMA_WRITE_BEHIND_INTERVAL = 0.5
+
+# Login audit (UserLoginLog). With LOGIN_AUDIT_WRITE_BEHIND, logins are
+# buffered and written by a background thread in batches, off the login
+# request; buffered rows are lost if the process is killed before the next
+# flush. `manage.py rollup_logins`, run daily, folds rows older than
+# LOGIN_AUDIT_RETENTION_DAYS into per-user daily LoginDailyRollup rows.
+LOGIN_AUDIT_WRITE_BEHIND = False
+LOGIN_AUDIT_WRITE_BEHIND_BATCH = 500
+LOGIN_AUDIT_WRITE_BEHIND_INTERVAL = 1.0
+LOGIN_AUDIT_RETENTION_DAYS = 90
+
+# The sidebar's conversation count is cached per user and cleared when a
+# conversation is created or deleted. With a per-process cache (the default
+# LocMemCache) other processes only see the change once their entry is
+# CONVERSATION_COUNT_TTL seconds old.
+CONVERSATION_COUNT_TTL = 60
+
+# Seconds between saves of a bot reply while it streams; None saves it only
+# at the end (or when the stream is cut short)
+OLLAMA_CHECKPOINT_INTERVAL = 5
+
+# /api/chat/ as Server-Sent Events (Accept: text/event-stream): a comment is
+# sent every OLLAMA_SSE_HEARTBEAT seconds while the generation is quiet, so
+# idle proxies keep the connection. A generation keeps running for
+# OLLAMA_STREAM_RESUME_GRACE seconds after its client went away, and its
+# events are kept OLLAMA_STREAM_BUFFER_TTL seconds after it ends, for
+# clients resuming from Last-Event-ID.
+OLLAMA_SSE_HEARTBEAT = 15
+OLLAMA_STREAM_RESUME_GRACE = 30
+OLLAMA_STREAM_BUFFER_TTL = 60
+
+# Tokens streamed to clients are merged into frames: a token arriving
+# OLLAMA_STREAM_FLUSH_INTERVAL seconds or more after the last frame goes out
+# at once, faster ones are held until the interval has passed and sent
+# together, at most OLLAMA_STREAM_FRAME_CHARS characters a frame. 0 sends
+# every token on its own.
+OLLAMA_STREAM_FLUSH_INTERVAL = 0.03
+OLLAMA_STREAM_FRAME_CHARS = 1024
+
+# Per-model limits on a chat, in seconds from when it was queued (None for
+# no limit): 'queue' to be picked up by a worker, 'first_token' for its
+# first token and 'total' for the whole answer. Stages a model doesn't list
+# fall back to '*'. Past a limit the chat is cancelled and the client gets
+# an error event with 'deadline' set to the stage.
+OLLAMA_DEADLINES = {
+    '*': {'queue': 120, 'first_token': 300, 'total': 900},
+}
+
+# Chunks held for each client that reads slower than Ollama generates.
+# When the queue is full, the worker stops reading from Ollama until the
+# client catches up.
+OLLAMA_RESPONSE_QUEUE_SIZE = 256
+
+# Identical chat requests (same model, messages and options) arriving while
+# one is queued or running share its generation instead of queueing another
+OLLAMA_COALESCE = True
+
+# Opt-in cache of finished generations keyed by model, messages and options;
+# hits are replayed through the normal stream. With DETERMINISTIC_ONLY, only
+# requests with temperature 0 or a fixed seed are cached.
+OLLAMA_RESPONSE_CACHE = False
+OLLAMA_RESPONSE_CACHE_DETERMINISTIC_ONLY = False
+OLLAMA_RESPONSE_CACHE_TTL = 3600
+OLLAMA_RESPONSE_CACHE_ENTRIES = 256
+OLLAMA_RESPONSE_CACHE_BYTES = 16 * 1024 * 1024
+
+# Bearer token Prometheus sends to scrape /metrics (staff sessions need none)
+OLLAMA_METRICS_TOKEN = os.environ.get('OLLAMA_METRICS_TOKEN')
+
+# Jobs accepted before api_chat answers 409, in total and per user. Queued
+# clients get their position and ETA every OLLAMA_QUEUE_STATUS_INTERVAL
+# seconds.
+OLLAMA_QUEUE_SIZE = 20
+OLLAMA_USER_QUEUE_SIZE = 2
+OLLAMA_QUEUE_STATUS_INTERVAL = 1.0
+
+# Worker threads draining the queue. Match this to OLLAMA_NUM_PARALLEL on
+# the Ollama side; extra workers only queue up inside Ollama.
+OLLAMA_WORKERS = 1
+
+# Max concurrent generations per model, e.g. {"llama3.1:70b": 1}.
+# "*" sets the limit for models not listed; unlisted models are unlimited.
+OLLAMA_MODEL_CONCURRENCY = {}
+
+# Route /api/chat/ to the asyncio view (chat.views.api_chat_async, needs
+# httpx). It queues chats through OLLAMA_SCHEDULER like the threaded view.
+# ollama_chat/asgi.py turns this on; WSGI keeps the threaded view.
+OLLAMA_ASYNC_CHAT = os.environ.get('OLLAMA_ASYNC_CHAT') == '1'
@@ -39,7 +39,7 @@ def test_streaming_backend():
     
     from unittest.mock import patch, MagicMock
     
-    with patch('chat.services.requests.post') as mock_post:
+    with patch('chat.transport.requests.Session.post') as mock_post:
         def mock_iter_content(chunk_size=None):
             words = ["Hello", " ", "World", " ", "from", " ", "Ollama", "!"]
             for word in words: